@@ -1,22 +1,54 @@
+import argparse
 import getpass
+import hashlib
 import json
 import logging
 import os
+import subprocess
+import sys
+import threading
+import time
 import uuid
 
-from typing import List, Literal, Dict, Any, Annotated
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import List, Literal, Dict, Any, Annotated, Callable, NamedTuple, Optional, Tuple
 from typing_extensions import TypedDict
 
-from langchain_core.messages import SystemMessage, AIMessage, HumanMessage, ToolMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import SystemMessage, AIMessage, HumanMessage, ToolMessage, message_chunk_to_message
+from langchain_core.runnables import RunnableLambda
 
 from pydantic import BaseModel, Field, ValidationError
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
-
-from IPython.display import Image, display
+from langgraph.config import get_config, get_stream_writer
+
+
+# orjson is an optional, faster JSON decoder for the AI turns.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from intake_cache import ResponseCache
+from intake_checkpoint import CompactSerializer, SqliteCheckpointSaver
+from intake_hedging import DeadlineExceeded, HedgeLost, Ticket, fallback_reply, get_hedge_policy
+from intake_crisis import crisis_flags_note, crisis_stop_turn, notify, screen
+from intake_llm import MODEL_TIERS, TIER_LARGE, TIER_SMALL, build_tier_llm
+from intake_logging import log_context, setup_logging, thread_id_var
+from intake_phq9 import phq9_turn
+from intake_record import merge_record
+from intake_prompts import load_prompt as compiled_prompt
+from intake_scheduler import PRIORITY_CRITICAL, PRIORITY_ROUTINE, get_scheduler
+from intake_skip import CONFIRM, METADATA_KEY as SKIP_METADATA_KEY, SKIP, SkipPolicy, confirm_note, \
+    volunteer_instruction
+from intake_metrics import (CRISIS_SCREEN, LLM_CACHE, LLM_COST, LLM_ESCALATIONS, LLM_FIRST_TOKEN_SECONDS,
+                            LLM_SECONDS, LLM_TIER_SECONDS, LOCAL_TURNS, NODE_SECONDS, PARSE_RESULTS, STAGE_SKIPS,
+                            TURNS, record_usage, serve_metrics)
+from intake_schemas import RESPONSE_FORMATS, STAGE_SCHEMAS
+from intake_streaming import ResponseFieldExtractor
 
 
 COMPLETE = 'complete'
@@ -24,30 +56,27 @@ IN_PROGRESS = 'in-progress'
 ALERT = 'alert'
 STOP = 'stop'
 
-FIRST_NODE = 150
+# History modes for a stage's LLM input (see stage_messages).
+HISTORY_STAGE = 'stage'
+HISTORY_FULL = 'full'
 
-# -------------------------------------------------------------------
-# Set up API key from file
-# -------------------------------------------------------------------
-# Determine the absolute path to the API key file located two directories above this script.
-script_dir = os.path.dirname(os.path.abspath(__file__))
-api_key_path = os.path.join(script_dir, '..', '..', 'OPENAI_API_KEY')
-
-# Read the API key from the file, remove any extra whitespace, and set it as an environment variable.
-with open(api_key_path, 'r') as key_file:
-    api_key = key_file.read().strip()
-os.environ["OPENAI_API_KEY"] = api_key
+# Set INTAKE_CHECKPOINT_DB to a file path to keep sessions in SQLite across
+# restarts; INTAKE_CHECKPOINT_KEEP is the number of checkpoints kept per thread.
+CHECKPOINT_DB_ENV = 'INTAKE_CHECKPOINT_DB'
+CHECKPOINT_KEEP_ENV = 'INTAKE_CHECKPOINT_KEEP'
 
+# Response cache for identical stage calls (see intake_cache.py):
+# INTAKE_LLM_CACHE_SIZE replies kept in memory (0 disables the cache) and an
+# optional SQLite file INTAKE_LLM_CACHE_DB shared across restarts.
+LLM_CACHE_SIZE_ENV = 'INTAKE_LLM_CACHE_SIZE'
+LLM_CACHE_DB_ENV = 'INTAKE_LLM_CACHE_DB'
 
 # -------------------------------------------------------------------
 # Setup Logging
+# Importing the module configures nothing; the entry point (main) calls
+# intake_logging.setup_logging (queued, rotating JSON lines) so importers
+# keep control of their own logging.
 # -------------------------------------------------------------------
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='ai_intake_system.log',
-    filemode='w'  # 'w' to overwrite each time, 'a' to append
-)
 logger = logging.getLogger(__name__)
 
 
@@ -56,31 +85,89 @@ logger = logging.getLogger(__name__)
 # 1) Load the prompt texts from .md files (ID 150 and ID 200).
 #    Adjust these paths if the files are located elsewhere.
 # -------------------------------------------------------------------
+# Relative prompt paths are resolved against this script's directory, so the
+# module can be imported from any working directory.
+PROMPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Prompts are served in compiled form (comments stripped, schemas
+# canonicalized, whitespace collapsed; see intake_prompts.py) from a cache
+# that reloads a file when its mtime changes.
 def load_prompt(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-
-PROMPT_150_PATH = "prompts/Prompt_0150_Get_Familiar.md"
-PROMPT_200_PATH = "prompts/Prompt_0200_Depression_Severity.md"
-PROMPT_300_PATH = "prompts/Prompt_0300_Illness_History.md"
-PROMPT_400_PATH = "prompts/Prompt_0400_Antidepressant_History.md"
-PROMPT_500_PATH = "prompts/Prompt_0500_Current_Medications.md"
-PROMPT_600_PATH = "prompts/Prompt_0600_Procedures.md"
-PROMPT_700_PATH = "prompts/Prompt_0700_Suicide_Risk_Factors.md"
-PROMPT_800_PATH = "prompts/Prompt_0800_Bipolar.md"
-PROMPT_900_PATH = "prompts/Prompt_0900_Conversation_Completed.md"
-PROMPT_1000_PATH = "prompts/Prompt_1000_Stop_Interaction.md"
-
-prompt_150 = load_prompt(PROMPT_150_PATH)
-prompt_200 = load_prompt(PROMPT_200_PATH)
-prompt_300 = load_prompt(PROMPT_300_PATH)
-prompt_400 = load_prompt(PROMPT_400_PATH)
-prompt_500 = load_prompt(PROMPT_500_PATH)
-prompt_600 = load_prompt(PROMPT_600_PATH)
-prompt_700 = load_prompt(PROMPT_700_PATH)
-prompt_800 = load_prompt(PROMPT_800_PATH)
-prompt_900 = load_prompt(PROMPT_900_PATH)
-prompt_1000 = load_prompt(PROMPT_1000_PATH)
+    return compiled_prompt(os.path.join(PROMPT_DIR, path))
+
+# -------------------------------------------------------------------
+# 2) Stage registry.
+#    One row per stage:
+#    - id: the stage ID.
+#    - prompt_path: the stage's prompt file.
+#    - next: the stage entered when it completes (None ends the conversation).
+#    - terminal: the conversation is over once the stage has run.
+#    - history: how much history its LLM call sees.
+#    - local: optional handler answering routine turns without the LLM, called
+#      with the stage's message window and the record; None defers to the LLM
+#      (see intake_phq9.py).
+#    - priority: priority of its LLM calls when the provider's rate limits are
+#      reached (see intake_scheduler.py).
+#    - deadline: deadline of those calls; None = the default (see intake_hedging.py).
+#    - tiers: model tiers it may use, cheapest first; a reply that fails the
+#      stage schema (or a failed call) escalates to the next tier.
+#    - skip: whether the stage is skipped or cut to one confirmation turn when
+#      the record already answers it (see intake_skip.py).
+#    The graph nodes and transitions are generated from this table, so a study
+#    protocol with a different stage sequence is a different table passed to
+#    build_workflow.
+# -------------------------------------------------------------------
+class Stage(NamedTuple):
+    id: int
+    prompt_path: str
+    next: Optional[int]
+    terminal: bool = False
+    history: str = HISTORY_STAGE
+    local: Optional[Callable[[list, Dict[str, Any]], Optional[AIMessage]]] = None
+    priority: int = PRIORITY_ROUTINE
+    deadline: Optional[float] = None
+    tiers: Tuple[str, ...] = (TIER_LARGE,)
+    skip: Optional[SkipPolicy] = None
+
+
+# Simple stages try the small model first; demanding ones (antidepressant
+# history 400, suicide risk 700) and the rest use the large model only.
+SMALL_FIRST = (TIER_SMALL, TIER_LARGE)
+
+STAGES = (
+    Stage(150, "prompts/Prompt_0150_Get_Familiar.md", 200, tiers=SMALL_FIRST),
+    Stage(200, "prompts/Prompt_0200_Depression_Severity.md", 300, local=phq9_turn),
+    # Volunteered diagnoses, medications and procedures are confirmed in one turn.
+    Stage(300, "prompts/Prompt_0300_Illness_History.md", 400, skip=SkipPolicy("diagnoses", "diagnosed conditions")),
+    Stage(400, "prompts/Prompt_0400_Antidepressant_History.md", 500),
+    Stage(500, "prompts/Prompt_0500_Current_Medications.md", 600,
+          skip=SkipPolicy("medications", "current medications")),
+    Stage(600, "prompts/Prompt_0600_Procedures.md", 700, skip=SkipPolicy("procedures", "medical procedures")),
+    Stage(700, "prompts/Prompt_0700_Suicide_Risk_Factors.md", 800, priority=PRIORITY_CRITICAL),
+    Stage(800, "prompts/Prompt_0800_Bipolar.md", 900),
+    # Wrap-up may refer back to anything the patient said.
+    Stage(900, "prompts/Prompt_0900_Conversation_Completed.md", None, terminal=True, history=HISTORY_FULL,
+          tiers=SMALL_FIRST),
+    # Replies locally when entered by the crisis screen (see intake_crisis.py).
+    Stage(1000, "prompts/Prompt_1000_Stop_Interaction.md", None, terminal=True, local=crisis_stop_turn,
+          priority=PRIORITY_CRITICAL, tiers=SMALL_FIRST),
+)
+
+# Stage entered from any other stage when the status is "stop" or "alert".
+STOP_STAGE = 1000
+
+FIRST_NODE = STAGES[0].id
+STAGE_BY_ID = {stage.id: stage for stage in STAGES}
+
+
+def node_name(stage_id: int) -> str:
+    return f"step_{stage_id}"
+
+
+def is_finished(step: int, status: str) -> bool:
+    """True once a conversation has no further turns (default registry)."""
+    stage = STAGE_BY_ID.get(step)
+    return step == STOP_STAGE or (stage is not None and stage.terminal and status == COMPLETE)
 
 # Prepend the system message (with the prompt_150) to the conversation messages.
 # def get_messages_info(messages):
@@ -114,7 +201,11 @@ def strip_markdown_code(text: str) -> str:
     """
     Remove markdown code block formatting (e.g. triple backticks) from the text.
     """
-    lines = text.strip().splitlines()
+    text = text.strip()
+    if not text.startswith("```"):
+        # Common case: the reply is bare JSON, nothing to strip.
+        return text
+    lines = text.splitlines()
     if lines and lines[0].startswith("```"):
         # Remove the first line (which may be ```json)
         lines = lines[1:]
@@ -124,99 +215,655 @@ def strip_markdown_code(text: str) -> str:
     return "\n".join(lines).strip()
 
 
+# -------------------------------------------------------------------
+# Parsed AI turns are cached by message id, so routing (get_state), the
+# history summary and any display or downstream consumer share a single
+# parse and validation per message. parse_counters records cache "hits",
+# "misses" (actual parses), "fallbacks" (replies that were not a valid
+# IntakeOutput) and "schema_mismatches" (valid envelope, wrong stage schema).
+# -------------------------------------------------------------------
+PARSE_CACHE_SIZE = 4096
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+_parse_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_parse_cache_lock = threading.Lock()
+parse_counters = Counter(hits=0, misses=0, fallbacks=0, schema_mismatches=0)
+
+
+def _parse_content(content, stage: Optional[int]) -> Optional[Dict[str, Any]]:
+    if not isinstance(content, str):
+        logger.error("Parsing failed: non-text content")
+        return None
+    try:
+        # Remove markdown code block formatting if present
+        cleaned_content = strip_markdown_code(content)
+        # Try to load as JSON first (orjson.JSONDecodeError subclasses json.JSONDecodeError)
+        raw_data = _json_loads(cleaned_content)
+    except json.JSONDecodeError as e:
+        logger.error("Parsing failed: %s", e)
+        return None
+
+    # Validate against the typed schema of the stage that produced the reply.
+    schema = STAGE_SCHEMAS.get(stage)
+    if schema is not None:
+        try:
+            return schema.model_validate(raw_data).model_dump()
+        except ValidationError as e:
+            logger.warning("Reply does not match the stage %s schema: %s", stage, e)
+            parse_counters["schema_mismatches"] += 1
+            PARSE_RESULTS.inc(stage=stage, result="schema_mismatch")
+
+    # Fall back to the generic envelope so the turn can still be routed.
+    try:
+        return IntakeOutput.model_validate(raw_data).model_dump()
+    except ValidationError as e:
+        logger.error("Parsing failed: %s", e)
+        return None
+
+
+def try_parse_output(ai_message: AIMessage) -> Optional[Dict[str, Any]]:
+    """
+    Parse the AIMessage content as JSON validated by the typed schema of the
+    stage that produced it (see intake_schemas.py), or by the generic
+    IntakeOutput envelope for untagged messages and schema mismatches.
+    Return None if the content is not a valid IntakeOutput.
+
+    Results are memoized per message; the returned dict is shared between
+    callers and must be treated as read-only.
+    """
+    key = ai_message.id
+    content = ai_message.content
+    if key is not None:
+        with _parse_cache_lock:
+            entry = _parse_cache.get(key)
+            if entry is not None and (entry[0] is content or entry[0] == content):
+                _parse_cache.move_to_end(key)
+                parse_counters["hits"] += 1
+                return entry[1]
+
+    stage = message_stage(ai_message)
+    parsed = _parse_content(content, stage)
+    if parsed is None:
+        PARSE_RESULTS.inc(stage=stage, result="fallback")
+    with _parse_cache_lock:
+        parse_counters["misses"] += 1
+        if parsed is None:
+            parse_counters["fallbacks"] += 1
+        if key is not None:
+            _parse_cache[key] = (content, parsed)
+            if len(_parse_cache) > PARSE_CACHE_SIZE:
+                _parse_cache.popitem(last=False)
+    return parsed
+
+
 def parse_output(ai_message: AIMessage) -> Dict[str, Any]:
     """
     Attempt to parse the AIMessage content as JSON using a Pydantic model.
     If parsing fails, fallback to a default structure.
     """
-    try:
-        # Remove markdown code block formatting if present
-        cleaned_content = strip_markdown_code(ai_message.content)
-        # Try to load as JSON first
-        raw_data = json.loads(cleaned_content)
-        # Validate and convert using the Pydantic model
-        # parsed = IntakeOutput.parse_obj(raw_data)
-        parsed = IntakeOutput.model_validate(raw_data)
+    parsed = try_parse_output(ai_message)
+    if parsed is not None:
+        return parsed
 
-        return parsed.model_dump()
+    # Fallback: Return a default structure with the raw content as the response.
+    # Nothing is recorded, so a malformed reply cannot overwrite earlier data.
+    return {
+        "response": ai_message.content,
+        "status": "in-progress",
+        "medical_history": {}
+    }
+
+
+# -------------------------------------------------------------------
+# Stage-scoped history windowing.
+# Each chain sends its stage prompt plus only the turns of the current
+# stage, with the merged medical record (state["record"]) carried forward
+# as compact JSON, so the prompt size stays roughly flat as the intake
+# progresses. Stages registered with HISTORY_FULL receive the whole
+# conversation instead.
+# -------------------------------------------------------------------
+SUMMARY_HEADER = "## Medical record so far (JSON)\n\n"
+
+# Appended to every stage prompt: the model reports medical_history as a
+# delta, which merge_record (intake_record.py) folds into state["record"].
+DELTA_INSTRUCTION = (
+    "## Reporting medical_history\n\n"
+    "In \"medical_history\", report only what is new or changed in this turn, using the "
+    "same JSON structure. Use null (or an empty list) for anything unchanged; do not "
+    "repeat what is already in the medical record."
+)
+
+
+def tag_stage(ai_message: AIMessage, stage: int) -> AIMessage:
+    """Record which stage produced an AI message (kept in the checkpoint, not sent to the LLM)."""
+    ai_message.response_metadata["stage"] = stage
+    return ai_message
+
+
+def message_stage(message) -> Optional[int]:
+    if isinstance(message, AIMessage):
+        return message.response_metadata.get("stage")
+    return None
+
+
+def stage_window(messages: list, stage: int) -> list:
+    """
+    Return the messages exchanged since the last AI message of another stage.
+    Untagged AI messages are kept, so older threads fall back to full history.
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        tagged = message_stage(messages[i])
+        if tagged is not None and tagged != stage:
+            return messages[i + 1:]
+    return messages
 
-    except (json.JSONDecodeError, ValidationError) as e:
-        logger.error("Parsing failed: %s", e)
-        # Fallback: Return a default structure with the raw content as the response
-        return {
-            "response": ai_message.content,
-            "status": "in-progress",
-            "medical_history": {
-                "demographics": {
-                    "age": "",
-                    "gender": ""
-                }
-            }
-        }
 
+def history_summary(messages: list, stage: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Rebuild the record by merging the medical_history of every tagged reply
+    (except those of ``stage``). Used for threads checkpointed before
+    state["record"] existed.
+    """
+    summary = {}
+    for m in messages:
+        tagged = message_stage(m)
+        if tagged is None or tagged == stage:
+            continue
+        parsed = try_parse_output(m)
+        if parsed is not None:
+            summary = merge_record(summary, parsed["medical_history"])
+    return summary
+
+
+def current_record(state) -> Dict[str, Any]:
+    """Return the merged medical record of a thread's state."""
+    if "record" in state:
+        return state["record"]
+    return history_summary(state.get("messages", []))
+
+
+def stage_messages(prompt: str, state, stage: int, history_mode: str = HISTORY_STAGE) -> list:
+    """Build the LLM input for a stage according to its history mode."""
+    history = state["messages"]
+    record = current_record(state)
+    if record:
+        prompt = prompt + "\n\n" + SUMMARY_HEADER + json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+    prompt = prompt + "\n\n" + DELTA_INSTRUCTION
+    crisis = state.get("crisis")
+    if crisis and crisis["factors"]:
+        prompt = prompt + "\n\n" + crisis_flags_note(crisis["factors"])
+    if history_mode == HISTORY_FULL:
+        return [SystemMessage(content=prompt)] + history
+    return [SystemMessage(content=prompt)] + stage_window(history, stage)
 
 
 # -------------------------------------------------------------------
 # Initialize Language Model (LLM) with tool binding
 # -------------------------------------------------------------------
-# Instantiate the ChatOpenAI LLM with a deterministic output (temperature=0).
-# llm = ChatOpenAI(temperature=0)
-llm = ChatOpenAI(temperature=0, model_name="gpt-4o")
-# Bind the PromptInstructions tool to the LLM so it can parse prompt details.
-llm_with_tool = llm.bind_tools([PromptInstructions])
+# The LLM for the configured backend (INTAKE_LLM_BACKEND, see intake_llm.py):
+# ChatOpenAI gpt-4o with temperature=0 by default, or the offline scripted
+# replay model. It is built on first use, so importing this module neither
+# reads the API key nor loads the provider SDK. _llm is the large tier; the
+# models of the other tiers are built on first use too.
+_llm = None
+_llm_with_tool = None
+_tier_llms: Dict[str, Any] = {}
+_init_lock = threading.Lock()
+
+
+def _bind_tool(llm):
+    # Bind the PromptInstructions tool to the LLM so it can parse prompt details.
+    return llm.bind_tools([PromptInstructions])
+
+
+def get_llm():
+    """Return the chat model (large tier), building it on first use."""
+    if _llm is None:
+        with _init_lock:
+            if _llm is None:
+                configure_llm(build_tier_llm(TIER_LARGE), TIER_LARGE)
+    return _llm
+
+
+def get_llm_with_tool():
+    """Return the chat model with the PromptInstructions tool bound."""
+    get_llm()
+    return _llm_with_tool
+
+# Request schema-constrained output (json_schema response format) for each
+# stage's typed schema. Set INTAKE_STRUCTURED_OUTPUT=0 for backends that do
+# not support it.
+STRUCTURED_OUTPUT = os.environ.get("INTAKE_STRUCTURED_OUTPUT", "1") != "0"
+_stage_llms: Dict[Tuple[int, str], Any] = {}
+
+
+def tier_llm(tier: str):
+    """Return the tool-bound chat model of a tier, building it on first use."""
+    if tier == TIER_LARGE:
+        return get_llm_with_tool()
+    bound = _tier_llms.get(tier)
+    if bound is None:
+        with _init_lock:
+            if tier not in _tier_llms:
+                _tier_llms[tier] = _bind_tool(build_tier_llm(tier))
+            bound = _tier_llms[tier]
+    return bound
+
+
+def stage_llm(stage_id: int, tier: str = TIER_LARGE):
+    """Return the tool-bound LLM of a tier for a stage, bound to the stage's response format."""
+    bound = _stage_llms.get((stage_id, tier))
+    if bound is None:
+        bound = tier_llm(tier)
+        if STRUCTURED_OUTPUT and stage_id in RESPONSE_FORMATS:
+            bound = bound.bind(response_format=RESPONSE_FORMATS[stage_id])
+        _stage_llms[(stage_id, tier)] = bound
+    return bound
+
+
+def configure_llm(new_llm, tier: Optional[str] = None):
+    """
+    Swap the chat model used by every chain and tier (e.g. for replay or
+    benchmarks), or only by the given tier.
+    """
+    global _llm, _llm_with_tool
+    bound = _bind_tool(new_llm)
+    if tier is None or tier == TIER_LARGE:
+        _llm_with_tool = bound
+        _llm = new_llm
+    for name in MODEL_TIERS:
+        if name != TIER_LARGE and tier in (None, name):
+            _tier_llms[name] = bound
+    _stage_llms.clear()
 
 # -------------------------------------------------------------------
-# Define a chain to collect information based on user messages.
+# LLM calls for the stage chains.
+# With STREAM_LLM enabled the reply is streamed: the "response" field is
+# decoded incrementally and emitted on the graph's "custom" stream as
+# {"stage": <id>, "delta": <text>} while the rest of the JSON is still being
+# generated. The full message is returned afterwards and validated/routed as
+# usual. Callers that do not request stream_mode="custom" simply ignore the
+# deltas.
 # -------------------------------------------------------------------
-def chain_150_get_familiar(state):
-    messages = [SystemMessage(content=prompt_150)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
+STREAM_LLM = os.environ.get("INTAKE_STREAM", "1") != "0"
 
-def chain_200_depression_severity(state):
-    messages = [SystemMessage(content=prompt_200)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
 
-def chain_300_illness_history7(state):
-    messages = [SystemMessage(content=prompt_300)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
+def build_response_cache() -> Optional[ResponseCache]:
+    size = int(os.environ.get(LLM_CACHE_SIZE_ENV, "1024"))
+    if size <= 0:
+        return None
+    return ResponseCache(max_entries=size, path=os.environ.get(LLM_CACHE_DB_ENV))
 
-def chain_400_antidepressant_history(state):
-    messages = [SystemMessage(content=prompt_400)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
 
-def chain_500_current_medications(state):
-    messages = [SystemMessage(content=prompt_500)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
+# Built on first use, so importing the module (e.g. in each intake_batch pool
+# worker) opens no cache database.
+_response_cache: Optional[ResponseCache] = None
+_response_cache_built = False
 
-def chain_600_procedures(state):
-    messages = [SystemMessage(content=prompt_600)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
 
-def chain_700_suicide_risk_factors(state):
-    messages = [SystemMessage(content=prompt_700)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache (None if disabled), building it on first use."""
+    global _response_cache, _response_cache_built
+    if not _response_cache_built:
+        with _init_lock:
+            if not _response_cache_built:
+                _response_cache = build_response_cache()
+                _response_cache_built = True
+    return _response_cache
 
-def chain_800_bipolar(state):
-    messages = [SystemMessage(content=prompt_800)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
 
-def chain_900_conversation_completed(state):
-    messages = [SystemMessage(content=prompt_900)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
+def configure_response_cache(cache: Optional[ResponseCache]):
+    global _response_cache, _response_cache_built
+    _response_cache = cache
+    _response_cache_built = True
 
-def chain_1000_stop_interaction(state):
-    messages = [SystemMessage(content=prompt_1000)] + state["messages"]
-    response = llm_with_tool.invoke(messages)
-    return {"messages": [response]}
+
+def cached_stage_reply(stage_id: int, model, messages: list) -> Optional[AIMessage]:
+    """
+    Return the cached reply for an identical earlier call (streaming its
+    response text), or None. A cached reply that fails the stage schema is
+    treated as a miss, so it goes through the tiers like a fresh call.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return None
+    message = cache.lookup_call(model, messages)
+    if message is not None and not reply_is_valid(message, stage_id):
+        message = None
+    LLM_CACHE.inc(stage=stage_id, result="miss" if message is None else "hit")
+    if message is not None:
+        emit_reply(stage_id, message)
+    return message
+
+
+def emit_reply(stage_id: int, message: AIMessage):
+    """Stream a complete reply's response text as one delta."""
+    if STREAM_LLM:
+        delta = ResponseFieldExtractor().feed(message.content)
+        if delta:
+            get_stream_writer()({"stage": stage_id, "delta": delta})
+
+
+def store_stage_reply(model, messages: list, message: AIMessage):
+    cache = get_response_cache()
+    if cache is not None:
+        cache.update_call(model, messages, message)
+
+
+def deadline_reply(stage_id: int) -> AIMessage:
+    """Fallback reply (streamed like any other) when a stage call misses its deadline."""
+    logger.warning("Stage %s LLM call missed its deadline; sending the fallback reply", stage_id)
+    message = fallback_reply()
+    if STREAM_LLM:
+        get_stream_writer()({"stage": stage_id, "delta": parse_output(message)["response"]})
+    return message
+
+
+# A stage LLM call: tried on each of the stage's model tiers in turn until a
+# reply passes the stage schema (the last tier's reply is always accepted).
+# On each tier the reply is served from the cache, or the call is admitted by
+# the rate-limit scheduler (see intake_scheduler.py) and then run under what
+# is left of the deadline (and possibly hedged, see intake_hedging.py). The
+# deadline budget only counts time spent in model calls, not time queued for
+# admission; a hedge is admitted separately. Deltas of a tier that may still
+# be escalated are held back and sent once its reply is accepted, so the
+# patient never sees a discarded reply.
+def call_stage_llm(stage_id: int, messages: list, priority: int = PRIORITY_ROUTINE,
+                   deadline: Optional[float] = None, tiers: Tuple[str, ...] = (TIER_LARGE,)) -> AIMessage:
+    policy = get_hedge_policy()
+    scheduler = get_scheduler()
+    budget = _Budget(deadline or policy.deadline)
+    for i, tier in enumerate(tiers):
+        final = i == len(tiers) - 1
+        model = stage_llm(stage_id, tier)
+        cached = cached_stage_reply(stage_id, model, messages)
+        if cached is not None:
+            return cached
+
+        def attempt(ticket: Ticket, model=model, tier=tier, final=final) -> AIMessage:
+            def invoke():
+                return invoke_stage_llm(stage_id, model, messages, ticket, tier, emit=final)
+            return invoke() if ticket.attempt == 0 else scheduler.call(invoke, messages, priority, stage=stage_id)
+
+        def race(attempt=attempt) -> AIMessage:
+            with budget.spend() as remaining:
+                return policy.call(stage_id, attempt, remaining)
+
+        try:
+            message = scheduler.call(race, messages, priority, stage=stage_id)
+        except DeadlineExceeded:
+            return deadline_reply(stage_id)
+        except Exception as e:
+            if final:
+                raise
+            escalate(stage_id, tier, "error", e)
+            continue
+        if accept_reply(stage_id, tier, model, messages, message, final):
+            return message
+
+
+async def acall_stage_llm(stage_id: int, messages: list, priority: int = PRIORITY_ROUTINE,
+                          deadline: Optional[float] = None, tiers: Tuple[str, ...] = (TIER_LARGE,)) -> AIMessage:
+    policy = get_hedge_policy()
+    scheduler = get_scheduler()
+    budget = _Budget(deadline or policy.deadline)
+    for i, tier in enumerate(tiers):
+        final = i == len(tiers) - 1
+        model = stage_llm(stage_id, tier)
+        cached = cached_stage_reply(stage_id, model, messages)
+        if cached is not None:
+            return cached
+
+        async def attempt(ticket: Ticket, model=model, tier=tier, final=final) -> AIMessage:
+            def invoke():
+                return ainvoke_stage_llm(stage_id, model, messages, ticket, tier, emit=final)
+            if ticket.attempt == 0:
+                return await invoke()
+            return await scheduler.acall(invoke, messages, priority, stage=stage_id)
+
+        async def race(attempt=attempt) -> AIMessage:
+            with budget.spend() as remaining:
+                return await policy.acall(stage_id, attempt, remaining)
+
+        try:
+            message = await scheduler.acall(race, messages, priority, stage=stage_id)
+        except DeadlineExceeded:
+            return deadline_reply(stage_id)
+        except Exception as e:
+            if final:
+                raise
+            escalate(stage_id, tier, "error", e)
+            continue
+        if accept_reply(stage_id, tier, model, messages, message, final):
+            return message
+
+
+class _Budget:
+    """A stage call's deadline, spent only while a model call is running."""
+
+    def __init__(self, seconds: Optional[float]):
+        self.seconds = seconds or None
+        self.spent = 0.0
+
+    @contextmanager
+    def spend(self):
+        """Yield the remaining seconds (None = no deadline) and charge the time spent inside."""
+        start = time.monotonic()
+        try:
+            # A tiny positive budget (not None, which would mean "the default") once it is used up.
+            yield None if self.seconds is None else max(1e-3, self.seconds - self.spent)
+        finally:
+            self.spent += time.monotonic() - start
+
+
+def reply_is_valid(message: AIMessage, stage_id: int) -> bool:
+    """True if the reply is JSON matching the stage's schema (IntakeOutput for stages without one)."""
+    if not isinstance(message.content, str):
+        return False
+    try:
+        raw_data = _json_loads(strip_markdown_code(message.content))
+        STAGE_SCHEMAS.get(stage_id, IntakeOutput).model_validate(raw_data)
+    except (json.JSONDecodeError, ValidationError):
+        return False
+    return True
+
+
+def escalate(stage_id: int, tier: str, reason: str, error: Optional[BaseException] = None):
+    LLM_ESCALATIONS.inc(stage=stage_id, tier=tier, reason=reason)
+    logger.warning("Stage %s reply from the %s tier escalated (%s)%s", stage_id, tier, reason,
+                   f": {error!r}" if error is not None else "")
+
+
+def accept_reply(stage_id: int, tier: str, model, messages: list, message: AIMessage, final: bool) -> bool:
+    """
+    Record a tier's reply; return False if it must be escalated to the next
+    tier. Only replies that pass the stage schema are cached.
+    """
+    record_usage(stage_id, message)
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        LLM_COST.inc(MODEL_TIERS[tier].cost(usage), stage=stage_id, tier=tier)
+    valid = reply_is_valid(message, stage_id)
+    if not final:
+        if not valid:
+            escalate(stage_id, tier, "invalid")
+            return False
+        emit_reply(stage_id, message)
+    if valid:
+        store_stage_reply(model, messages, message)
+    return True
+
+
+# One model call, streaming the reply text as it arrives. Only the attempt
+# holding the ticket's claim may stream; a hedged attempt that lost the race
+# stops at its next chunk with HedgeLost.
+def invoke_stage_llm(stage_id: int, model, messages: list, ticket: Optional[Ticket] = None,
+                     tier: str = TIER_LARGE, emit: bool = True) -> AIMessage:
+    if ticket is not None and not ticket.wanted():
+        raise HedgeLost()
+    start = time.perf_counter()
+    if not STREAM_LLM:
+        message = model.invoke(messages)
+        if ticket is not None and not ticket.claim():
+            raise HedgeLost()
+    else:
+        writer = get_stream_writer()
+        extractor = ResponseFieldExtractor()
+        message = None
+        for chunk in model.stream(messages):
+            if ticket is not None and not ticket.claim():
+                raise HedgeLost()
+            if message is None:
+                LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, stage=stage_id)
+            message = chunk if message is None else message + chunk
+            delta = extractor.feed(chunk.content) if emit else None
+            if delta:
+                writer({"stage": stage_id, "delta": delta})
+        message = message_chunk_to_message(message)
+    elapsed = time.perf_counter() - start
+    LLM_SECONDS.observe(elapsed, stage=stage_id)
+    LLM_TIER_SECONDS.observe(elapsed, tier=tier)
+    return message
+
+
+async def ainvoke_stage_llm(stage_id: int, model, messages: list, ticket: Optional[Ticket] = None,
+                            tier: str = TIER_LARGE, emit: bool = True) -> AIMessage:
+    if ticket is not None and not ticket.wanted():
+        raise HedgeLost()
+    start = time.perf_counter()
+    if not STREAM_LLM:
+        message = await model.ainvoke(messages)
+        if ticket is not None and not ticket.claim():
+            raise HedgeLost()
+    else:
+        writer = get_stream_writer()
+        extractor = ResponseFieldExtractor()
+        message = None
+        async for chunk in model.astream(messages):
+            if ticket is not None and not ticket.claim():
+                raise HedgeLost()
+            if message is None:
+                LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, stage=stage_id)
+            message = chunk if message is None else message + chunk
+            delta = extractor.feed(chunk.content) if emit else None
+            if delta:
+                writer({"stage": stage_id, "delta": delta})
+        message = message_chunk_to_message(message)
+    elapsed = time.perf_counter() - start
+    LLM_SECONDS.observe(elapsed, stage=stage_id)
+    LLM_TIER_SECONDS.observe(elapsed, tier=tier)
+    return message
+
+
+# -------------------------------------------------------------------
+# Build the chain node for one stage. The node has a sync and an async
+# variant: astream/ainvoke (see intake_sessions.py) await the LLM call so a
+# slow reply only suspends its own session instead of blocking the loop.
+# -------------------------------------------------------------------
+def make_stage_node(stage: Stage, volunteer: Optional[str] = None) -> RunnableLambda:
+    """``volunteer`` is the note asking for answers to later skippable stages (see build_workflow)."""
+    load_prompt(stage.prompt_path)  # fail at build time if the file is missing
+    name = node_name(stage.id)
+
+    def chain(state):
+        with log_context(stage=stage.id), NODE_SECONDS.time(node=name):
+            response = local_stage_reply(stage, state)
+            if response is None:
+                confirming = confirm_flow(stage, state)
+                messages = stage_messages(stage_prompt(stage, state, volunteer, confirming), state, stage.id,
+                                          stage.history)
+                response = call_stage_llm(stage.id, messages, stage.priority, stage.deadline, stage.tiers)
+                tag_confirm(response, confirming)
+            response = tag_stage(response, stage.id)
+        TURNS.inc(stage=stage.id)
+        return stage_update(stage, response)
+
+    async def achain(state):
+        with log_context(stage=stage.id), NODE_SECONDS.time(node=name):
+            response = local_stage_reply(stage, state)
+            if response is None:
+                confirming = confirm_flow(stage, state)
+                messages = stage_messages(stage_prompt(stage, state, volunteer, confirming), state, stage.id,
+                                          stage.history)
+                response = await acall_stage_llm(stage.id, messages, stage.priority, stage.deadline,
+                                                 stage.tiers)
+                tag_confirm(response, confirming)
+            response = tag_stage(response, stage.id)
+        TURNS.inc(stage=stage.id)
+        return stage_update(stage, response)
+
+    return RunnableLambda(chain, afunc=achain, name=name)
+
+
+# A stage whose answer is already recorded runs as a single confirmation (see
+# intake_skip.py). Its replies are tagged, and the stage stays in the confirm
+# flow for as long as its first reply is tagged.
+def confirm_flow(stage: Stage, state) -> Optional[str]:
+    """"first" or "followup" while the stage is in its confirm flow, else None."""
+    if stage.skip is None:
+        return None
+    replies = [m for m in stage_window(state["messages"], stage.id) if message_stage(m) == stage.id]
+    if replies:
+        return "followup" if replies[0].response_metadata.get(SKIP_METADATA_KEY) == CONFIRM else None
+    if stage.skip.decide(current_record(state)) == CONFIRM:
+        STAGE_SKIPS.inc(stage=stage.id, action=CONFIRM)
+        return "first"
+    return None
+
+
+def tag_confirm(response: AIMessage, confirming: Optional[str]):
+    """Mark a reply given in the confirm flow, so the stage's later turns stay in it."""
+    if confirming is not None:
+        response.response_metadata[SKIP_METADATA_KEY] = CONFIRM
+
+
+def stage_prompt(stage: Stage, state, volunteer: Optional[str] = None, confirming: Optional[str] = None) -> str:
+    """The stage prompt plus its skip notes: the volunteer note and, in the confirm flow, the confirm note."""
+    prompt = load_prompt(stage.prompt_path)
+    if volunteer:
+        prompt = prompt + "\n\n" + volunteer
+    if confirming is not None:
+        prompt = prompt + "\n\n" + confirm_note(stage.skip, current_record(state), followup=confirming == "followup")
+    return prompt
+
+
+def local_stage_reply(stage: Stage, state) -> Optional[AIMessage]:
+    """Run the stage's local handler, if any; None means the LLM must answer."""
+    if stage.local is None:
+        return None
+    response = stage.local(stage_window(state["messages"], stage.id), current_record(state))
+    if response is not None:
+        LOCAL_TURNS.inc(stage=stage.id)
+        delta = ResponseFieldExtractor().feed(response.content)
+        if delta:
+            get_stream_writer()({"stage": stage.id, "delta": delta})
+    return response
+
+
+def stage_update(stage: Stage, response: AIMessage) -> Dict[str, Any]:
+    """
+    State update for a stage reply: the message, the step and the record
+    delta, with any volunteered answers to later stages lifted into it.
+    """
+    update = {"messages": [response], "step": stage.id}
+    parsed = try_parse_output(response)
+    if parsed is None:
+        return update
+    delta = parsed["medical_history"]
+    volunteered = {k: v for k, v in (parsed.get("volunteered") or {}).items() if v}
+    if volunteered:
+        delta = merge_record(delta, volunteered)
+    if delta:
+        update["record"] = delta
+    return update
+
+
+def timed_node(name: str, func):
+    """Wrap a plain node function so its executions are recorded in NODE_SECONDS."""
+    def node(state):
+        with NODE_SECONDS.time(node=name):
+            return func(state)
+    return RunnableLambda(node, name=name)
 
 # -------------------------------------------------------------------
 # Define a system prompt template for generating the final prompt.
@@ -250,65 +897,56 @@ def get_prompt_messages(messages: list):
 # -------------------------------------------------------------------
 def prompt_gen_chain(state):
     messages = get_prompt_messages(state["messages"])
-    response = llm.invoke(messages)
+    response = get_llm().invoke(messages)
     return {"messages": [response]}
 
 # -------------------------------------------------------------------
 # Define a function to decide the next state in the state graph.
 # -------------------------------------------------------------------
-def get_state(state):
-
-    
-    messages = state["messages"]
-    
-    last_message = messages[-1]
-    parsed = parse_output(last_message)
-    
-    response = parsed['response']
-    status = parsed['status']
-    medical_history = parsed['medical_history']
-    
-    
-    
-    # If the last message is an AIMessage that contains a tool call, transition to "add_tool_message".
-    # Stay in current node
-
-    current_step = state["step"]
-
-
-    if status == ALERT:
-        return 'step_1000'
-    elif status == STOP:
-        return 'step_1000'
-    elif status == COMPLETE:
-        if current_step == 150:
-            return "step_200"
-        elif current_step == 200:
-            return "step_300"
-        elif current_step == 300:
-            return "step_400"
-        elif current_step == 400:
-            return "step_500"
-        elif current_step == 500:
-            return "step_600"
-        elif current_step == 600:
-            return "step_700"
-        elif current_step == 700:
-            return "step_800"
-        elif current_step == 800:
-            return "step_900"
-        elif current_step == 900:
-            return END
-        elif current_step == 1000:
-            return END
-    
-    elif isinstance(last_message, AIMessage) and last_message.tool_calls:
-        return "add_tool_message"
-    # If the last message is not from a human, consider the conversation ended.
-    elif not isinstance(messages[-1], HumanMessage):
+def make_router(transitions: Dict[int, Optional[int]], stop_stage: int = STOP_STAGE,
+                skips: Optional[Dict[int, SkipPolicy]] = None):
+    """
+    Build the conditional-edge function for a protocol. ``transitions`` maps
+    each stage ID to the stage entered when it completes (None = END);
+    ``skips`` maps stage IDs to their skip policy.
+    """
+    skips = skips or {}
+
+    def next_stage(step: int, state) -> Optional[int]:
+        """The stage entered after ``step`` completes, routing past stages the record already answers."""
+        next_step = transitions.get(step)
+        if next_step in skips:
+            record = current_record(state)
+            while next_step in skips and skips[next_step].decide(record) == SKIP:
+                logger.info("Skipping stage %s: already answered", next_step)
+                STAGE_SKIPS.inc(stage=next_step, action=SKIP)
+                next_step = transitions.get(next_step)
+        return next_step
+
+    def get_state(state):
+        messages = state["messages"]
+        last_message = messages[-1]
+        current_step = state["step"]
+        with log_context(stage=current_step):
+            status = parse_output(last_message)['status']
+
+        if status in (ALERT, STOP) and current_step != stop_stage:
+            return node_name(stop_stage)
+        elif status == COMPLETE:
+            next_step = next_stage(current_step, state)
+            return END if next_step is None else node_name(next_step)
+        # If the last message is an AIMessage that contains a tool call, transition to "add_tool_message".
+        elif isinstance(last_message, AIMessage) and last_message.tool_calls:
+            return "add_tool_message"
+
+        # Otherwise wait for the patient's next message.
         return END
 
-    return END
+    return get_state
+
+
+get_state = make_router({stage.id: stage.next for stage in STAGES},
+                        skips={stage.id: stage.skip for stage in STAGES if stage.skip is not None})
 
 # -------------------------------------------------------------------
 # Define a typed dictionary for the conversation state.
@@ -318,28 +956,33 @@ class State(TypedDict):
     messages: Annotated[list, add_messages]
     # "step" tracks which step ID we are currently in, e.g. 150 or 200.
     step: int
+    # "record" is the medical record merged from every turn's medical_history delta.
+    record: Annotated[Dict[str, Any], merge_record]
+    # "crisis" is the crisis screen of the latest patient message:
+    # {"factors": [...matched risk factors], "acute": [...factors that escalate]}.
+    crisis: Dict[str, List[str]]
     
-# -------------------------------------------------------------------
-# Initialize memory for checkpointing and create the workflow state graph.
-# -------------------------------------------------------------------
-memory = MemorySaver()
-workflow = StateGraph(State)
-workflow.add_node("step_150", chain_150_get_familiar) 
-workflow.add_node("step_200", chain_200_depression_severity)
-workflow.add_node("step_300", chain_300_illness_history7)
-workflow.add_node("step_400", chain_400_antidepressant_history)
-workflow.add_node("step_500", chain_500_current_medications)
-workflow.add_node("step_600", chain_600_procedures)
-workflow.add_node("step_700", chain_700_suicide_risk_factors)
-workflow.add_node("step_800", chain_800_bipolar)
-workflow.add_node("step_900", chain_900_conversation_completed)
-workflow.add_node("step_1000", chain_1000_stop_interaction)
-workflow.add_node("prompt", prompt_gen_chain) # Node for generating the final prompt.
-
 # -------------------------------------------------------------------
 # Add a node to the workflow that adds a tool message indicating prompt generation.
 # -------------------------------------------------------------------
-@workflow.add_node
+def screen_message(state: State):
+    """
+    Crisis screen of the latest patient message (see intake_crisis.py), run
+    before any stage node. Acute matches notify the hooks here; route_start
+    then sends the turn straight to the stop stage.
+    """
+    messages = state.get("messages") or []
+    last = messages[-1] if messages else None
+    if not isinstance(last, HumanMessage):
+        return {"crisis": {"factors": [], "acute": []}}
+    result = screen(last.content)
+    for factor in result.factors:
+        CRISIS_SCREEN.inc(factor=factor, action="escalate" if factor in result.acute else "flag")
+    if result.escalate:
+        notify(get_config()["configurable"].get("thread_id"), result, last.content)
+    return {"crisis": {"factors": list(result.factors), "acute": list(result.acute)}}
+
+
 def add_tool_message(state: State):
     return {
         "messages": [
@@ -352,130 +995,301 @@ def add_tool_message(state: State):
     }
 
 # -------------------------------------------------------------------
-# Define transitions between states in the state graph.
+# Create the workflow state graph from a stage table.
 # -------------------------------------------------------------------
-workflow.add_conditional_edges( \
-    "step_150", get_state, ["add_tool_message", "step_150", "step_200", END])
-workflow.add_conditional_edges( \
-    "step_200", get_state, ["add_tool_message", "step_200", "step_300", END])
-workflow.add_conditional_edges( \
-    "step_300", get_state, ["add_tool_message", "step_300", "step_400", END])
-workflow.add_conditional_edges( \
-    "step_400", get_state, ["add_tool_message", "step_400", "step_500", END])
-workflow.add_conditional_edges( \
-    "step_500", get_state, ["add_tool_message", "step_500", "step_600", END])
-workflow.add_conditional_edges( \
-    "step_600", get_state, ["add_tool_message", "step_600", "step_700", END])
-workflow.add_conditional_edges( \
-    "step_700", get_state, ["add_tool_message", "step_700", "step_800", END])
-workflow.add_conditional_edges( \
-    "step_800", get_state, ["add_tool_message", "step_800", "step_900", END])
-workflow.add_conditional_edges( \
-    "step_900", get_state, ["add_tool_message", "step_900", END])
-workflow.add_conditional_edges( \
-    "step_1000", get_state, ["add_tool_message", END])
-
+def build_workflow(stages=STAGES, stop_stage: int = STOP_STAGE) -> StateGraph:
+    transitions = {stage.id: stage.next for stage in stages}
+    missing = ({n for n in transitions.values() if n is not None} | {stop_stage}) - transitions.keys()
+    if missing:
+        raise ValueError(f"Stage table references unknown stages: {sorted(missing)}")
+    first = stages[0].id
+    by_id = {stage.id: stage for stage in stages}
+    skips = {stage.id: stage.skip for stage in stages if stage.skip is not None}
+
+    def later_stages(stage: Stage):
+        seen = {stage.id}
+        while stage.next is not None and stage.next not in seen:
+            stage = by_id[stage.next]
+            seen.add(stage.id)
+            yield stage
+
+    workflow = StateGraph(State)
+    for stage in stages:
+        volunteer = volunteer_instruction(later.skip for later in later_stages(stage) if later.skip is not None)
+        workflow.add_node(node_name(stage.id), make_stage_node(stage, volunteer))
+    workflow.add_node("prompt", timed_node("prompt", prompt_gen_chain)) # Node for generating the final prompt.
+    workflow.add_node("add_tool_message", timed_node("add_tool_message", add_tool_message))
+    workflow.add_node("screen", timed_node("screen", screen_message))
+
+    # Every turn is screened first. It then resumes at the step stored in the
+    # thread's checkpoint, so a new human message continues the current stage
+    # instead of restarting, unless the screen escalates to the stop stage.
+    def route_start(state):
+        step = state.get("step") or first
+        crisis = state.get("crisis")
+        if crisis and crisis["acute"] and step != stop_stage:
+            return node_name(stop_stage)
+        return node_name(step)
+
+    workflow.add_edge(START, "screen")
+    workflow.add_conditional_edges("screen", route_start, [node_name(stage.id) for stage in stages])
+
+    # Define transitions between states in the state graph.
+    router = make_router(transitions, stop_stage, skips)
+    for stage in stages:
+        targets = ["add_tool_message", END]
+        # Completing a stage enters the next one, or a later one past stages that may be skipped.
+        for later in later_stages(stage):
+            targets.append(node_name(later.id))
+            if later.skip is None or later.skip.mode != SKIP:
+                break
+        if stage.id != stop_stage:
+            targets.append(node_name(stop_stage))
+        workflow.add_conditional_edges(node_name(stage.id), router, targets)
+
+    workflow.add_edge("add_tool_message", "prompt")
+    workflow.add_edge("prompt", END)
+    return workflow
 
-workflow.add_edge("add_tool_message", "prompt")
-workflow.add_edge("prompt", END)
-workflow.add_edge(START, f"step_{FIRST_NODE}")
-# Compile the workflow into a graph with memory checkpointing.
-graph = workflow.compile(checkpointer=memory)
 
 # -------------------------------------------------------------------
-# Render and save the state graph visualization.
+# Initialize memory for checkpointing and compile the default protocol.
 # -------------------------------------------------------------------
-
-
-# Display the graph as a Mermaid diagram within Jupyter Notebook.
-display(Image(graph.get_graph().draw_mermaid_png()))
-
-# Also, save the graph visualization as a PNG file.
-png_data = graph.get_graph().draw_mermaid_png()
-with open("graph.png", "wb") as f:
-    f.write(png_data)
-
+def build_checkpointer(path: Optional[str] = None, keep_last: Optional[int] = None, fence=None):
+    """
+    Return the checkpointer for the graph: SQLite (durable, pruned to the last
+    keep_last checkpoints per thread, each write checked by ``fence`` if given)
+    when a database path is configured, otherwise an in-process MemorySaver.
+    Both store messages in compact form (see intake_transcript).
+    """
+    path = path or os.environ.get(CHECKPOINT_DB_ENV)
+    if not path:
+        return MemorySaver(serde=CompactSerializer())
+    if keep_last is None:
+        keep_last = int(os.environ.get(CHECKPOINT_KEEP_ENV, "20"))
+    logger.info("Using SQLite checkpointer at %s (keep_last=%s)", path, keep_last)
+    return SqliteCheckpointSaver(path, keep_last=keep_last or None, serde=CompactSerializer(), fence=fence)
+
+
+# The default checkpointer, workflow and compiled graph are built on first
+# access (get_graph(), or the module attributes memory/workflow/graph), not
+# at import.
+_graph = None
+_memory = None
+_workflow = None
+
+
+def get_graph():
+    """Return the compiled default graph, building it on first use."""
+    global _graph, _memory, _workflow
+    if _graph is None:
+        with _init_lock:
+            if _graph is None:
+                _memory = build_checkpointer()
+                _workflow = build_workflow()
+                # Compile the workflow into a graph with memory checkpointing.
+                _graph = _workflow.compile(checkpointer=_memory)
+    return _graph
+
+
+def __getattr__(name):
+    # Module-level access to the lazily built objects (intake.graph, ...).
+    if name in ("llm", "llm_with_tool"):
+        return get_llm() if name == "llm" else get_llm_with_tool()
+    if name == "response_cache":
+        return get_response_cache()
+    if name in ("graph", "memory", "workflow"):
+        get_graph()
+        return globals()["_" + name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # -------------------------------------------------------------------
-# Begin the conversation with an initial agent output (agent jump-start)
+# Render the state graph visualization (offline).
+# The Mermaid source is produced locally and cached by a hash of the graph
+# topology (nodes and edges): rendering is skipped when the topology is
+# unchanged. The PNG needs the mermaid.ink web service and is only produced
+# on request.
 # -------------------------------------------------------------------
-print("Agent initiating conversation...\n")
+def topology_hash(drawable) -> str:
+    nodes = sorted(drawable.nodes)
+    edges = sorted((e.source, e.target, str(e.data), e.conditional) for e in drawable.edges)
+    return hashlib.sha256(json.dumps([nodes, edges]).encode()).hexdigest()[:16]
 
-state_data = {
-    "messages": [],
-    "step": FIRST_NODE
-}
-config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-
-# Perform an initial call to the state machine.
-output_iter = graph.stream(state_data, config=config, stream_mode="updates")
-last_output = None
-for i, last_output in enumerate(output_iter):
-    last_message = next(iter(last_output.values()))["messages"][-1]
-    d = parse_output(last_message)
-    print(f"AI: {d['response']}")
 
+def render_graph(path: str = "graph.mmd", png: bool = False, force: bool = False) -> bool:
+    """
+    Write the Mermaid diagram of the graph to path (and path with a .png
+    suffix when png=True). Returns False when the cached files already match
+    the current topology.
+    """
+    drawable = get_graph().get_graph()
+    digest = topology_hash(drawable)
+    base = os.path.splitext(path)[0]
+    hash_path = base + ".hash"
+    outputs = [path] + ([base + ".png"] if png else [])
+    if not force and all(os.path.exists(p) for p in outputs) and os.path.exists(hash_path):
+        with open(hash_path) as f:
+            if f.read().strip() == digest:
+                return False
+
+    with open(path, "w") as f:
+        f.write(drawable.draw_mermaid())
+    if png:
+        with open(base + ".png", "wb") as f:
+            f.write(drawable.draw_mermaid_png())
+    with open(hash_path, "w") as f:
+        f.write(digest)
+    logger.info("Rendered graph %s to %s", digest, ", ".join(outputs))
+    return True
+
+
+def display_graph():
+    """Display the graph as a Mermaid diagram within a Jupyter notebook."""
+    from IPython.display import Image, display
+    display(Image(get_graph().get_graph().draw_mermaid_png()))
 
 # -------------------------------------------------------------------
-# Begin a simulated interactive conversation loop.
+# Cold start: time a fresh interpreter importing this module and building
+# the graph, i.e. what a restarted worker pays before serving its first turn.
 # -------------------------------------------------------------------
-# Cached responses for non-interactive testing.
-
-# cached_human_responses = ["hi!", "rag prompt", "1 rag, 2 none, 3 no, 4 no", "red", "q"]
-# cached_response_index = 0
-# Generate a unique thread ID for the conversation configuration.
-config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-
-# state_data = {
-#     "messages": [],
-#     "step": 150
-# }
-
-# Infinite loop for conversation until user types 'q' or 'Q' to quit.
-while True:
-    
-    # try:
-    # Get user input from the terminal.
-    user = input("User (q/Q to quit): ")
-    # except:
-    #     # If input fails (e.g., non-interactive environment), use cached responses.
-    #     user = cached_human_responses[cached_response_index]
-    #     cached_response_index += 1
-    # print(f"User (q/Q to quit): {user}")
-    # Exit the loop if the user wants to quit.
-    if user in {"q", "Q"}:
-        print("AI: Byebye")
-        break
-    output = None
-    
+COLD_START_BUDGET = float(os.environ.get("INTAKE_COLD_START_BUDGET", "2.0"))
+
+_COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import ai_intake_system as intake
+imported = time.perf_counter()
+intake.get_graph()
+intake.get_llm()
+ready = time.perf_counter()
+print(json.dumps({"import": imported - start, "build": ready - imported, "total": ready - start}))
+"""
+
+
+def measure_cold_start(runs: int = 3) -> Dict[str, float]:
+    """Return the median import/build/total seconds over fresh interpreters."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _COLD_START_SCRIPT], env=env, cwd=here,
+                             capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: sorted(s[key] for s in samples)[len(samples) // 2] for key in samples[0]}
 
-    # Add the user's message to the conversation
-    state_data["messages"].append(HumanMessage(content=user))
 
-    # Now run the state machine in streaming mode
-    output_iter = graph.stream(state_data, config=config, stream_mode="updates")
-    
-    # Keep track of the final output from this turn
+# -------------------------------------------------------------------
+# Interactive console conversation (one patient).
+# For serving many patients concurrently, see intake_sessions.py.
+# -------------------------------------------------------------------
+def stream_turn(state_data, config, verbose=True):
+    """
+    Run one turn, printing the reply as it streams in, followed by the parsed
+    status and medical history of every node update when verbose.
+    """
     last_output = None
-    for i, last_output in enumerate(output_iter):
+    streamed = False
+    i = 0
+    for mode, chunk in get_graph().stream(state_data, config=config, stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            # Show the reply text while the rest of the JSON is generated.
+            if not streamed:
+                print("\nresponse:   " if verbose else "AI: ", end="")
+                streamed = True
+            print(chunk["delta"], end="", flush=True)
+            continue
 
-    # Stream the conversation through the state graph.
-    # for output in graph.stream(
-        # {"messages": [HumanMessage(content=user)]}, config=config, stream_mode="updates"
-    # ):
-        print(f'\niteration: {i}')
+        last_output = chunk
         # Extract the latest message from the streamed output.
         last_message = next(iter(last_output.values()))["messages"][-1]
-        # Pretty-print the last message.
-        # last_message.pretty_print()
-
         d = parse_output(last_message)
-        
-        print(f"response:   {d['response']}")
-        print(f"status:     {d['status']}")
-        print(f"med hx:     {d['medical_history']}")
-        
-
-    # If a prompt is generated, indicate completion.
-    if last_output and "prompt" in last_output:
-        print("Done!")
+
+        if streamed:
+            print()
+        elif verbose:
+            print(f'\niteration: {i}')
+            print(f"response:   {d['response']}")
+        else:
+            print(f"AI: {d['response']}")
+        if verbose:
+            print(f"status:     {d['status']}")
+            print(f"med hx:     {d['medical_history']}")
+        streamed = False
+        i += 1
+    return last_output
+
+
+def run_console():
+    # Generate a unique thread ID for the conversation configuration.
+    # The same thread is used for the opening turn and every later turn,
+    # so the checkpointer carries the messages and current step forward.
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    thread_id_var.set(config["configurable"]["thread_id"])
+
+    # ---------------------------------------------------------------
+    # Begin the conversation with an initial agent output (agent jump-start)
+    # ---------------------------------------------------------------
+    print("Agent initiating conversation...\n")
+
+    state_data = {
+        "messages": [],
+        "step": FIRST_NODE
+    }
+
+    # Perform an initial call to the state machine.
+    stream_turn(state_data, config, verbose=False)
+
+    # Infinite loop for conversation until user types 'q' or 'Q' to quit.
+    while True:
+
+        # Get user input from the terminal.
+        user = input("User (q/Q to quit): ")
+        # Exit the loop if the user wants to quit.
+        if user in {"q", "Q"}:
+            print("AI: Byebye")
+            break
+
+        # Only the new message is sent; earlier turns come from the checkpoint.
+        state_data = {"messages": [HumanMessage(content=user)]}
+
+        # Now run the state machine in streaming mode
+        last_output = stream_turn(state_data, config)
+
+        # If a prompt is generated, indicate completion.
+        if last_output and "prompt" in last_output:
+            print("Done!")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI intake system")
+    commands = parser.add_subparsers(dest="command")
+    chat = commands.add_parser("chat", help="interactive console conversation (default)")
+    chat.add_argument("--metrics-port", type=int, help="serve /metrics and /metrics.json on this port")
+    render = commands.add_parser("render", help="write the graph diagram (offline Mermaid source)")
+    render.add_argument("--out", default="graph.mmd", help="Mermaid output path")
+    render.add_argument("--png", action="store_true", help="also render a PNG (uses mermaid.ink)")
+    render.add_argument("--force", action="store_true", help="render even if the topology is unchanged")
+    coldstart = commands.add_parser("coldstart", help="measure import + graph build time")
+    coldstart.add_argument("--runs", type=int, default=3)
+    coldstart.add_argument("--budget", type=float, default=COLD_START_BUDGET,
+                           help="fail if the median total exceeds this many seconds")
+    args = parser.parse_args(argv)
+
+    if args.command == "render":
+        changed = render_graph(args.out, png=args.png, force=args.force)
+        print(f"{args.out}: {'rendered' if changed else 'unchanged'}")
+        return 0
+    if args.command == "coldstart":
+        timings = measure_cold_start(args.runs)
+        print(" ".join(f"{k}={v:.3f}s" for k, v in timings.items()) + f" budget={args.budget:.3f}s")
+        return 0 if timings["total"] <= args.budget else 1
+
+    setup_logging()
+    if getattr(args, "metrics_port", None):
+        serve_metrics(args.metrics_port)
+    run_console()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
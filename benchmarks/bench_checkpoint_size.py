@@ -0,0 +1,119 @@
+"""
+Offline benchmark of checkpoint size and serialization time.
+
+Runs scripted intakes on the replay backend, collects every checkpoint (and
+its pending writes) of each session, and re-serializes them with LangGraph's
+default JsonPlusSerializer and with ``intake_checkpoint.CompactSerializer``
+(compact Turn rows, zstd and zlib). Reports stored bytes per session, the size
+of the final checkpoint, and dumps/loads time per checkpoint (pending writes
+count towards stored bytes but are not timed):
+
+    python benchmarks/bench_checkpoint_size.py --sessions 5
+    python benchmarks/bench_checkpoint_size.py --json size.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+
+os.environ.setdefault("INTAKE_LLM_BACKEND", "replay")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Keep benchmark output quiet.
+logging.basicConfig(level=logging.WARNING)
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer  # noqa: E402
+
+import ai_intake_system as intake  # noqa: E402
+from intake_checkpoint import CompactSerializer, zstandard  # noqa: E402
+
+
+def serializers():
+    result = {"jsonplus": JsonPlusSerializer(), "compact.zlib": CompactSerializer(codec="zlib")}
+    if zstandard is not None:
+        result["compact.zstd"] = CompactSerializer(codec="zstd")
+    return result
+
+
+def run_session(answers=20):
+    """Drive one scripted intake to completion; return its checkpoints and pending writes, oldest first."""
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    payload = {"messages": [], "step": intake.FIRST_NODE}
+    for _ in range(answers + 1):
+        for _update in intake.graph.stream(payload, config=config, stream_mode="updates"):
+            pass
+        snapshot = intake.graph.get_state(config)
+        status = intake.parse_output(snapshot.values["messages"][-1])["status"]
+        if intake.is_finished(snapshot.values["step"], status):
+            break
+        payload = {"messages": [HumanMessage(content="yes")]}
+    checkpoints, writes = [], []
+    for saved in reversed(list(intake.graph.checkpointer.list(config))):
+        checkpoints.append(saved.checkpoint)
+        writes.extend(value for _task, _channel, value in saved.pending_writes or [])
+    return checkpoints, writes
+
+
+def measure(serde, sessions):
+    stored, final, dumps, loads = [], [], [], []
+    for checkpoints, writes in sessions:
+        blobs = []
+        for obj in checkpoints:
+            start = time.perf_counter()
+            blobs.append(serde.dumps_typed(obj))
+            dumps.append(time.perf_counter() - start)
+        for blob in blobs:
+            start = time.perf_counter()
+            serde.loads_typed(blob)
+            loads.append(time.perf_counter() - start)
+        final.append(len(blobs[-1][1]))
+        blobs.extend(serde.dumps_typed(obj) for obj in writes)
+        stored.append(sum(len(data) for _type, data in blobs))
+    return {
+        "bytes_per_session": statistics.median(stored),
+        "final_checkpoint_bytes": statistics.median(final),
+        "dumps_us": statistics.median(dumps) * 1e6,
+        "loads_us": statistics.median(loads) * 1e6,
+    }
+
+
+def check_round_trip(serde, sessions):
+    for checkpoints, writes in sessions:
+        for obj in checkpoints + writes:
+            if serde.loads_typed(serde.dumps_typed(obj)) != obj:
+                raise RuntimeError(f"{type(serde).__name__} did not round-trip a checkpoint")
+
+
+def run(sessions):
+    runs = [run_session() for _ in range(sessions)]
+    results = {}
+    for name, serde in serializers().items():
+        check_round_trip(serde, runs)
+        for metric, value in measure(serde, runs).items():
+            results[f"{name}.{metric}"] = value
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5, help="scripted intakes to collect checkpoints from")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.sessions)
+    for name, value in results.items():
+        print(f"{name:<36} {value:>12.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Offline benchmark of the intake framework's own per-turn overhead.
+
+Runs entirely on the scripted replay backend (no network, no API key), so the
+numbers measure graph routing, parsing, checkpointing and message handling
+rather than model latency. Typical CI usage:
+
+    python benchmarks/bench_overhead.py --json bench.json
+    python benchmarks/bench_overhead.py --baseline bench.json --tolerance 1.0
+
+With ``--baseline`` the script exits non-zero if any metric is slower than the
+baseline by more than ``tolerance`` (a fraction, 1.0 = twice as slow).
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+
+os.environ.setdefault("INTAKE_LLM_BACKEND", "replay")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Keep benchmark output quiet.
+logging.basicConfig(level=logging.WARNING)
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+from langgraph.graph.message import add_messages  # noqa: E402
+
+import ai_intake_system as intake  # noqa: E402
+from intake_llm import ScriptedChatModel, default_script, canned_reply  # noqa: E402
+
+STAGES = [stage.id for stage in intake.STAGES]
+
+
+def _time_per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def _completing_message(script, stage):
+    return AIMessage(content=script[stage][-1])
+
+
+def bench_routing(script, iterations):
+    """Time get_state (parse + transition) on a completing reply for each stage."""
+    results = {}
+    for stage in STAGES:
+        reply = intake.tag_stage(_completing_message(script, stage), stage)
+        state = {"messages": [HumanMessage(content="ok"), reply], "step": stage}
+        results[f"get_state.{stage}"] = _time_per_call(lambda: intake.get_state(state), iterations)
+    return results
+
+
+def bench_parse(script, iterations):
+    """Time parse_output (typed stage schema) on every scripted reply of each stage."""
+    results = {}
+    for stage in STAGES:
+        messages = [intake.tag_stage(AIMessage(content=r), stage) for r in script[stage]]
+        results[f"parse_output.{stage}"] = _time_per_call(
+            lambda: [intake.parse_output(m) for m in messages], iterations) / len(messages)
+    # Messages with an id are parsed once and then served from the cache.
+    cached = [intake.tag_stage(AIMessage(content=r, id=f"bench-{stage}-{i}"), stage)
+              for stage in STAGES for i, r in enumerate(script[stage])]
+    results["parse_output.cached"] = _time_per_call(
+        lambda: [intake.parse_output(m) for m in cached], iterations) / len(cached)
+    return results
+
+
+def run_session(answers=20):
+    """Drive one scripted intake to completion (at most ``answers`` replies), timing every turn and checkpoint read."""
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    turns = []
+    payload = {"messages": [], "step": intake.FIRST_NODE}
+    for _ in range(answers + 1):
+        start = time.perf_counter()
+        for _update in intake.graph.stream(payload, config=config, stream_mode="updates"):
+            pass
+        turn_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        snapshot = intake.graph.get_state(config)
+        read_time = time.perf_counter() - start
+
+        turns.append({
+            "turn": turn_time,
+            "checkpoint_read": read_time,
+            "messages": len(snapshot.values["messages"]),
+            "step": snapshot.values["step"],
+        })
+        status = intake.parse_output(snapshot.values["messages"][-1])["status"]
+        if intake.is_finished(snapshot.values["step"], status):
+            break
+        payload = {"messages": [HumanMessage(content="yes")]}
+    return turns, snapshot.values["messages"]
+
+
+def bench_sessions(sessions):
+    """Per-turn graph overhead and checkpoint reads over full intakes (150 -> 900)."""
+    runs = [run_session() for _ in range(sessions)]
+    results = {}
+    for i in range(len(runs[0][0])):
+        results[f"turn.{i:02d}"] = statistics.median(r[0][i]["turn"] for r in runs)
+        results[f"checkpoint_read.{i:02d}"] = statistics.median(r[0][i]["checkpoint_read"] for r in runs)
+    final_steps = {r[0][-1]["step"] for r in runs}
+    if final_steps != {900}:
+        raise RuntimeError(f"Scripted intake ended at {final_steps}, expected 900")
+    return results, runs[0][1]
+
+
+def bench_stop_path(sessions):
+    """Per-turn overhead when the patient stops at stage 400 (routes to 1000)."""
+    script = default_script()
+    script[400] = [script[400][0], canned_reply("Okay, we will stop here.", intake.STOP, {"antidepressant_history": {}})]
+    original = intake.llm
+    intake.configure_llm(ScriptedChatModel(script=script))
+    try:
+        runs = [run_session()[0] for _ in range(sessions)]
+    finally:
+        intake.configure_llm(original)
+    if {r[-1]["step"] for r in runs} != {1000}:
+        raise RuntimeError("Stop path did not reach stage 1000")
+    return {"stop_path.turn": statistics.median(t["turn"] for r in runs for t in r)}
+
+
+def bench_accumulation(history, iterations):
+    """Time the add_messages reducer as the history grows to a full intake."""
+    results = {}
+    new = [HumanMessage(content="yes", id="bench")]
+    for size in sorted({2, len(history) // 2, len(history)}):
+        prefix = history[:size]
+        results[f"add_messages.{size:02d}"] = _time_per_call(lambda: add_messages(prefix, new), iterations)
+    return results
+
+
+def run(iterations, sessions):
+    script = default_script()
+    results = {}
+    results.update(bench_routing(script, iterations))
+    results.update(bench_parse(script, iterations))
+    session_results, history = bench_sessions(sessions)
+    results.update(session_results)
+    results.update(bench_stop_path(sessions))
+    results.update(bench_accumulation(history, iterations))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return (metric, baseline, current) for metrics slower than baseline*(1+tolerance)."""
+    return [
+        (name, baseline[name], value)
+        for name, value in results.items()
+        if name in baseline and value > baseline[name] * (1 + tolerance)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500, help="calls per micro-benchmark")
+    parser.add_argument("--sessions", type=int, default=20, help="scripted intakes per session benchmark")
+    parser.add_argument("--json", help="write results (seconds per operation) to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json output")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="allowed slowdown vs baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations, args.sessions)
+    for name, value in results.items():
+        print(f"{name:<28} {value * 1e6:>12.1f} us")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before * 1e6:.1f} us -> {after * 1e6:.1f} us")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Batch (offline) intake runs over scripted patient transcripts.
+
+Each input line is one scripted patient:
+
+    {"id": "p001", "answers": ["I'm 42, female.", "Several days", ...]}
+
+Every conversation gets the agent's opening turn, then the answers in order,
+until the intake finishes or the answers run out. One output line is written
+per conversation with the final step and status, the merged medical_history
+and per-turn timings:
+
+    {"id": "p001", "thread_id": "...", "step": 900, "status": "complete",
+     "finished": true, "medical_history": {...},
+     "turns": [{"step": 150, "status": "in-progress", "latency": 0.81, ...}],
+     "elapsed": 12.3}
+
+Conversations are split into chunks that run on a process pool (``--workers``,
+default one per core); inside each worker up to ``--concurrency``
+conversations run at once on the asyncio session engine, so throughput scales
+with both cores and concurrent LLM calls. ``--workers 0`` runs in-process.
+
+    python intake_batch.py patients.jsonl results.jsonl --workers 4 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional
+
+import ai_intake_system as intake
+from intake_sessions import SessionEngine, summarize_latencies
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_conversations(path: str) -> List[Dict[str, Any]]:
+    """Read scripted conversations ({"id", "answers"}) from a JSONL file."""
+    conversations = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            answers = item.get("answers")
+            if not isinstance(answers, list):
+                raise ValueError(f"{path}:{line_number}: expected an 'answers' list")
+            conversations.append({"id": str(item.get("id", line_number)), "answers": answers})
+    return conversations
+
+
+def chunked(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# -------------------------------------------------------------------
+# Running conversations (inside a worker)
+# -------------------------------------------------------------------
+async def run_conversation(engine: SessionEngine, conversation: Dict[str, Any]) -> Dict[str, Any]:
+    """Drive one scripted conversation to completion and summarize it."""
+    thread_id = f"batch-{conversation['id']}-{uuid.uuid4().hex[:8]}"
+    start = time.perf_counter()
+    try:
+        turns = [await engine.start_session(thread_id)]
+        for answer in conversation["answers"]:
+            if turns[-1].finished:
+                break
+            turns.append(await engine.send(thread_id, answer))
+        snapshot = await engine.graph.aget_state({"configurable": {"thread_id": thread_id}})
+    except Exception as e:
+        logger.exception("Conversation %s failed", conversation["id"])
+        return {"id": conversation["id"], "thread_id": thread_id, "error": repr(e),
+                "elapsed": time.perf_counter() - start}
+    finally:
+        await engine.end_session(thread_id)
+
+    last = turns[-1]
+    return {
+        "id": conversation["id"],
+        "thread_id": thread_id,
+        "step": last.step,
+        "status": last.status,
+        "finished": last.finished,
+        "medical_history": intake.current_record(snapshot.values),
+        "turns": [
+            {"step": t.step, "status": t.status, "latency": t.latency,
+             "first_token_latency": t.first_token_latency}
+            for t in turns
+        ],
+        "elapsed": time.perf_counter() - start,
+    }
+
+
+async def run_conversations(conversations: List[Dict[str, Any]], concurrency: int) -> List[Dict[str, Any]]:
+    engine = SessionEngine(max_concurrent_turns=concurrency)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def bounded(conversation):
+        async with slots:
+            return await run_conversation(engine, conversation)
+
+    try:
+        return await asyncio.gather(*(bounded(c) for c in conversations))
+    finally:
+        await engine.close()
+
+
+# Every chunk a process runs shares one event loop: the async HTTP client of
+# intake_http (held by the chat models) is bound to the loop it was first used on.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def run_chunk(conversations: List[Dict[str, Any]], concurrency: int) -> List[Dict[str, Any]]:
+    """Process-pool entry point: run a chunk of conversations on the process's event loop."""
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(run_conversations(conversations, concurrency))
+
+
+# -------------------------------------------------------------------
+# Driver
+# -------------------------------------------------------------------
+def run_batch(conversations: List[Dict[str, Any]], output_path: str, workers: int, concurrency: int,
+              chunk_size: int) -> Dict[str, Any]:
+    """Run every conversation, writing results as chunks complete; return a summary."""
+    start = time.perf_counter()
+    results = 0
+    errors = 0
+    latencies: List[float] = []
+    with open(output_path, "w", encoding="utf-8") as out:
+        def write(chunk_results):
+            nonlocal results, errors
+            for result in chunk_results:
+                out.write(json.dumps(result) + "\n")
+                results += 1
+                errors += "error" in result
+                latencies.extend(t["latency"] for t in result.get("turns", []))
+            out.flush()
+
+        if workers == 0:
+            for chunk in chunked(conversations, chunk_size):
+                write(run_chunk(chunk, concurrency))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(run_chunk, chunk, concurrency)
+                           for chunk in chunked(conversations, chunk_size)]
+                for future in as_completed(futures):
+                    write(future.result())
+
+    elapsed = time.perf_counter() - start
+    return {
+        "conversations": results,
+        "errors": errors,
+        "elapsed": elapsed,
+        "conversations_per_second": results / elapsed if elapsed else 0.0,
+        "turn_latency": summarize_latencies(latencies),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL of scripted conversations")
+    parser.add_argument("output", help="JSONL results file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (0 = run in this process)")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent conversations per worker")
+    parser.add_argument("--chunk-size", type=int,
+                        help="conversations per task (default: 4 x concurrency, spread over all workers)")
+    args = parser.parse_args(argv)
+
+    conversations = load_conversations(args.input)
+    per_worker = -(-len(conversations) // max(args.workers, 1))
+    chunk_size = args.chunk_size or max(1, min(4 * args.concurrency, per_worker))
+    summary = run_batch(conversations, args.output, args.workers, args.concurrency, chunk_size)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
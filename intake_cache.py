@@ -0,0 +1,138 @@
+"""
+Content-addressed response cache for deterministic (temperature-0) LLM calls.
+
+Every stage call is fully determined by the model settings (name, temperature,
+bound tools, response format) and the message list, so identical requests -
+most visibly the opening turn of stage 150 that every session starts with, or
+a test session being replayed - can reuse the earlier reply.
+
+``ResponseCache`` is a LangChain ``BaseCache``: entries are keyed by a SHA-256
+of (llm_string, serialized messages), the same inputs LangChain's own cache
+lookup uses, so it can be passed as ``cache=`` to a chat model for
+non-streaming calls. Streaming calls bypass LangChain's cache, so the stage
+call site uses ``lookup_call``/``update_call`` with the same keys.
+
+Tiers:
+- memory: an LRU of at most ``max_entries`` replies;
+- disk (optional, ``path``): a SQLite table, shared across restarts and
+  processes; disk hits are promoted to memory.
+
+``stats`` counts memory_hits, disk_hits, misses and writes.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+
+from collections import Counter, OrderedDict
+from typing import Any, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+from langchain_core.runnables import RunnableBinding
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+def call_signature(model, messages: list) -> Optional[tuple]:
+    """
+    Return (prompt, llm_string) for a (possibly bound) chat model call, as
+    LangChain's cache would compute them, or None if the call is not
+    deterministic (temperature above 0).
+    """
+    kwargs = {}
+    while isinstance(model, RunnableBinding):
+        kwargs = {**model.kwargs, **kwargs}
+        model = model.bound
+    if getattr(model, "temperature", 0) not in (0, None):
+        return None
+    normalized = [m.model_copy(update={"id": None}) if getattr(m, "id", None) else m for m in messages]
+    return dumps(normalized), model._get_llm_string(**kwargs)
+
+
+class ResponseCache(BaseCache):
+    """Two-tier (LRU memory, optional SQLite disk) LLM response cache."""
+
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.path = path
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[str, list]" = OrderedDict()
+        self.stats = Counter(memory_hits=0, disk_hits=0, misses=0, writes=0)
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    # ---------------------------------------------------------------
+    # BaseCache interface
+    # ---------------------------------------------------------------
+    def lookup(self, prompt: str, llm_string: str) -> Optional[list]:
+        key = cache_key(prompt, llm_string)
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return value
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = [ChatGeneration(message=m) for m in messages_from_dict(json.loads(row[0]))]
+                    self._remember(key, value)
+                    self.stats["disk_hits"] += 1
+                    return value
+            self.stats["misses"] += 1
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        key = cache_key(prompt, llm_string)
+        value = list(return_val)
+        with self.lock:
+            self._remember(key, value)
+            self.stats["writes"] += 1
+            if self.conn is not None and all(isinstance(g, ChatGeneration) for g in value):
+                self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)",
+                                  (key, json.dumps([message_to_dict(g.message) for g in value])))
+
+    def clear(self, **kwargs: Any) -> None:
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM responses")
+
+    def _remember(self, key: str, value: list):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    # ---------------------------------------------------------------
+    # Call-site helpers (streaming calls)
+    # ---------------------------------------------------------------
+    def lookup_call(self, model, messages: list) -> Optional[AIMessage]:
+        """Return a cached reply for this model call, or None."""
+        signature = call_signature(model, messages)
+        if signature is None:
+            return None
+        generations = self.lookup(*signature)
+        if not generations:
+            return None
+        # A fresh id, so the reply is a new message in the conversation, and
+        # no usage, since no tokens were spent.
+        return generations[0].message.model_copy(update={"id": None, "usage_metadata": None}, deep=True)
+
+    def update_call(self, model, messages: list, message: AIMessage) -> None:
+        signature = call_signature(model, messages)
+        if signature is not None:
+            self.update(*signature, [ChatGeneration(message=message.model_copy(deep=True))])
+
+    def hit_rate(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
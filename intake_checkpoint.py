@@ -0,0 +1,412 @@
+"""
+Durable SQLite checkpointer for the intake graph.
+
+``SqliteCheckpointSaver`` stores LangGraph checkpoints in a SQLite file opened
+in WAL mode, so sessions survive a restart and can be resumed by
+``thread_id``. To keep disk and memory use flat:
+
+- Pending writes reported by a task are buffered in memory and committed in
+  the same transaction as the checkpoint that closes the super-step, so each
+  step costs one commit instead of one per write. Error and interrupt writes,
+  which may not be followed by a checkpoint, are committed immediately.
+- After each checkpoint only the last ``keep_last`` checkpoints of the thread
+  (and their writes) are kept; older ones are deleted.
+- ``CompactSerializer`` (the serde ``build_checkpointer`` installs) stores
+  message lists as compact ``intake_transcript.Turn`` rows and compresses
+  blobs with zstd (zlib if zstandard is not installed).
+- An optional ``fence(conn, config)`` runs inside each checkpoint's
+  transaction before anything is written and raises to refuse the write
+  (``intake_worker`` uses it to require the turn's lease on the thread).
+
+Usage:
+
+    saver = SqliteCheckpointSaver("sessions.db", keep_last=10)
+    graph = build_workflow().compile(checkpointer=saver)
+"""
+import asyncio
+import random
+import sqlite3
+import threading
+import zlib
+
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from intake_transcript import Turn, to_turns
+
+try:
+    import zstandard
+except ImportError:  # zlib is used instead
+    zstandard = None
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value BLOB NOT NULL,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+# Buffered write rows: (thread_id, ns, checkpoint_id, task_id, idx, channel, type, value, task_path)
+_WriteRow = Tuple[str, str, str, str, int, str, str, bytes, str]
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver[str]):
+    """LangGraph checkpointer backed by a SQLite file in WAL mode."""
+
+    def __init__(self, path: str, keep_last: Optional[int] = 20, synchronous: str = "NORMAL", *, serde=None,
+                 fence: Optional[Callable[[sqlite3.Connection, RunnableConfig], None]] = None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.keep_last = keep_last
+        self.fence = fence
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(_SCHEMA)
+        self._pending: List[_WriteRow] = []
+
+    def close(self):
+        with self.lock:
+            self._flush_writes()
+            self.conn.close()
+
+    # ---------------------------------------------------------------
+    # Writes
+    # ---------------------------------------------------------------
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_type, checkpoint_blob = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_blob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self.lock:
+            try:
+                with self._transaction():
+                    if self.fence is not None:
+                        self.fence(self.conn, config)
+                    self._insert_writes(self._pending)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                         checkpoint_type, checkpoint_blob, metadata_type, metadata_blob),
+                    )
+                    if self.keep_last:
+                        self._prune(thread_id, checkpoint_ns)
+            except BaseException:
+                # Keep other threads' buffered writes for their own next checkpoint.
+                self._pending = [row for row in self._pending if row[0] != thread_id]
+                raise
+            self._pending = []
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        special = False
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            special = special or write_idx < 0
+            value_type, value_blob = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx,
+                         channel, value_type, value_blob, task_path))
+        with self.lock:
+            self._pending.extend(rows)
+            if special:
+                # Errors and interrupts may end the run without another checkpoint.
+                self._flush_writes()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.lock:
+            self._pending = [row for row in self._pending if row[0] != thread_id]
+            with self._transaction():
+                self.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                self.conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    def _insert_writes(self, rows: List[_WriteRow]):
+        if not rows:
+            return
+        # Regular writes keep the first value (retries are idempotent);
+        # special writes (negative idx) replace the stored one.
+        self.conn.executemany("INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              [row for row in rows if row[4] >= 0])
+        self.conn.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              [row for row in rows if row[4] < 0])
+
+    def _flush_writes(self):
+        if self._pending:
+            with self._transaction():
+                self._insert_writes(self._pending)
+            self._pending = []
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        keep = (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last)
+        self.conn.execute(
+            """DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                   SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                   ORDER BY checkpoint_id DESC LIMIT ?)""", keep)
+        self.conn.execute(
+            """DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                   SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                   ORDER BY checkpoint_id DESC LIMIT ?)""", keep)
+
+    # ---------------------------------------------------------------
+    # Reads
+    # ---------------------------------------------------------------
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        with self.lock:
+            if checkpoint_id:
+                row = self.conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id)).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns)).fetchone()
+            if row is None:
+                return None
+            return self._to_tuple(row)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        query = "SELECT * FROM checkpoints"
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_id)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+            results = []
+            for row in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                item = self._to_tuple(row)
+                if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                results.append(item)
+        return iter(results)
+
+    def _to_tuple(self, row) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, ctype, cblob, mtype, mblob = row
+        writes = self.conn.execute(
+            "SELECT task_id, channel, type, value, task_path, idx FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+        pending = [(task_id, channel, vtype, value, task_path, idx)
+                   for (t, ns, cid, task_id, idx, channel, vtype, value, task_path) in self._pending
+                   if (t, ns, cid) == (thread_id, checkpoint_ns, checkpoint_id)]
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed((ctype, cblob)),
+            metadata=self.serde.loads_typed((mtype, mblob)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                  "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((vtype, value)))
+                for task_id, channel, vtype, value, _path, _idx in writes + pending
+            ],
+        )
+
+    # ---------------------------------------------------------------
+    # Async API: SQLite calls run in a worker thread so a commit never
+    # blocks the event loop.
+    # ---------------------------------------------------------------
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        # Usually only buffered in memory; flushed with the next checkpoint.
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# -------------------------------------------------------------------
+# Compact serializer
+# -------------------------------------------------------------------
+_TURN = "__turn__"
+_TURNS = "__turns__"
+
+
+def _compact(value):
+    """Replace messages (and lists of messages) nested in dicts/lists with Turn rows."""
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(v, BaseMessage) for v in value):
+            turns = to_turns(value)
+            if turns is not None:
+                return {_TURNS: [turn.pack() for turn in turns]}
+        return [_compact(v) for v in value]
+    if isinstance(value, BaseMessage):
+        turn = Turn.from_message(value)
+        if turn is not None:
+            return {_TURN: turn.pack()}
+    return value
+
+
+def _expand(value):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if _TURNS in value:
+                return [Turn.unpack(row).to_message() for row in value[_TURNS]]
+            if _TURN in value:
+                return Turn.unpack(value[_TURN]).to_message()
+        return {k: _expand(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_expand(v) for v in value]
+    return value
+
+
+class CompactSerializer(JsonPlusSerializer):
+    """
+    JsonPlusSerializer that stores messages as Turn rows and compresses blobs
+    of at least ``min_size`` bytes. Types are tagged "compact/<codec>/<type>";
+    blobs written by the plain serializer still load.
+    """
+
+    def __init__(self, *args, codec: Optional[str] = None, level: int = 3, min_size: int = 256, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codec = codec or ("zstd" if zstandard is not None else "zlib")
+        if self.codec == "zstd" and zstandard is None:
+            raise ImportError("The zstd codec needs the zstandard package")
+        self.level = level
+        self.min_size = min_size
+        self._local = threading.local()
+
+    def _zstd(self, kind: str):
+        # zstandard (de)compressors are not thread-safe; keep one pair per thread.
+        codec = getattr(self._local, kind, None)
+        if codec is None:
+            codec = (zstandard.ZstdCompressor(level=self.level) if kind == "compressor"
+                     else zstandard.ZstdDecompressor())
+            setattr(self._local, kind, codec)
+        return codec
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = super().dumps_typed(_compact(obj))
+        if type_ != "msgpack":
+            return type_, data
+        if len(data) < self.min_size:
+            return f"compact/raw/{type_}", data
+        if self.codec == "zstd":
+            return f"compact/zstd/{type_}", self._zstd("compressor").compress(data)
+        return f"compact/zlib/{type_}", zlib.compress(data, self.level)
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, blob = data
+        if not type_.startswith("compact/"):
+            return super().loads_typed(data)
+        _, codec, inner = type_.split("/", 2)
+        if codec == "zstd":
+            if zstandard is None:
+                raise ImportError("This checkpoint was written with zstd; install the zstandard package")
+            blob = self._zstd("decompressor").decompress(blob)
+        elif codec == "zlib":
+            blob = zlib.decompress(blob)
+        return _expand(super().loads_typed((inner, blob)))
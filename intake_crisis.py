@@ -0,0 +1,230 @@
+"""
+Local crisis screen run on every patient message before any LLM call.
+
+The phrases are grouped by the 15 suicide risk factors of
+``Prompt_0700_Suicide_Risk_Factors.md`` (``SUICIDE_RISK_FACTORS``) and
+compiled once into a single alternation with one named group per factor, so
+screening a message is one regex scan (microseconds) regardless of the
+conversation length or model latency.
+
+- Matches for the acute factors (``ACUTE_FACTORS``) escalate: the graph
+  routes straight to the stop stage, whose local handler (``crisis_stop_turn``)
+  replies without a model call, and every registered notification hook is
+  called (``add_crisis_hook``).
+- All other matches are passed to the model as flags in the stage prompt, so
+  it can ask about them and decide whether to raise an alert.
+- A match is not acute, and is passed on as a flag instead, when it is
+  negated (a negation at most two words before it in the same clause: "I'm
+  not suicidal", "never wanted to kill myself") or reported about someone
+  else (the clause's latest subject is a third party: "my brother was
+  suicidal"). Clauses end at punctuation and at and/but/so/because, and a
+  new subject starts a new clause, so "I can't sleep and I want to die" and
+  "I can't cope I want to die" still escalate.
+
+Positive and negative phrases are covered by ``test_intake_crisis.py``.
+
+The phrase lists are deliberately conservative; extend ``CRISIS_PHRASES`` for
+a study's population and language.
+"""
+import json
+import logging
+import re
+import uuid
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from intake_schemas import SUICIDE_RISK_FACTORS
+
+
+logger = logging.getLogger(__name__)
+
+# Regex fragments per risk factor (lowercase; matched on word boundaries).
+CRISIS_PHRASES: Dict[str, Tuple[str, ...]] = {
+    "active_suicidal_ideation": (
+        r"kill(?:ing)? myself", r"end(?:ing)? (?:my|it) (?:own )?life", r"end it all", r"take my (?:own )?life",
+        r"commit(?:ting)? suicide", r"suicidal", r"want(?:ed)? to die", r"(?:shoot|hang|drown) myself",
+    ),
+    "passive_suicidal_ideation": (
+        r"wish (?:i|that i) (?:was|were) dead", r"better off dead",
+        r"(?:want|wish|hope|pray)(?:ed)? (?:to |(?:that )?i (?:would |could |will |might )?|i'?d )?(?:not|never) wake up",
+        r"(?:go to sleep|fall asleep|sleep) and (?:not|never) wake up",
+        r"don'?t want to (?:be alive|live|exist)(?: anymore)?", r"no reason to (?:live|go on)",
+        r"tired of (?:living|being alive)",
+    ),
+    "suicidal_behavior": (
+        r"tried to (?:kill myself|end my life)", r"attempted suicide", r"suicide attempt",
+        r"took an overdose", r"overdosed",
+    ),
+    "non_suicidal_self_injury": (
+        r"(?:cut|cutting|burn|burning|burned|hurt|hurting|harm|harming) myself", r"self[- ]?harm(?:ing)?",
+    ),
+    "thwarted_belongingness": (
+        r"no ?one cares", r"nobody cares", r"(?:all|completely|totally) alone", r"don'?t belong",
+    ),
+    "burdensomeness": (
+        r"(?:a|such a) burden", r"better off without me",
+    ),
+    "hopelessness": (
+        r"hopeless", r"no hope", r"nothing (?:will|is going to) (?:ever )?get better", r"no future",
+    ),
+    "persistent_intolerable_pain": (
+        r"(?:unbearable|intolerable) pain", r"pain is (?:unbearable|too much)", r"can'?t (?:take|bear) the pain",
+    ),
+    "acute_exacerbation_of_mental_illness": (
+        r"hearing voices", r"stopped (?:taking )?my (?:meds|medications?|pills)", r"relapsed?",
+    ),
+    "preparatory_suicide_actions": (
+        r"(?:bought|got|have) a gun", r"(?:wrote|writing|written) (?:a|my) (?:suicide|goodbye) (?:note|letter)",
+        r"giving away my (?:things|stuff|belongings)", r"(?:stockpil\w*|saving up|saved up|collecting) (?:pills|meds)",
+    ),
+    "lack_of_sleep": (
+        r"can'?t sleep", r"haven'?t slept", r"insomnia", r"no sleep",
+    ),
+    "adverse_life_events": (
+        r"lost my (?:job|home|house)", r"got fired", r"passed away", r"divorce", r"death of my",
+    ),
+    "victimization": (
+        r"abused", r"abusive", r"bullied", r"assaulted", r"raped",
+    ),
+    "sexual_or_gender_dysphoria": (
+        r"gender dysphoria", r"dysphori[ac]",
+    ),
+    "impulsive_behavior": (
+        r"reckless", r"impulsive",
+    ),
+}
+assert set(CRISIS_PHRASES) == set(SUICIDE_RISK_FACTORS)
+
+# Factors that trigger immediate escalation.
+ACUTE_FACTORS = frozenset({
+    "active_suicidal_ideation",
+    "passive_suicidal_ideation",
+    "suicidal_behavior",
+    "preparatory_suicide_actions",
+})
+
+# Reply of the stop stage after an escalation.
+CRISIS_STOP_MESSAGE = (
+    "Thank you for telling me. I am stopping the questionnaire so a member of our care team can follow up "
+    "with you right away. If you are in immediate danger, please call your local emergency number now "
+    "(in the US, call or text 988)."
+)
+
+# One word boundary in front of the whole alternation (rather than per phrase)
+# and matching lowercased text keep a typical message to ~15 microseconds.
+_PATTERN = re.compile(
+    "\\b(?:" + "|".join(f"(?P<{factor}>{'|'.join(phrases)})" for factor, phrases in CRISIS_PHRASES.items())
+    + ")\\b"
+)
+# Negation and subject checks only look within the clause of a match, which
+# starts after the last clause break and at the clause's last subject.
+_CLAUSE_BREAK = re.compile(r"[,.;:!?]|\b(?:and|but|so|because)\b")
+# A negation at most two words before the match.
+_NEGATED = re.compile(r"\b(?:no|not|never|nor|don'?t|didn'?t|haven'?t|hasn'?t|wouldn'?t|won'?t|isn'?t|"
+                      r"aren'?t|wasn'?t|can'?t|doesn'?t)\b(?:\s+[\w']+){0,2}\s*$")
+# Subjects of a clause: a third party (tried first, so "my brother" is not read as "my") or the patient.
+_SUBJECT = re.compile(
+    r"\b(?:(?P<other>he|she|they|his|her|their|someone|(?:my|our|a) (?:brother|sister|mother|mom|father|dad|"
+    r"parents?|son|daughter|kids?|child|husband|wife|partner|boyfriend|girlfriend|friend|cousin|aunt|uncle|"
+    r"grand(?:mother|father|ma|pa)|neighbou?r|co-?worker|colleague|roommate|patient))"
+    r"|(?P<self>i|i'm|im|i've|i'd|me|my))\b"
+)
+
+
+class ScreenResult(NamedTuple):
+    factors: Tuple[str, ...]      # matched factors, in order of first appearance
+    acute: Tuple[str, ...]        # matched acute factors (not negated)
+
+    @property
+    def escalate(self) -> bool:
+        return bool(self.acute)
+
+
+NO_MATCH = ScreenResult((), ())
+
+
+def _clause_before(text: str, start: int) -> str:
+    """The text between the last clause boundary and ``start``."""
+    end = 0
+    for end_match in _CLAUSE_BREAK.finditer(text, 0, start):
+        end = end_match.end()
+    return text[end:start]
+
+
+def _is_acute(text: str, start: int) -> bool:
+    clause = _clause_before(text, start)
+    subject = None
+    for subject in _SUBJECT.finditer(clause):
+        pass
+    if subject is not None:
+        # A new subject opens a new clause: the "can't" of "I can't cope I want to die" is not its negation.
+        clause = clause[subject.start():]
+    if _NEGATED.search(clause):
+        return False
+    return subject is None or subject.lastgroup == "self"
+
+
+def screen(text) -> ScreenResult:
+    """Screen one patient message for crisis phrases."""
+    if not isinstance(text, str) or not text:
+        return NO_MATCH
+    factors: List[str] = []
+    acute: List[str] = []
+    text = text.lower()
+    for match in _PATTERN.finditer(text):
+        factor = match.lastgroup
+        if factor not in factors:
+            factors.append(factor)
+        if factor in ACUTE_FACTORS and factor not in acute and _is_acute(text, match.start()):
+            acute.append(factor)
+    if not factors:
+        return NO_MATCH
+    return ScreenResult(tuple(factors), tuple(acute))
+
+
+# -------------------------------------------------------------------
+# Notification hooks
+# -------------------------------------------------------------------
+_hooks: List[Callable[[Optional[str], ScreenResult, str], None]] = []
+
+
+def add_crisis_hook(hook: Callable[[Optional[str], ScreenResult, str], None]):
+    """Register hook(thread_id, result, text), called on every escalation."""
+    _hooks.append(hook)
+
+
+def notify(thread_id: Optional[str], result: ScreenResult, text: str):
+    logger.critical("Crisis screen escalation: thread=%s factors=%s", thread_id, ",".join(result.acute))
+    for hook in list(_hooks):
+        try:
+            hook(thread_id, result, text)
+        except Exception:
+            logger.exception("Crisis hook %r failed", hook)
+
+
+# -------------------------------------------------------------------
+# Prompt flags and the stop stage's local reply
+# -------------------------------------------------------------------
+def crisis_flags_note(factors) -> str:
+    return ("## Safety screen\n\n"
+            "The patient's latest message matched phrases for these suicide risk factors: "
+            + ", ".join(factors)
+            + ". Check with the patient as appropriate, and set status to \"alert\" if there is immediate risk.")
+
+
+def crisis_stop_turn(window: List, record: Dict) -> Optional[AIMessage]:
+    """Local handler of the stop stage: reply at once when it was entered by the crisis screen."""
+    last = window[-1] if window else None
+    if not isinstance(last, HumanMessage):
+        return None
+    result = screen(last.content)
+    if not result.escalate:
+        return None
+    content = json.dumps({
+        "response": CRISIS_STOP_MESSAGE,
+        "status": "complete",
+        "medical_history": {"stop_interaction": True, "reason": "crisis_screen: " + ", ".join(result.acute)},
+    })
+    return AIMessage(content=content, id=str(uuid.uuid4()))
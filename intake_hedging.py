@@ -0,0 +1,287 @@
+"""
+Per-call deadlines and hedged requests for stage LLM calls.
+
+``HedgePolicy.call`` / ``acall`` run one stage LLM call as a race of up to two
+attempts (each still admitted by the rate-limit scheduler):
+
+- Deadline: the call fails with ``DeadlineExceeded`` if no reply has arrived
+  by the stage's deadline (the ``deadline`` column of the stage registry,
+  else ``INTAKE_LLM_DEADLINE`` seconds, default 30; 0 disables), and the
+  stage answers with ``fallback_reply`` instead of leaving the patient
+  waiting. A reply that has arrived (been claimed, see below) by then is
+  never discarded: the call waits for it to finish. The race runs inside the
+  scheduler's admission (``ai_intake_system.call_stage_llm``), so time queued
+  for rate limits or a 429 backoff does not count.
+- Hedge (``INTAKE_LLM_HEDGE=1``): if no attempt has started replying after the
+  stage's observed p95 time to first reply (over its last ``window`` calls,
+  once ``min_samples`` are in), a duplicate request is fired and whichever
+  replies first wins.
+
+An attempt "claims" the reply when its first chunk arrives (streaming) or
+when it returns (non-streaming), through its ``Ticket``. Only the claiming
+attempt may stream deltas; the other one stops at its next chunk (or is
+cancelled, on the async path). A ticket is no longer wanted once the call
+gave up or the deadline passed, so an abandoned attempt sends no further
+request and cannot claim (or store) a reply. Hedges fired, won and lost are
+counted in ``intake_llm_hedges`` so the win rate per stage can be watched.
+
+On the sync path, calls with a deadline or a hedge run their attempts on a
+thread pool and the caller waits with a timeout; a call with neither runs in
+the caller's thread.
+"""
+import asyncio
+import collections
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from langchain_core.messages import AIMessage
+
+from intake_metrics import LLM_DEADLINES, LLM_HEDGES
+
+
+FALLBACK_MESSAGE = ("I'm sorry, this is taking longer than expected. "
+                    "Could you please repeat your last answer?")
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when no attempt of a stage LLM call finished before its deadline."""
+
+
+class HedgeLost(Exception):
+    """Raised inside an attempt that lost the race (or was abandoned at the deadline)."""
+
+
+class _Race:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.winner: Optional[int] = None
+        self.abandoned = False
+        # monotonic time after which no attempt is wanted (None = no deadline).
+        self.end: Optional[float] = None
+        self.claimed_at: Optional[float] = None
+        self.changed = threading.Event()
+
+
+class Ticket:
+    """One attempt's handle on a race."""
+    __slots__ = ("race", "attempt")
+
+    def __init__(self, race: _Race, attempt: int):
+        self.race = race
+        self.attempt = attempt
+
+    def wanted(self) -> bool:
+        """False once another attempt won, the call was abandoned, or the deadline passed unclaimed."""
+        race = self.race
+        if race.abandoned or race.winner not in (None, self.attempt):
+            return False
+        return race.winner is not None or race.end is None or time.monotonic() <= race.end
+
+    def claim(self) -> bool:
+        """Claim the reply for this attempt; True if it is (or already was) the winner."""
+        race = self.race
+        if race.winner == self.attempt:
+            return not race.abandoned
+        with race.lock:
+            if race.winner is None and not race.abandoned:
+                race.winner = self.attempt
+                race.claimed_at = time.monotonic()
+                race.changed.set()
+            return race.winner == self.attempt and not race.abandoned
+
+
+def fallback_reply() -> AIMessage:
+    """Stage reply used when the LLM call misses its deadline (the stage stays in progress)."""
+    content = json.dumps({"response": FALLBACK_MESSAGE, "status": "in-progress", "medical_history": {}})
+    return AIMessage(content=content, id=str(uuid.uuid4()), response_metadata={"fallback": "deadline"})
+
+
+class HedgePolicy:
+    def __init__(self, deadline: Optional[float] = 30.0, hedge: bool = False, quantile: float = 0.95,
+                 min_samples: int = 20, window: int = 200, max_workers: int = 64):
+        self.deadline = deadline or None
+        self.hedge = hedge
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.window = window
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        # Recent times to first reply per stage (seconds).
+        self.latencies: Dict[Any, Deque[float]] = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "HedgePolicy":
+        env = os.environ.get
+        return cls(deadline=float(env("INTAKE_LLM_DEADLINE", "30")), hedge=env("INTAKE_LLM_HEDGE", "0") == "1")
+
+    def hedge_delay(self, stage) -> Optional[float]:
+        """Seconds after which a duplicate request is fired, or None (hedging off or too few samples)."""
+        if not self.hedge:
+            return None
+        with self.lock:
+            samples = sorted(self.latencies[stage])
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(self.quantile * len(samples)))]
+
+    def _observe(self, stage, race: _Race, start: float):
+        if race.claimed_at is not None:
+            with self.lock:
+                self.latencies[stage].append(race.claimed_at - start)
+
+    def _settle(self, stage, race: _Race, hedged: bool):
+        if hedged:
+            LLM_HEDGES.inc(stage=stage, result="won" if race.winner == 1 else "lost")
+
+    @staticmethod
+    def _abandon(race: _Race) -> bool:
+        # At the deadline: give up unless an attempt has claimed the reply (checked
+        # under the race lock, so a claim cannot slip in between).
+        with race.lock:
+            if race.winner is None:
+                race.abandoned = True
+                race.changed.set()
+            return race.abandoned
+
+    @staticmethod
+    def _timeout(race: _Race, end: Optional[float]) -> Optional[float]:
+        # Once a reply has been claimed the call waits for it without a timeout.
+        if end is None or race.winner is not None:
+            return None
+        return max(0.0, end - time.monotonic())
+
+    def _deadline_exceeded(self, stage, race: _Race, deadline: Optional[float]):
+        race.abandoned = True
+        LLM_DEADLINES.inc(stage=stage)
+        return DeadlineExceeded(f"Stage {stage} LLM call exceeded its {deadline}s deadline")
+
+    # ---------------------------------------------------------------
+    # Sync path (attempts run on a thread pool)
+    # ---------------------------------------------------------------
+    def _submit(self, attempt: Callable[[Ticket], Any], ticket: Ticket):
+        if self._pool is None:
+            with self.lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="intake-llm")
+
+        def run():
+            try:
+                return attempt(ticket)
+            finally:
+                ticket.race.changed.set()
+
+        # Each attempt runs in a copy of the caller's context (graph config, stream writer, log context).
+        return self._pool.submit(contextvars.copy_context().run, run)
+
+    def call(self, stage, attempt: Callable[[Ticket], Any], deadline: Optional[float] = None) -> Any:
+        """Run attempt(ticket) under the stage's deadline, hedging it if it is slow to reply."""
+        deadline = deadline or self.deadline
+        hedge_after = self.hedge_delay(stage)
+        race = _Race()
+        if deadline is None and hedge_after is None:
+            # Nothing to wait for with a timeout: run in the caller's thread.
+            return attempt(Ticket(race, 0))
+
+        start = time.monotonic()
+        end = race.end = start + deadline if deadline else None
+        futures = {self._submit(attempt, Ticket(race, 0))}
+        hedged = False
+        if hedge_after is not None and (end is None or start + hedge_after < end):
+            race.changed.wait(hedge_after)
+            if race.winner is None and not any(f.done() for f in futures):
+                LLM_HEDGES.inc(stage=stage, result="fired")
+                futures.add(self._submit(attempt, Ticket(race, 1)))
+                hedged = True
+
+        error = None
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=self._timeout(race, end), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._observe(stage, race, start)
+                    self._settle(stage, race, hedged)
+                    return future.result()
+                if not isinstance(future.exception(), HedgeLost):
+                    error = future.exception()
+            if not done and self._abandon(race):
+                raise self._deadline_exceeded(stage, race, deadline)
+        if error is not None:
+            raise error
+        raise self._deadline_exceeded(stage, race, deadline)
+
+    # ---------------------------------------------------------------
+    # Async path (attempts are tasks; losers are cancelled)
+    # ---------------------------------------------------------------
+    async def acall(self, stage, attempt: Callable[[Ticket], Awaitable[Any]], deadline: Optional[float] = None) -> Any:
+        deadline = deadline or self.deadline
+        hedge_after = self.hedge_delay(stage)
+        if deadline is None and hedge_after is None:
+            return await attempt(Ticket(_Race(), 0))
+
+        race = _Race()
+        start = time.monotonic()
+        end = race.end = start + deadline if deadline else None
+        tasks = {asyncio.ensure_future(attempt(Ticket(race, 0)))}
+        hedged = False
+        try:
+            if hedge_after is not None and (end is None or start + hedge_after < end):
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done and race.winner is None:
+                    LLM_HEDGES.inc(stage=stage, result="fired")
+                    tasks.add(asyncio.ensure_future(attempt(Ticket(race, 1))))
+                    hedged = True
+
+            error = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self._timeout(race, end),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._observe(stage, race, start)
+                        self._settle(stage, race, hedged)
+                        return task.result()
+                    if not isinstance(task.exception(), HedgeLost):
+                        error = task.exception()
+                if not done and self._abandon(race):
+                    raise self._deadline_exceeded(stage, race, deadline)
+            if error is not None:
+                raise error
+            raise self._deadline_exceeded(stage, race, deadline)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def hedge_win_rate(stage) -> Optional[float]:
+    """Fraction of fired hedges that replied first for a stage (None if none fired)."""
+    fired = LLM_HEDGES.get(stage=stage, result="fired")
+    return LLM_HEDGES.get(stage=stage, result="won") / fired if fired else None
+
+
+_lock = threading.Lock()
+_policy: Optional[HedgePolicy] = None
+
+
+def get_hedge_policy() -> HedgePolicy:
+    """Return the process-wide policy, built from the environment on first use."""
+    global _policy
+    if _policy is None:
+        with _lock:
+            if _policy is None:
+                _policy = HedgePolicy.from_env()
+    return _policy
+
+
+def configure_hedging(policy: HedgePolicy):
+    global _policy
+    _policy = policy
@@ -0,0 +1,125 @@
+"""
+Shared, connection-pooled HTTP clients for the LLM backend.
+
+Every ChatOpenAI instance built by ``intake_llm.build_llm`` is given the same
+``httpx.Client`` / ``httpx.AsyncClient``, so all sessions reuse one pool of
+kept-alive (TLS) connections instead of handshaking per call, and every
+request has explicit connect/read timeouts. HTTP/2 is used when the ``h2``
+package is installed.
+
+Settings (environment, with defaults):
+
+- INTAKE_HTTP_MAX_CONNECTIONS (100): pool size limit.
+- INTAKE_HTTP_MAX_KEEPALIVE (20): idle connections kept open.
+- INTAKE_HTTP_KEEPALIVE_EXPIRY (30): seconds an idle connection is kept.
+- INTAKE_HTTP_CONNECT_TIMEOUT (5) / INTAKE_HTTP_READ_TIMEOUT (60): seconds.
+- INTAKE_HTTP2 (auto): "1" to require HTTP/2, "0" to disable it.
+
+The async client must be used from a single event loop (the session engine's).
+"""
+import importlib.util
+import os
+import threading
+
+from typing import NamedTuple, Optional
+
+import httpx
+
+
+class HttpSettings(NamedTuple):
+    max_connections: int = 100
+    max_keepalive: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 60.0
+    http2: Optional[bool] = None   # None = use HTTP/2 if h2 is installed
+
+    @classmethod
+    def from_env(cls) -> "HttpSettings":
+        env = os.environ.get
+        http2 = env("INTAKE_HTTP2", "auto")
+        return cls(
+            max_connections=int(env("INTAKE_HTTP_MAX_CONNECTIONS", cls._field_defaults["max_connections"])),
+            max_keepalive=int(env("INTAKE_HTTP_MAX_KEEPALIVE", cls._field_defaults["max_keepalive"])),
+            keepalive_expiry=float(env("INTAKE_HTTP_KEEPALIVE_EXPIRY", cls._field_defaults["keepalive_expiry"])),
+            connect_timeout=float(env("INTAKE_HTTP_CONNECT_TIMEOUT", cls._field_defaults["connect_timeout"])),
+            read_timeout=float(env("INTAKE_HTTP_READ_TIMEOUT", cls._field_defaults["read_timeout"])),
+            http2=None if http2 == "auto" else http2 != "0",
+        )
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive,
+                            keepalive_expiry=self.keepalive_expiry)
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+_lock = threading.Lock()
+_settings: Optional[HttpSettings] = None
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_settings() -> HttpSettings:
+    global _settings
+    if _settings is None:
+        _settings = HttpSettings.from_env()
+    return _settings
+
+
+def _client_kwargs(settings: HttpSettings) -> dict:
+    http2 = http2_available() if settings.http2 is None else settings.http2
+    return {"limits": settings.limits, "timeout": settings.timeout, "http2": http2}
+
+
+def get_http_client() -> httpx.Client:
+    """Return the process-wide pooled sync client."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(**_client_kwargs(get_settings()))
+    return _client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled async client."""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = httpx.AsyncClient(**_client_kwargs(get_settings()))
+    return _async_client
+
+
+def configure_http(settings: HttpSettings):
+    """Use new settings; clients are rebuilt on next use (existing ones are closed)."""
+    global _settings
+    close_http_clients()
+    _settings = settings
+
+
+def close_http_clients():
+    """Close the shared sync client and drop both clients (the async one is closed by aclose_http_clients)."""
+    global _client, _async_client
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _async_client = None
+
+
+async def aclose_http_clients():
+    global _async_client
+    client, _async_client = _async_client, None
+    if client is not None:
+        await client.aclose()
+    close_http_clients()
@@ -0,0 +1,294 @@
+"""
+Pluggable LLM backends for the intake graph.
+
+``build_llm`` returns the chat model used by every stage chain. The backend is
+chosen with the ``INTAKE_LLM_BACKEND`` environment variable:
+
+- ``openai`` (default): ``ChatOpenAI`` with gpt-4o over the shared pooled
+  HTTP client of ``intake_http``; the API key is read from
+  ``OPENAI_API_KEY`` or the key file two directories above this script.
+- ``replay``: ``ScriptedChatModel``, an offline stand-in that returns canned
+  ``IntakeOutput`` JSON per stage. Set ``INTAKE_REPLAY_SCRIPT`` to a JSON file
+  ({"150": [reply, ...], ...}) to replay recorded replies instead of the
+  built-in script.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+from functools import cached_property
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+BACKEND_ENV = "INTAKE_LLM_BACKEND"
+REPLAY_SCRIPT_ENV = "INTAKE_REPLAY_SCRIPT"
+DEFAULT_MODEL = "gpt-4o"
+
+# Every stage prompt names its phase as "ID <number>".
+_STAGE_ID = re.compile(r"\bID (\d+)\b")
+
+
+# -------------------------------------------------------------------
+# Model tiers. Stages name the tiers they may use, cheapest first (see the
+# tiers column of the stage registry); a reply that fails validation on one
+# tier is escalated to the next.
+# -------------------------------------------------------------------
+class ModelTier(NamedTuple):
+    name: str
+    model_name: str
+    # USD per million prompt / completion tokens (for the cost metrics).
+    input_cost: float
+    output_cost: float
+
+    def cost(self, usage: Dict[str, int]) -> float:
+        return (usage.get("input_tokens", 0) * self.input_cost
+                + usage.get("output_tokens", 0) * self.output_cost) / 1e6
+
+
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+MODEL_TIERS = {
+    TIER_SMALL: ModelTier(TIER_SMALL, os.environ.get("INTAKE_MODEL_SMALL", "gpt-4o-mini"), 0.15, 0.60),
+    TIER_LARGE: ModelTier(TIER_LARGE, os.environ.get("INTAKE_MODEL_LARGE", DEFAULT_MODEL), 2.50, 10.00),
+}
+
+
+def build_tier_llm(tier: str, backend: Optional[str] = None) -> BaseChatModel:
+    return build_llm(backend, model_name=MODEL_TIERS[tier].model_name)
+
+
+# -------------------------------------------------------------------
+# OpenAI backend
+# -------------------------------------------------------------------
+def load_api_key(path: Optional[str] = None):
+    """
+    Make sure OPENAI_API_KEY is set, reading it from the key file if needed.
+    """
+    if os.environ.get("OPENAI_API_KEY"):
+        return
+    if path is None:
+        # The API key file lives two directories above this script.
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(script_dir, '..', '..', 'OPENAI_API_KEY')
+    # Read the API key from the file, remove any extra whitespace, and set it as an environment variable.
+    with open(path, 'r') as key_file:
+        os.environ["OPENAI_API_KEY"] = key_file.read().strip()
+
+
+def build_llm(backend: Optional[str] = None, model_name: str = DEFAULT_MODEL) -> BaseChatModel:
+    """Instantiate the chat model for the selected backend."""
+    backend = backend or os.environ.get(BACKEND_ENV, "openai")
+    if backend == "openai":
+        from langchain_openai import ChatOpenAI
+        from intake_http import get_async_http_client, get_http_client, get_settings
+
+        load_api_key()
+        # Deterministic output (temperature=0); stream_usage reports token
+        # counts on streamed replies too (see intake_metrics). All instances
+        # share one pooled keep-alive HTTP client (see intake_http). Rate-limit
+        # retries are left to the central scheduler (see intake_scheduler).
+        return ChatOpenAI(temperature=0, model_name=model_name, stream_usage=True,
+                          http_client=get_http_client(), http_async_client=get_async_http_client(),
+                          request_timeout=get_settings().timeout, max_retries=0)
+    if backend == "replay":
+        script_path = os.environ.get(REPLAY_SCRIPT_ENV)
+        if script_path:
+            return ScriptedChatModel.from_file(script_path)
+        return ScriptedChatModel(script=default_script())
+    raise ValueError(f"Unknown LLM backend {backend!r} (expected 'openai' or 'replay')")
+
+
+# -------------------------------------------------------------------
+# Scripted / replay backend
+# -------------------------------------------------------------------
+def canned_reply(response: str, status: str, medical_history: Dict[str, Any]) -> str:
+    return json.dumps({"response": response, "status": status, "medical_history": medical_history})
+
+
+def default_script() -> Dict[int, List[str]]:
+    """
+    Canned replies for a patient who completes every stage after one answer.
+
+    Each stage gets an opening question (status in-progress) followed by a
+    completing reply whose medical_history mirrors the stage prompt schema.
+    """
+    phq9 = [{"question_number": i, "answer": "several days"} for i in range(1, 10)]
+    no_bipolar_symptoms = {f"rms_q{i}": False for i in range(1, 7)}
+    no_bipolar_symptoms["likely_bipolar_depression"] = False
+    return {
+        150: [
+            canned_reply("How are you feeling today?", "in-progress",
+                         {"demographics": {"age": "", "gender": ""}}),
+            canned_reply("Thank you. Next I will ask about your mood.", "complete",
+                         {"demographics": {"age": "42", "gender": "female"}}),
+        ],
+        200: [
+            canned_reply("Over the last 2 weeks, how often have you had little interest or pleasure in doing things?",
+                         "in-progress", {"phq9_responses": [], "depression_severity": None}),
+            canned_reply("Thank you, I have recorded your PHQ-9 answers.", "complete",
+                         {"phq9_responses": phq9, "depression_severity": "moderate"}),
+        ],
+        300: [
+            canned_reply("Have you ever been diagnosed with any medical or mental health conditions?",
+                         "in-progress", {"diagnoses": []}),
+            canned_reply("Thank you for sharing your diagnoses.", "complete",
+                         {"diagnoses": [{"phrase": "depression", "snomed_code": "35489007",
+                                         "snomed_name": "Depressive disorder"}]}),
+        ],
+        400: [
+            canned_reply("Have you ever taken an antidepressant?", "in-progress",
+                         {"antidepressant_history": {}}),
+            canned_reply("Thank you for the antidepressant history.", "complete",
+                         {"antidepressant_history": {"SERTRALINE": {"taken": True, "remission": False}}}),
+        ],
+        500: [
+            canned_reply("What medications are you currently taking?", "in-progress", {"medications": []}),
+            canned_reply("Thank you, I have your current medications.", "complete",
+                         {"medications": [{"phrase": "sertraline 50mg", "rxnorm_code": "36437",
+                                           "generic_name": "sertraline"}]}),
+        ],
+        600: [
+            canned_reply("Have you had any medical procedures?", "in-progress", {"procedures": []}),
+            canned_reply("Thank you for telling me about your procedures.", "complete",
+                         {"procedures": [{"phrase": "appendix removed", "snomed_code": "80146002",
+                                          "snomed_name": "Appendectomy"}]}),
+        ],
+        700: [
+            canned_reply("Have you had trouble sleeping recently?", "in-progress", {"suicide_risk_profile": []}),
+            canned_reply("Thank you for answering these difficult questions.", "complete",
+                         {"suicide_risk_profile": ["lack_of_sleep"]}),
+        ],
+        800: [
+            canned_reply("Have you ever had a week where you felt much more energetic than usual?",
+                         "in-progress", {"bipolar_screening": no_bipolar_symptoms}),
+            canned_reply("Thank you, that completes the screening questions.", "complete",
+                         {"bipolar_screening": no_bipolar_symptoms}),
+        ],
+        900: [
+            canned_reply("Based on your answers, we recommend following up with your clinician. Any questions?",
+                         "in-progress", {"conversation_completed": False, "final_recommendation_provided": True,
+                                         "client_questions_answered_via_pubmed": []}),
+            canned_reply("Thank you for completing the intake.", "complete",
+                         {"conversation_completed": True, "final_recommendation_provided": True,
+                          "client_questions_answered_via_pubmed": []}),
+        ],
+        1000: [
+            canned_reply("Unfortunately, there is an issue with our monitor, so we must discontinue the session at this time.",
+                         "complete", {"stop_interaction": True, "reason": "monitor_unavailable"}),
+        ],
+    }
+
+
+def stage_of(messages: List[BaseMessage]) -> Optional[int]:
+    """Return the stage ID named in the leading system prompt, if any."""
+    for m in messages:
+        if isinstance(m, SystemMessage):
+            match = _STAGE_ID.search(m.content)
+            if match:
+                return int(match.group(1))
+    return None
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Deterministic chat model that replays canned replies per stage.
+
+    The stage is read from the system prompt. The n-th call for a stage in a
+    conversation returns the n-th scripted reply, where n is the number of
+    replies from that stage's script already present in the history; the last
+    reply repeats once the script is exhausted. Because the position is derived
+    from the messages alone, replay is stable across threads and restarts.
+    """
+    script: Dict[int, List[str]]
+    # Simulated model latency in seconds (0 for pure overhead measurements).
+    latency: float = 0.0
+    # Characters per chunk when streaming.
+    chunk_size: int = 8
+    model_name: str = "scripted-replay"
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ScriptedChatModel":
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        script = {
+            int(stage): [r if isinstance(r, str) else json.dumps(r) for r in replies]
+            for stage, replies in raw.items()
+        }
+        return cls(script=script, **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-replay"
+
+    @cached_property
+    def script_hash(self) -> str:
+        return hashlib.sha256(json.dumps(self.script, sort_keys=True).encode()).hexdigest()[:16]
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        # The script is part of the model's identity (e.g. for response caching).
+        return {"model_name": self.model_name, "script": self.script_hash}
+
+    def bind_tools(self, tools, **kwargs):
+        # Tools are accepted (and become part of the bound kwargs) but never called.
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _next_reply(self, messages: List[BaseMessage]) -> str:
+        stage = stage_of(messages)
+        if stage not in self.script:
+            raise KeyError(f"No scripted replies for stage {stage}")
+        replies = self.script[stage]
+        known = set(replies)
+        position = sum(1 for m in messages if isinstance(m, AIMessage) and m.content in known)
+        return replies[min(position, len(replies) - 1)]
+
+    @staticmethod
+    def _usage(messages: List[BaseMessage], reply: str) -> Dict[str, int]:
+        # Rough token estimate (4 characters per token) so replay runs exercise token metrics.
+        prompt = sum(len(m.content) for m in messages if isinstance(m.content, str)) // 4
+        completion = len(reply) // 4
+        return {"input_tokens": prompt, "output_tokens": completion, "total_tokens": prompt + completion}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        reply = self._next_reply(messages)
+        message = AIMessage(content=reply, usage_metadata=self._usage(messages, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        reply = self._next_reply(messages)
+        message = AIMessage(content=reply, usage_metadata=self._usage(messages, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, messages):
+        reply = self._next_reply(messages)
+        pieces = [reply[i:i + self.chunk_size] for i in range(0, len(reply), self.chunk_size)] or [""]
+        chunks = [AIMessageChunk(content=piece) for piece in pieces]
+        # Like OpenAI with stream_usage, the last chunk reports the usage.
+        chunks[-1].usage_metadata = self._usage(messages, reply)
+        return chunks, self.latency / len(chunks)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks, delay = self._chunks(messages)
+        for chunk in chunks:
+            if delay:
+                time.sleep(delay)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks, delay = self._chunks(messages)
+        for chunk in chunks:
+            if delay:
+                await asyncio.sleep(delay)
+            yield ChatGenerationChunk(message=chunk)
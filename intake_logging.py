@@ -0,0 +1,158 @@
+"""
+Non-blocking, structured logging for the intake system.
+
+``setup_logging`` installs a ``QueueHandler`` on the root logger, so logging
+calls on the request path only format the record and put it on a queue; a
+``QueueListener`` thread writes the records to a size-rotated file as JSON
+lines:
+
+    {"ts": "...", "level": "INFO", "logger": "intake_sessions",
+     "thread_id": "…", "stage": 200, "msg": "..."}
+
+``thread_id`` and ``stage`` come from context variables set with
+``log_context`` (the session engine sets the thread, the stage nodes set the
+stage), so every record of a turn can be correlated without passing them
+around. Messages longer than ``max_chars`` are truncated and API keys are
+masked before the record leaves the calling thread, and the chatty HTTP client
+loggers (which log whole request bodies at DEBUG) are capped at WARNING.
+
+Settings can also come from the environment: INTAKE_LOG_FILE,
+INTAKE_LOG_LEVEL, INTAKE_LOG_MAX_CHARS, INTAKE_LOG_MAX_BYTES,
+INTAKE_LOG_BACKUPS.
+"""
+import atexit
+import contextlib
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+
+from typing import Optional
+
+
+LOG_FILE = "ai_intake_system.log"
+DEFAULT_MAX_CHARS = 2000
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+# Loggers that dump full request/response bodies at DEBUG/INFO.
+NOISY_LOGGERS = ("httpx", "httpcore", "openai", "urllib3", "hpack")
+
+thread_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("intake_thread_id", default=None)
+stage_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("intake_stage", default=None)
+
+_SECRETS = re.compile(r"(sk-[A-Za-z0-9_\-]{8})[A-Za-z0-9_\-]+|(Bearer\s+)\S+")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+@contextlib.contextmanager
+def log_context(thread_id: Optional[str] = None, stage: Optional[int] = None):
+    """Tag every record logged inside the block with thread_id and/or stage."""
+    tokens = []
+    if thread_id is not None:
+        tokens.append((thread_id_var, thread_id_var.set(thread_id)))
+    if stage is not None:
+        tokens.append((stage_var, stage_var.set(stage)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Attach the session context to each record and cap/redact its message.
+
+    Runs on the QueueHandler, i.e. in the thread (and asyncio task) that
+    logged, where the context variables are visible.
+    """
+
+    def __init__(self, max_chars: int = DEFAULT_MAX_CHARS):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.thread_id = thread_id_var.get()
+        record.stage = stage_var.get()
+        message = _SECRETS.sub(lambda m: (m.group(1) or m.group(2)) + "***", record.getMessage())
+        if self.max_chars and len(message) > self.max_chars:
+            message = f"{message[:self.max_chars]}... [truncated {len(message) - self.max_chars} chars]"
+        record.msg, record.args = message, None
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format a record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread_id": getattr(record, "thread_id", None),
+            "stage": getattr(record, "stage", None),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(filename: Optional[str] = None, level=None, max_chars: Optional[int] = None,
+                  max_bytes: Optional[int] = None, backups: Optional[int] = None) -> logging.handlers.QueueListener:
+    """
+    Route all logging through a queue to a rotating JSON-lines file.
+
+    Calling it again replaces the previous configuration. The listener is
+    stopped (and the queue drained) at interpreter exit.
+    """
+    global _listener
+    env = os.environ.get
+    filename = filename or env("INTAKE_LOG_FILE", LOG_FILE)
+    level = level or env("INTAKE_LOG_LEVEL", "INFO")
+    max_chars = int(env("INTAKE_LOG_MAX_CHARS", DEFAULT_MAX_CHARS)) if max_chars is None else max_chars
+    max_bytes = int(env("INTAKE_LOG_MAX_BYTES", DEFAULT_MAX_BYTES)) if max_bytes is None else max_bytes
+    backups = int(env("INTAKE_LOG_BACKUPS", DEFAULT_BACKUPS)) if backups is None else backups
+
+    shutdown_logging()
+    file_handler = logging.handlers.RotatingFileHandler(
+        filename, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    file_handler.setFormatter(JsonLinesFormatter())
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter(max_chars))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,310 @@
+"""
+In-process metrics for the intake system.
+
+A small, dependency-free set of Prometheus-style instruments (``Counter``,
+``Gauge``, ``Histogram``), all labelled and thread-safe, registered on a
+module-level ``REGISTRY``. The graph nodes, LLM calls, parser and session
+engine update the instruments defined at the bottom of this module; the
+registry can be read as Prometheus text exposition (``render_prometheus``),
+as a JSON-serializable dict (``to_json``), or served over HTTP:
+
+    server = serve_metrics(9100)     # GET /metrics, GET /metrics.json
+
+Example: the p95 of stage 700 is visible as
+``intake_node_seconds_bucket{node="step_700",le=...}``.
+"""
+import bisect
+import json
+import math
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+# Seconds; covers local nodes (ms) up to slow LLM calls (tens of seconds).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base class: a named family of values keyed by label values."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[LabelValues, object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Return (suffix, label string, value) exposition samples."""
+        raise NotImplementedError
+
+    def snapshot(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [("_total", _format_labels(self.labelnames, k), v) for k, v in sorted(items)]
+
+    def snapshot(self):
+        with self.lock:
+            return [{"labels": dict(zip(self.labelnames, k)), "value": v} for k, v in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        return [("", labels, v) for _suffix, labels, v in super().samples()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Estimate a quantile from the buckets (upper bound of the matching bucket)."""
+        with self.lock:
+            entry = self.values.get(self._key(labels))
+            if not entry or not entry[2]:
+                return None
+            counts, total = list(entry[0]), entry[2]
+        rank, cumulative = q * total, 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def samples(self):
+        with self.lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in sorted(self.values.items())]
+        out = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                out.append(("_bucket", _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"'),
+                            cumulative))
+            out.append(("_sum", _format_labels(self.labelnames, key), total))
+            out.append(("_count", _format_labels(self.labelnames, key), count))
+        return out
+
+    def snapshot(self):
+        with self.lock:
+            items = sorted(self.values.items())
+            return [{
+                "labels": dict(zip(self.labelnames, k)),
+                "count": v[2],
+                "sum": v[1],
+                "buckets": dict(zip([_format_value(b) for b in self.buckets + (math.inf,)], v[0])),
+            } for k, v in items]
+
+
+class Registry:
+    """A set of metrics with Prometheus text and JSON output."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> Dict[str, dict]:
+        return {
+            name: {"type": metric.kind, "help": metric.documentation, "values": metric.snapshot()}
+            for name, metric in list(self.metrics.items())
+        }
+
+
+REGISTRY = Registry()
+
+
+# -------------------------------------------------------------------
+# HTTP endpoint
+# -------------------------------------------------------------------
+def serve_metrics(port: int = 9100, host: str = "127.0.0.1", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = registry.render_prometheus().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                body = json.dumps(registry.to_json()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="intake-metrics", daemon=True).start()
+    return server
+
+
+# -------------------------------------------------------------------
+# Intake instruments
+# -------------------------------------------------------------------
+NODE_SECONDS = REGISTRY.histogram(
+    "intake_node_seconds", "Wall time of each graph node execution.", ["node"])
+LLM_SECONDS = REGISTRY.histogram(
+    "intake_llm_seconds", "Wall time of each stage LLM call.", ["stage"])
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "intake_llm_first_token_seconds", "Time to the first streamed chunk of a stage LLM call.", ["stage"])
+LLM_TOKENS = REGISTRY.counter(
+    "intake_llm_tokens", "Tokens reported by the model, by stage and kind (prompt/completion).", ["stage", "kind"])
+LLM_WAIT_SECONDS = REGISTRY.histogram(
+    "intake_llm_wait_seconds", "Time LLM calls waited for the rate-limit scheduler, by priority.", ["priority"])
+LLM_RATE_LIMITED = REGISTRY.counter(
+    "intake_llm_rate_limited", "Rate-limit (429) errors retried by the scheduler.", ["stage"])
+LLM_HEDGES = REGISTRY.counter(
+    "intake_llm_hedges", "Hedged duplicate LLM requests fired, and whether they won or lost the race.",
+    ["stage", "result"])
+LLM_DEADLINES = REGISTRY.counter(
+    "intake_llm_deadlines", "Stage LLM calls that missed their deadline and got the fallback reply.", ["stage"])
+LLM_TIER_SECONDS = REGISTRY.histogram(
+    "intake_llm_tier_seconds", "Duration of LLM calls per model tier.", ["tier"])
+LLM_COST = REGISTRY.counter(
+    "intake_llm_cost_usd", "Estimated LLM cost in USD from reported token usage, per stage and model tier.",
+    ["stage", "tier"])
+LLM_ESCALATIONS = REGISTRY.counter(
+    "intake_llm_escalations", "Stage calls escalated from a model tier to the next (reason: invalid/error).",
+    ["stage", "tier", "reason"])
+LLM_CACHE = REGISTRY.counter(
+    "intake_llm_cache", "Stage LLM calls served from the response cache (hit) or the model (miss).",
+    ["stage", "result"])
+STAGE_SKIPS = REGISTRY.counter(
+    "intake_stage_skips", "Stages routed past (skip) or cut to one confirmation turn (confirm) because the "
+    "record already answered them.", ["stage", "action"])
+LOCAL_TURNS = REGISTRY.counter(
+    "intake_local_turns", "Stage turns answered by a local handler without an LLM call.", ["stage"])
+CRISIS_SCREEN = REGISTRY.counter(
+    "intake_crisis_screen", "Crisis screen matches per risk factor, by action (escalate/flag).", ["factor", "action"])
+TURNS = REGISTRY.counter(
+    "intake_turns", "Agent turns produced by each stage.", ["stage"])
+PARSE_RESULTS = REGISTRY.counter(
+    "intake_parse_results", "Replies that failed the stage schema (schema_mismatch) or all parsing (fallback).",
+    ["stage", "result"])
+ACTIVE_SESSIONS = REGISTRY.gauge(
+    "intake_active_sessions", "Sessions currently open in the session engine.")
+SESSIONS_EVICTED = REGISTRY.counter(
+    "intake_sessions_evicted", "Sessions ended by the session engine for inactivity, by reason (idle/finished).",
+    ["reason"])
+HTTP_REQUESTS = REGISTRY.counter(
+    "intake_http_requests", "Requests handled by the HTTP front end, by route and status code.", ["route", "status"])
+WS_DROPPED = REGISTRY.counter(
+    "intake_ws_dropped_deltas", "Streamed reply pieces dropped because a WebSocket client was not reading.")
+
+
+def record_usage(stage, message):
+    """Add a reply's usage_metadata (if the backend reports it) to the token counters."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        LLM_TOKENS.inc(usage.get("input_tokens", 0), stage=stage, kind="prompt")
+        LLM_TOKENS.inc(usage.get("output_tokens", 0), stage=stage, kind="completion")
@@ -0,0 +1,159 @@
+"""
+Local fast path for stage 200 (PHQ-9 depression severity).
+
+The nine PHQ-9 items and their four answer options are fixed, so most of the
+stage needs no model call: ``phq9_turn`` is the stage's local handler (see the
+``local`` column of the stage registry). It
+
+- opens the stage by asking item 1 from a template;
+- codes standard frequency answers ("2", "several days", "nearly every
+  day", ...) to 0-3, records them and asks the next unanswered item;
+- after item 9, reads back the answers with the total score and, once the
+  patient confirms, completes the stage with the severity computed from the
+  score (0-9 low, 10-19 moderate, 20-27 severe).
+
+It returns None - and the stage prompt is sent to the LLM as usual - for
+anything else: free text or ambiguous answers, corrections, a nonzero answer
+to item 9 (thoughts of self-harm), or a summary the patient does not simply
+confirm. The next unanswered item is derived from the record, so the fast
+path picks up again after the model has handled a turn.
+
+Each local reply carries ``response_metadata["phq9_item"]``: the item number
+it asked, or "confirm" for the summary.
+"""
+import json
+import re
+import uuid
+
+from typing import Dict, List, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+STAGE_ID = 200
+
+PHQ9_ITEMS = (
+    "Little interest or pleasure in doing things",
+    "Feeling down, depressed, or hopeless",
+    "Trouble falling or staying asleep, or sleeping too much",
+    "Feeling tired or having little energy",
+    "Poor appetite or overeating",
+    "Feeling bad about yourself, or that you are a failure or have let yourself or your family down",
+    "Trouble concentrating on things, such as reading the newspaper or watching television",
+    "Moving or speaking so slowly that other people could have noticed, or the opposite, "
+    "being so fidgety or restless that you have been moving around a lot more than usual",
+    "Thoughts that you would be better off dead, or of hurting yourself in some way",
+)
+SELF_HARM_ITEM = 9
+
+FREQUENCY_LABELS = ("not at all", "several days", "more than half the days", "nearly every day")
+
+# Normalized answers accepted as a frequency code; anything else goes to the LLM.
+_ANSWER_CODES = {
+    **{str(code): code for code in range(4)},
+    **{label: code for code, label in enumerate(FREQUENCY_LABELS)},
+    "never": 0, "none": 0, "no days": 0, "none of the days": 0,
+    "some days": 1, "a few days": 1, "several": 1,
+    "more than half": 2, "more than half of the days": 2, "most days": 2,
+    "almost every day": 3, "nearly everyday": 3, "every day": 3, "everyday": 3,
+}
+_AFFIRMATIVE = {
+    "yes", "y", "yep", "yeah", "correct", "right", "that is correct", "thats correct", "thats right",
+    "yes thats correct", "yes thats right", "yes correct", "yes it is", "looks good", "yes looks good",
+}
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+_SPACES = re.compile(r"\s+")
+
+OPTIONS = "not at all, several days, more than half the days, or nearly every day"
+
+
+def normalize(text: str) -> str:
+    return _SPACES.sub(" ", _NON_WORD.sub("", text.lower().replace("-", " "))).strip()
+
+
+def code_answer(text) -> Optional[int]:
+    """Return the 0-3 code of a standard PHQ-9 frequency answer, or None."""
+    if not isinstance(text, str):
+        return None
+    return _ANSWER_CODES.get(normalize(text))
+
+
+def severity(total: int) -> str:
+    if total >= 20:
+        return "severe"
+    if total >= 10:
+        return "moderate"
+    return "low"
+
+
+def question(item: int, opening: bool = False) -> str:
+    text = f"Over the last 2 weeks, how often have you been bothered by: {PHQ9_ITEMS[item - 1].lower()}? " \
+           f"(Please answer {OPTIONS}.)"
+    if opening:
+        text = ("Next I will ask you nine questions about how you have been feeling, one at a time. "
+                + text)
+    return text
+
+
+def summary(codes: Dict[int, int]) -> str:
+    lines = [f"{item}. {PHQ9_ITEMS[item - 1]}: {FREQUENCY_LABELS[codes[item]]}" for item in range(1, 10)]
+    total = sum(codes.values())
+    return ("Thank you. Here is a summary of your answers:\n" + "\n".join(lines)
+            + f"\nYour total score is {total}. Is this correct?")
+
+
+def _reply(response: str, status: str, medical_history: dict, item) -> AIMessage:
+    content = json.dumps({"response": response, "status": status, "medical_history": medical_history})
+    return AIMessage(content=content, id=str(uuid.uuid4()), response_metadata={"phq9_item": item})
+
+
+def phq9_turn(window: List, record: Dict) -> Optional[AIMessage]:
+    """
+    Answer a stage 200 turn locally, or return None to call the LLM.
+
+    ``window`` holds the messages of the current stage (see stage_window),
+    ``record`` the merged medical record so far.
+    """
+    answers = {r["question_number"]: r["answer"] for r in record.get("phq9_responses") or []}
+    pending = next((item for item in range(1, 10) if item not in answers), None)
+    previous = next((m for m in reversed(window) if isinstance(m, AIMessage)), None)
+    last = window[-1] if window else None
+
+    if previous is None:
+        # Entering the stage: ask the first unanswered item.
+        if pending is None:
+            return None
+        no_change = {"phq9_responses": [], "depression_severity": None}
+        return _reply(question(pending, opening=pending == 1), "in-progress", no_change, pending)
+
+    if not isinstance(last, HumanMessage):
+        return None
+    asked = previous.response_metadata.get("phq9_item")
+
+    if asked == "confirm":
+        codes = {item: code_answer(answer) for item, answer in answers.items()}
+        if normalize(last.content) not in _AFFIRMATIVE or None in codes.values() or len(codes) != 9:
+            return None
+        level = severity(sum(codes.values()))
+        return _reply("Thank you for confirming. I have recorded your answers.", "complete",
+                      {"phq9_responses": [], "depression_severity": level}, None)
+
+    # The model may have asked the pending item itself (asked is None).
+    if pending is None or asked not in (None, pending):
+        return None
+    code = code_answer(last.content)
+    if code is None or (pending == SELF_HARM_ITEM and code > 0):
+        return None
+
+    answers[pending] = FREQUENCY_LABELS[code]
+    delta = {"phq9_responses": [{"question_number": pending, "answer": FREQUENCY_LABELS[code]}],
+             "depression_severity": None}
+    following = next((item for item in range(pending + 1, 10) if item not in answers), None)
+    if following is not None:
+        return _reply(question(following), "in-progress", delta, following)
+
+    codes = {item: code_answer(answer) for item, answer in answers.items()}
+    if None in codes.values() or len(codes) != 9:
+        # Some answers were free text recorded by the model: let it summarize.
+        return None
+    return _reply(summary(codes), "in-progress", delta, "confirm")
@@ -0,0 +1,262 @@
+"""
+Prompt compiler for the stage prompt files.
+
+The ``prompts/Prompt_0XXX_*.md`` files are written for people (markdown
+emphasis, aligned ``jsonc`` schemas with ``//`` comments) but are sent as the
+system message on every turn. ``compile_prompt`` turns one into its compact
+runtime form:
+
+- ``json``/``jsonc`` blocks: ``//`` and ``/* */`` comments and trailing commas
+  are removed and the schema is re-emitted as canonical one-line JSON. A
+  block whose fence is tagged ``keep-comments`` (```` ```json keep-comments ````)
+  keeps its comments, because they carry content the model needs (the RMS
+  questions of stage 800, the risk factor definitions of stage 700); only its
+  indentation and alignment padding are removed.
+- Markdown: bold/italic markers are dropped, runs of spaces and trailing
+  whitespace are collapsed, and blank lines are reduced to one.
+
+``python intake_prompts.py build`` writes the compiled prompts to
+``prompts/build/`` and reports token counts before and after (``--check``
+exits non-zero if an artifact is out of date). At run time ``load_prompt``
+serves the artifact when it is newer than its source, else compiles the
+source in-process; results are cached and reloaded when the source file's
+mtime changes, so edited prompts take effect on the next turn.
+``INTAKE_PROMPT_COMPILE=0`` sends the source files verbatim.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import threading
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+BUILD_DIR = "build"
+KEEP_COMMENTS = "keep-comments"
+
+_FENCE = re.compile(r"^```([^\n]*)\n(.*?)^```[ \t]*$", re.MULTILINE | re.DOTALL)
+_BOLD = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1")
+_ITALIC = re.compile(r"(?<![\w*])\*(?=\S)([^*\n]+?)(?<=\S)\*(?![\w*])")
+_SPACES = re.compile(r"(?<=\S)[ \t]{2,}")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+# -------------------------------------------------------------------
+# JSON blocks
+# -------------------------------------------------------------------
+def strip_json_comments(text: str) -> str:
+    """Remove // and /* */ comments and trailing commas outside JSON strings."""
+    out: List[str] = []
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c == '"':
+            j = i + 1
+            while j < n and text[j] != '"':
+                j += 2 if text[j] == "\\" else 1
+            out.append(text[i:j + 1])
+            i = j + 1
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+        else:
+            if c in "]}":
+                # Drop a trailing comma left before the closing bracket.
+                k = len(out) - 1
+                while k >= 0 and out[k].isspace():
+                    k -= 1
+                if k >= 0 and out[k] == ",":
+                    del out[k]
+            out.append(c)
+            i += 1
+    return "".join(out)
+
+
+def compile_json_block(body: str, keep_comments: bool = False) -> Tuple[str, str]:
+    """Return (fence language, compact body) for a json/jsonc block."""
+    if keep_comments:
+        lines = [_SPACES.sub(" ", line.strip()) for line in body.splitlines()]
+        return "jsonc", "\n".join(line for line in lines if line.strip())
+    stripped = strip_json_comments(body)
+    try:
+        value = json.loads(stripped)
+    except ValueError:
+        # Not valid JSON once comments are gone (e.g. "..." placeholders): just squeeze it.
+        return "json", " ".join(stripped.split())
+    return "json", json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+# -------------------------------------------------------------------
+# Markdown
+# -------------------------------------------------------------------
+def _compile_text(text: str) -> str:
+    text = _BOLD.sub(r"\2", text)
+    text = _ITALIC.sub(r"\1", text)
+    return "\n".join(_SPACES.sub(" ", line.rstrip()) for line in text.split("\n"))
+
+
+def _compile_fence(match: "re.Match") -> str:
+    info, body = match.group(1).split(), match.group(2)
+    language = info[0] if info else ""
+    if language not in ("json", "jsonc"):
+        return match.group(0)
+    language, body = compile_json_block(body, KEEP_COMMENTS in info[1:])
+    return f"```{language}\n{body}\n```"
+
+
+def compile_prompt(text: str) -> str:
+    """Compile one prompt file's markdown into its compact runtime form."""
+    parts = []
+    last = 0
+    for match in _FENCE.finditer(text):
+        parts.append(_compile_text(text[last:match.start()]))
+        parts.append(_compile_fence(match))
+        last = match.end()
+    parts.append(_compile_text(text[last:]))
+    return _BLANK_LINES.sub("\n\n", "".join(parts)).strip() + "\n"
+
+
+# -------------------------------------------------------------------
+# Token counts
+# -------------------------------------------------------------------
+_counter: Optional[Tuple[str, Callable[[str], int]]] = None
+
+
+def token_counter() -> Tuple[str, Callable[[str], int]]:
+    """(name, count) using tiktoken's o200k_base when it can be loaded, else four characters per token."""
+    global _counter
+    if _counter is None:
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding("o200k_base")
+            _counter = ("o200k_base", lambda text: len(encoding.encode(text)))
+        except Exception:  # not installed, or the encoding cannot be downloaded
+            _counter = ("estimate", lambda text: len(text) // 4 + 1)
+    return _counter
+
+
+# -------------------------------------------------------------------
+# Runtime cache
+# -------------------------------------------------------------------
+def artifact_path(source: str) -> str:
+    directory, name = os.path.split(source)
+    return os.path.join(directory, BUILD_DIR, name)
+
+
+class PromptCache:
+    """Compiled prompts by source path, reloaded when the source's mtime changes."""
+
+    def __init__(self, compiled: bool = True):
+        self.compiled = compiled
+        self.lock = threading.Lock()
+        self._entries: Dict[str, Tuple[int, str]] = {}
+
+    def get(self, source: str) -> str:
+        mtime = os.stat(source).st_mtime_ns
+        entry = self._entries.get(source)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        text = self._load(source, mtime)
+        with self.lock:
+            self._entries[source] = (mtime, text)
+        return text
+
+    def _load(self, source: str, mtime: int) -> str:
+        if self.compiled:
+            artifact = artifact_path(source)
+            try:
+                if os.stat(artifact).st_mtime_ns >= mtime:
+                    with open(artifact, "r", encoding="utf-8") as f:
+                        return f.read()
+            except FileNotFoundError:
+                pass
+        with open(source, "r", encoding="utf-8") as f:
+            text = f.read()
+        return compile_prompt(text) if self.compiled else text
+
+
+_lock = threading.Lock()
+_cache: Optional[PromptCache] = None
+
+
+def get_prompt_cache() -> PromptCache:
+    """Return the process-wide prompt cache, built from the environment on first use."""
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = PromptCache(compiled=os.environ.get("INTAKE_PROMPT_COMPILE", "1") != "0")
+    return _cache
+
+
+def configure_prompt_cache(cache: PromptCache):
+    global _cache
+    _cache = cache
+
+
+def load_prompt(source: str) -> str:
+    return get_prompt_cache().get(source)
+
+
+# -------------------------------------------------------------------
+# Build step
+# -------------------------------------------------------------------
+class PromptReport(NamedTuple):
+    source: str
+    tokens_before: int
+    tokens_after: int
+    up_to_date: bool
+
+
+def build(sources: List[str], check: bool = False) -> List[PromptReport]:
+    """Compile each source to its artifact (or with check=True, only compare) and report token counts."""
+    _, count = token_counter()
+    reports = []
+    for source in sources:
+        with open(source, "r", encoding="utf-8") as f:
+            text = f.read()
+        compiled = compile_prompt(text)
+        artifact = artifact_path(source)
+        try:
+            with open(artifact, "r", encoding="utf-8") as f:
+                up_to_date = f.read() == compiled
+        except FileNotFoundError:
+            up_to_date = False
+        if not check and not up_to_date:
+            os.makedirs(os.path.dirname(artifact), exist_ok=True)
+            with open(artifact, "w", encoding="utf-8") as f:
+                f.write(compiled)
+        reports.append(PromptReport(source, count(text), count(compiled), up_to_date))
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the stage prompt files into their compact runtime form.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("build", help="write prompts/build/ and report token counts")
+    command.add_argument("sources", nargs="*", help="prompt files (default: prompts/Prompt_*.md)")
+    command.add_argument("--check", action="store_true", help="write nothing; exit 1 if an artifact is out of date")
+    args = parser.parse_args(argv)
+
+    sources = args.sources or sorted(glob.glob(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts", "Prompt_*.md")))
+    reports = build(sources, check=args.check)
+    name, _ = token_counter()
+    before = sum(r.tokens_before for r in reports)
+    after = sum(r.tokens_after for r in reports)
+    for r in reports:
+        flag = "" if r.up_to_date or not args.check else "  (out of date)"
+        print(f"{os.path.basename(r.source):<44} {r.tokens_before:>6} -> {r.tokens_after:>6}{flag}")
+    if before:
+        print(f"{'total (' + name + ' tokens)':<44} {before:>6} -> {after:>6} ({1 - after / before:.0%} saved)")
+    return 1 if args.check and not all(r.up_to_date for r in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
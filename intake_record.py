@@ -0,0 +1,86 @@
+"""
+The accumulated medical record of an intake, merged from per-turn deltas.
+
+Each AI turn reports in ``medical_history`` only what changed in that turn;
+``merge_record`` is the LangGraph reducer of the ``record`` state field and
+folds those deltas into one record, in the spirit of JSON merge patch
+(RFC 7396):
+
+- objects merge key by key, recursively;
+- ``null`` means "unknown / unchanged" and never erases a recorded value
+  (the stage schemas use null for fields not yet known);
+- lists of objects merge by their identifying field (``question_number``,
+  ``phrase`` or ``question``): an item with a known identifier replaces the
+  recorded one, new items are appended;
+- other lists (e.g. suicide risk factors) are unioned, keeping order;
+- any other value replaces the recorded one.
+
+Re-sending a full object is therefore harmless, so stages (and older replies)
+that still emit their whole medical_history merge to the same result.
+"""
+from typing import Any, Dict, List, Optional
+
+
+# Fields identifying an item within a list of objects, in order of preference.
+ITEM_KEYS = ("question_number", "phrase", "question")
+
+
+def merge_record(left: Optional[Dict[str, Any]], right: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reducer: return left with the delta right merged in (neither input is modified)."""
+    if not right:
+        return left or {}
+    if not left:
+        return _strip_nulls(right)
+    return _merge_dict(left, right)
+
+
+def _merge_dict(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(left)
+    for key, value in right.items():
+        if value is None:
+            continue
+        merged[key] = _merge_value(left.get(key), value)
+    return merged
+
+
+def _merge_value(left: Any, right: Any) -> Any:
+    if isinstance(right, dict):
+        return _merge_dict(left, right) if isinstance(left, dict) else _strip_nulls(right)
+    if isinstance(right, list) and isinstance(left, list):
+        return _merge_list(left, right)
+    return right
+
+
+def _item_key(item: Any):
+    if isinstance(item, dict):
+        for field in ITEM_KEYS:
+            if item.get(field) is not None:
+                return field, item[field]
+        return None
+    return "value", item
+
+
+def _merge_list(left: List[Any], right: List[Any]) -> List[Any]:
+    merged = list(left)
+    index = {}
+    for i, item in enumerate(merged):
+        key = _item_key(item)
+        if key is not None:
+            index.setdefault(key, i)
+    for item in right:
+        key = _item_key(item)
+        if key is None:
+            merged.append(item)
+        elif key in index:
+            i = index[key]
+            merged[i] = _merge_value(merged[i], item) if isinstance(item, dict) else item
+        else:
+            index[key] = len(merged)
+            merged.append(item)
+    return merged
+
+
+def _strip_nulls(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _strip_nulls(v) for k, v in value.items() if v is not None}
+    return value
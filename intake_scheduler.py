@@ -0,0 +1,259 @@
+"""
+Central scheduler for outbound LLM calls.
+
+Every stage LLM call (``ai_intake_system.call_stage_llm``) is admitted by one
+process-wide ``LLMScheduler`` instead of firing and retrying on its own:
+
+- Two token buckets cap requests per minute and tokens per minute. A call is
+  charged its estimated prompt tokens plus ``completion_tokens`` up front;
+  the estimate is corrected with the reply's reported usage afterwards.
+- Waiting calls are admitted strictly in priority order, FIFO within a
+  priority, so crisis turns (``PRIORITY_CRITICAL``: the stop stage 1000 and
+  the suicide risk stage 700) go ahead of routine stages and are never
+  starved by them under load.
+- A rate-limit error (HTTP 429) pauses admission for every caller for the
+  provider's ``Retry-After`` or a jittered exponential backoff, and the call
+  is re-queued at its priority, up to ``max_retries`` times. The OpenAI
+  client is built with ``max_retries=0`` so retries happen only here.
+
+Settings (environment, with defaults): INTAKE_LLM_RPM and INTAKE_LLM_TPM (0 =
+unlimited), INTAKE_LLM_COMPLETION_TOKENS (400), INTAKE_LLM_MAX_RETRIES (6).
+
+Sync callers (threads) and async callers (the session engine's loop) share
+the same queue.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from typing import Any, Awaitable, Callable, List, Optional
+
+from intake_metrics import LLM_RATE_LIMITED, LLM_WAIT_SECONDS
+
+
+PRIORITY_CRITICAL = 0
+PRIORITY_ROUTINE = 1
+PRIORITY_NAMES = {PRIORITY_CRITICAL: "critical", PRIORITY_ROUTINE: "routine"}
+
+
+class TokenBucket:
+    """Continuously refilled bucket of ``per_minute`` units; None is unlimited."""
+
+    def __init__(self, per_minute: Optional[float], burst: Optional[float] = None):
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.capacity = float(burst or per_minute or 0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.rate is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` can be taken (amounts above capacity need a full bucket)."""
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.rate is not None:
+            self.level -= amount
+
+
+def estimate_tokens(messages: list) -> int:
+    """Rough prompt size: four characters per token."""
+    return sum(len(m.content) if isinstance(m.content, str) else len(str(m.content)) for m in messages) // 4 + 1
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asks to wait for a rate-limit error (0 if unspecified), or None for other errors."""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("retry-after", 0)))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "wake")
+
+    def __init__(self, priority: int, seq: int, wake: Callable[[], None]):
+        self.priority = priority
+        self.seq = seq
+        self.wake = wake
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, completion_tokens: int = 400,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.completion_tokens = completion_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Admission is paused for everyone until this time after a 429.
+        self._paused_until = 0.0
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        env = os.environ.get
+        return cls(rpm=float(env("INTAKE_LLM_RPM", "0")), tpm=float(env("INTAKE_LLM_TPM", "0")),
+                   completion_tokens=int(env("INTAKE_LLM_COMPLETION_TOKENS", "400")),
+                   max_retries=int(env("INTAKE_LLM_MAX_RETRIES", "6")))
+
+    # ---------------------------------------------------------------
+    # Admission
+    # ---------------------------------------------------------------
+    def _admit(self, waiter: _Waiter, cost: float) -> Optional[float]:
+        """Under the lock: 0 if admitted, else seconds to wait (None = until woken)."""
+        if self._waiting[0] is not waiter:
+            return None
+        now = time.monotonic()
+        wait = max(self._paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(cost, now))
+        if wait > 0:
+            return wait
+        heapq.heappop(self._waiting)
+        self.requests.take(1)
+        self.tokens.take(cost)
+        if self._waiting:
+            self._waiting[0].wake()
+        return 0.0
+
+    def _leave(self, waiter: _Waiter):
+        with self.lock:
+            if waiter in self._waiting:
+                self._waiting.remove(waiter)
+                heapq.heapify(self._waiting)
+                if self._waiting:
+                    self._waiting[0].wake()
+
+    def acquire(self, cost: float, priority: int = PRIORITY_ROUTINE):
+        """Block the calling thread until a call of ``cost`` tokens may start."""
+        event = threading.Event()
+        waiter = _Waiter(priority, next(self._seq), event.set)
+        start = time.monotonic()
+        with self.lock:
+            heapq.heappush(self._waiting, waiter)
+        try:
+            while True:
+                event.clear()
+                with self.lock:
+                    wait = self._admit(waiter, cost)
+                if wait == 0:
+                    break
+                event.wait(wait)
+        except BaseException:
+            self._leave(waiter)
+            raise
+        LLM_WAIT_SECONDS.observe(time.monotonic() - start, priority=PRIORITY_NAMES.get(priority, priority))
+
+    async def aacquire(self, cost: float, priority: int = PRIORITY_ROUTINE):
+        """Wait (without blocking the event loop) until a call of ``cost`` tokens may start."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = _Waiter(priority, next(self._seq), lambda: loop.call_soon_threadsafe(event.set))
+        start = time.monotonic()
+        with self.lock:
+            heapq.heappush(self._waiting, waiter)
+        try:
+            while True:
+                event.clear()
+                with self.lock:
+                    wait = self._admit(waiter, cost)
+                if wait == 0:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._leave(waiter)
+            raise
+        LLM_WAIT_SECONDS.observe(time.monotonic() - start, priority=PRIORITY_NAMES.get(priority, priority))
+
+    def settle(self, estimated: float, result: Any):
+        """Correct the token bucket with the reply's reported usage."""
+        usage = getattr(result, "usage_metadata", None)
+        if usage and usage.get("total_tokens"):
+            with self.lock:
+                self.tokens.take(usage["total_tokens"] - estimated)
+
+    # ---------------------------------------------------------------
+    # Rate-limit backoff
+    # ---------------------------------------------------------------
+    def _backoff(self, error: BaseException, attempt: int, stage) -> Optional[float]:
+        """Pause admission after a 429 and return the delay, or None if the error is not retried."""
+        delay = retry_after(error)
+        if delay is None or attempt >= self.max_retries:
+            return None
+        LLM_RATE_LIMITED.inc(stage=stage)
+        # Full jitter, but never less than the provider asked for.
+        delay = max(delay, random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+        with self.lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, func: Callable[[], Any], messages: list, priority: int = PRIORITY_ROUTINE, stage=None) -> Any:
+        """Run func() under the limits, retrying rate-limit errors."""
+        cost = estimate_tokens(messages) + self.completion_tokens
+        for attempt in itertools.count():
+            self.acquire(cost, priority)
+            try:
+                result = func()
+            except Exception as e:
+                if self._backoff(e, attempt, stage) is None:
+                    raise
+                continue
+            self.settle(cost, result)
+            return result
+
+    async def acall(self, func: Callable[[], Awaitable[Any]], messages: list, priority: int = PRIORITY_ROUTINE,
+                    stage=None) -> Any:
+        cost = estimate_tokens(messages) + self.completion_tokens
+        for attempt in itertools.count():
+            await self.aacquire(cost, priority)
+            try:
+                result = await func()
+            except Exception as e:
+                if self._backoff(e, attempt, stage) is None:
+                    raise
+                continue
+            self.settle(cost, result)
+            return result
+
+
+_lock = threading.Lock()
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_scheduler() -> LLMScheduler:
+    """Return the process-wide scheduler, built from the environment on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler.from_env()
+    return _scheduler
+
+
+def configure_scheduler(scheduler: LLMScheduler):
+    global _scheduler
+    _scheduler = scheduler
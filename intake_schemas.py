@@ -0,0 +1,243 @@
+"""
+Typed output schemas for each intake stage.
+
+Each ``StageXXXOutput`` mirrors the JSON format described in the matching
+``prompts/Prompt_0XXX_*.md`` file, with ``medical_history`` typed instead of a
+free-form dict. The models serve two purposes:
+
+- ``RESPONSE_FORMATS`` holds the OpenAI ``json_schema`` response format of
+  every stage, converted once at import, which the stage chains bind so the
+  model's output is constrained to the schema. Stages whose schema cannot be
+  expressed in strict mode (free-form keys) are bound non-strict.
+- ``STAGE_SCHEMAS`` is used by ``parse_output`` to validate each reply against
+  the schema of the stage that produced it.
+
+Fields that are unknown during an in-progress turn are nullable but still
+required, as strict structured output requires every property to be present.
+Since each turn reports only what changed (see intake_record.py), null also
+means "unchanged" and lists hold only the new items.
+Stages 900 and 1000 report their wrap-up fields under ``medical_history`` so
+every stage shares the response/status/medical_history envelope. The envelope
+also carries ``volunteered``: answers to later stages that the patient gave
+early, which may let those stages be skipped (see intake_skip.py).
+"""
+from typing import Any, Dict, List, Literal, Optional, Type
+
+from pydantic import BaseModel
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+Status = Literal["in-progress", "complete", "stop", "alert"]
+
+# The 15 suicide risk factors of Prompt_0700_Suicide_Risk_Factors.md.
+SUICIDE_RISK_FACTORS = (
+    "active_suicidal_ideation",
+    "passive_suicidal_ideation",
+    "suicidal_behavior",
+    "non_suicidal_self_injury",
+    "thwarted_belongingness",
+    "burdensomeness",
+    "hopelessness",
+    "persistent_intolerable_pain",
+    "acute_exacerbation_of_mental_illness",
+    "preparatory_suicide_actions",
+    "lack_of_sleep",
+    "adverse_life_events",
+    "victimization",
+    "sexual_or_gender_dysphoria",
+    "impulsive_behavior",
+)
+SuicideRiskFactor = Literal[SUICIDE_RISK_FACTORS]
+
+
+# -------------------------------------------------------------------
+# medical_history payloads
+# -------------------------------------------------------------------
+class Demographics(BaseModel):
+    age: Optional[str]
+    gender: Optional[str]
+
+
+class GetFamiliarHistory(BaseModel):
+    demographics: Demographics
+
+
+class PHQ9Response(BaseModel):
+    question_number: int
+    answer: str
+
+
+class DepressionSeverityHistory(BaseModel):
+    phq9_responses: List[PHQ9Response]
+    depression_severity: Optional[Literal["low", "moderate", "severe"]]
+
+
+class SnomedEntry(BaseModel):
+    phrase: str
+    snomed_code: str
+    snomed_name: str
+
+
+class IllnessHistory(BaseModel):
+    diagnoses: List[SnomedEntry]
+
+
+class AntidepressantUse(BaseModel):
+    taken: Optional[bool]
+    remission: Optional[bool]
+
+
+class AntidepressantHistory(BaseModel):
+    # Keyed by drug name (AMITRIPTYLINE ... VENLAFAXINE, OTHER); only confirmed drugs.
+    antidepressant_history: Dict[str, AntidepressantUse]
+
+
+class Medication(BaseModel):
+    phrase: str
+    rxnorm_code: str
+    generic_name: str
+
+
+class CurrentMedicationsHistory(BaseModel):
+    medications: List[Medication]
+
+
+class ProceduresHistory(BaseModel):
+    procedures: List[SnomedEntry]
+
+
+class SuicideRiskHistory(BaseModel):
+    suicide_risk_profile: List[SuicideRiskFactor]
+
+
+class BipolarScreening(BaseModel):
+    rms_q1: Optional[bool]
+    rms_q2: Optional[bool]
+    rms_q3: Optional[bool]
+    rms_q4: Optional[bool]
+    rms_q5: Optional[bool]
+    rms_q6: Optional[bool]
+    likely_bipolar_depression: Optional[bool]
+
+
+class BipolarHistory(BaseModel):
+    bipolar_screening: BipolarScreening
+
+
+class PubmedAnswer(BaseModel):
+    question: str
+    answer: str
+    pubmed_reference: Optional[str]
+
+
+class ConversationCompletedHistory(BaseModel):
+    conversation_completed: Optional[bool]
+    final_recommendation_provided: Optional[bool]
+    client_questions_answered_via_pubmed: List[PubmedAnswer]
+
+
+class StopInteractionHistory(BaseModel):
+    stop_interaction: bool
+    reason: str
+
+
+class Volunteered(BaseModel):
+    # Keyed like the medical_history of the stage each answer belongs to.
+    diagnoses: Optional[List[SnomedEntry]] = None
+    medications: Optional[List[Medication]] = None
+    procedures: Optional[List[SnomedEntry]] = None
+
+
+# -------------------------------------------------------------------
+# Per-stage output envelopes
+# -------------------------------------------------------------------
+class StageOutput(BaseModel):
+    response: str
+    status: Status
+    # Optional locally so replies without it still validate; required (nullable) in strict mode.
+    volunteered: Optional[Volunteered] = None
+
+
+class Stage150Output(StageOutput):
+    medical_history: GetFamiliarHistory
+
+
+class Stage200Output(StageOutput):
+    medical_history: DepressionSeverityHistory
+
+
+class Stage300Output(StageOutput):
+    medical_history: IllnessHistory
+
+
+class Stage400Output(StageOutput):
+    medical_history: AntidepressantHistory
+
+
+class Stage500Output(StageOutput):
+    medical_history: CurrentMedicationsHistory
+
+
+class Stage600Output(StageOutput):
+    medical_history: ProceduresHistory
+
+
+class Stage700Output(StageOutput):
+    medical_history: SuicideRiskHistory
+
+
+class Stage800Output(StageOutput):
+    medical_history: BipolarHistory
+
+
+class Stage900Output(StageOutput):
+    medical_history: ConversationCompletedHistory
+
+
+class Stage1000Output(StageOutput):
+    medical_history: StopInteractionHistory
+
+
+STAGE_SCHEMAS: Dict[int, Type[StageOutput]] = {
+    150: Stage150Output,
+    200: Stage200Output,
+    300: Stage300Output,
+    400: Stage400Output,
+    500: Stage500Output,
+    600: Stage600Output,
+    700: Stage700Output,
+    800: Stage800Output,
+    900: Stage900Output,
+    1000: Stage1000Output,
+}
+
+# Stages whose schema uses free-form keys, which strict mode cannot express.
+NON_STRICT_STAGES = {400}
+
+
+def _strip_defaults(schema: Any) -> Any:
+    # Structured outputs do not accept "default"; the fields stay required and nullable.
+    if isinstance(schema, dict):
+        return {k: _strip_defaults(v) for k, v in schema.items() if k != "default"}
+    if isinstance(schema, list):
+        return [_strip_defaults(v) for v in schema]
+    return schema
+
+
+def response_format(schema: Type[BaseModel], strict: bool = True) -> dict:
+    """Convert a schema to an OpenAI json_schema response format."""
+    function = convert_to_openai_tool(schema, strict=strict)["function"]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": function["name"],
+            "schema": _strip_defaults(function["parameters"]),
+            "strict": strict,
+        },
+    }
+
+
+RESPONSE_FORMATS: Dict[int, dict] = {
+    stage: response_format(schema, strict=stage not in NON_STRICT_STAGES)
+    for stage, schema in STAGE_SCHEMAS.items()
+}
@@ -0,0 +1,487 @@
+"""
+HTTP and WebSocket front end for the session engine.
+
+A small asyncio HTTP/1.1 server (standard library only, with a minimal RFC
+6455 WebSocket) around ``intake_sessions.SessionEngine``, so a web intake
+form can drive many patient conversations from one process:
+
+    POST   /sessions               start a session: {"thread_id"?} -> 201 opening turn
+    POST   /sessions/{id}/turn     send a message: {"text": "..."} -> 200 turn
+    POST   /sessions/{id}/resume   re-open a session from its checkpoints -> 200 state
+    GET    /sessions/{id}          -> 200 state (step, finished, record, ...)
+    DELETE /sessions/{id}          end the session (checkpoints are kept) -> 204
+    GET    /sessions/{id}/ws       WebSocket for the same session
+    GET    /healthz, GET /metrics
+
+Turns are the engine's ``TurnResult`` as JSON; errors are ``{"error": ...}``
+with 400 (bad request), 404 (unknown session), 409 (a turn is already in
+progress, or the session has finished), 413 (body too large) or 429 (the
+session's queue is full).
+
+Over the WebSocket the client sends ``{"text": "..."}`` (or plain text) and
+receives ``{"type": "delta", "delta": ...}`` frames as the reply streams in,
+then ``{"type": "turn", ...}`` with the full turn, or ``{"type": "error",
+"status": ..., "error": ...}``. As over HTTP, a message sent while a turn is
+in progress, or after the intake has finished, is answered with a 409 error.
+Sessions left unused are ended after ``--idle-timeout`` seconds (sooner once
+finished) and can be re-opened with ``resume``.
+
+One slow client cannot tie up the server: request headers and bodies have a
+read timeout and a size limit, every socket write has a send timeout, and
+WebSocket output goes through a bounded per-connection outbox. Stream deltas
+that do not fit are dropped (the final turn frame still carries the full
+reply); a client that cannot take a turn frame is disconnected.
+
+    python intake_server.py --port 8080 --max-concurrent-turns 64 --queue-size 8
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import re
+import struct
+import sys
+
+from http import HTTPStatus
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+from intake_logging import setup_logging
+from intake_metrics import HTTP_REQUESTS, REGISTRY, WS_DROPPED
+from intake_sessions import ConcurrentTurnError, SessionClosedError, SessionEngine
+
+
+logger = logging.getLogger(__name__)
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+_SESSION_PATH = re.compile(r"^/sessions/([^/]+)(?:/(turn|resume|ws))?$")
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Dict[str, Any]:
+        if not self.body:
+            return {}
+        try:
+            payload = json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, "Body is not valid JSON") from None
+        if not isinstance(payload, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        return payload
+
+
+# -------------------------------------------------------------------
+# HTTP/1.1 framing
+# -------------------------------------------------------------------
+async def read_request(reader: asyncio.StreamReader, max_body: int) -> Optional[Request]:
+    """Read one request; return None when the client closed the connection."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise HttpError(400, "Incomplete request") from None
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, "Request headers too large") from None
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _version = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "Malformed request") from None
+    if length < 0:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > max_body:
+        raise HttpError(413, f"Body larger than {max_body} bytes")
+    try:
+        body = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        raise HttpError(400, "Incomplete request") from None
+    return Request(method.upper(), urlsplit(target).path, headers, body)
+
+
+def encode_response(status: int, body: bytes = b"", content_type: str = "application/json",
+                    close: bool = False) -> bytes:
+    head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Length: {len(body)}"]
+    if body:
+        head.append(f"Content-Type: {content_type}")
+    if close:
+        head.append("Connection: close")
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+
+# -------------------------------------------------------------------
+# WebSocket (RFC 6455, server side, text messages only)
+# -------------------------------------------------------------------
+def websocket_accept(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def encode_frame(opcode: int, payload: bytes = b"") -> bytes:
+    n = len(payload)
+    if n < 126:
+        head = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return head + payload
+
+
+def _unmask(payload: bytes, mask: bytes) -> bytes:
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big")
+
+
+class WebSocket:
+    """One server-side WebSocket connection with a bounded outbox."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_message: int,
+                 send_timeout: float, outbox_size: int):
+        self.reader = reader
+        self.writer = writer
+        self.max_message = max_message
+        self.send_timeout = send_timeout
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=outbox_size)
+        self.closed = False
+        self.sender = asyncio.create_task(self._send_loop())
+
+    def send_json(self, payload: Dict[str, Any], droppable: bool = False):
+        """Queue a text frame without waiting; drop it (droppable) or disconnect when the outbox is full."""
+        self._queue(encode_frame(OP_TEXT, json.dumps(payload).encode()), droppable)
+
+    def _queue(self, frame: bytes, droppable: bool = False):
+        if self.closed:
+            return
+        try:
+            self.outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            if droppable:
+                WS_DROPPED.inc()
+                return
+            logger.warning("WebSocket client is not reading; disconnecting")
+            self.abort()
+
+    async def _send_loop(self):
+        while True:
+            frame = await self.outbox.get()
+            if frame is None:
+                return
+            self.writer.write(frame)
+            try:
+                await asyncio.wait_for(self.writer.drain(), self.send_timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                self.abort()
+                return
+
+    def close(self, code: int = 1000):
+        """Queue a close frame; the outbox is flushed before the connection ends."""
+        if not self.closed:
+            self._queue(encode_frame(OP_CLOSE, struct.pack("!H", code)))
+            self._queue(None)
+            self.closed = True
+
+    def abort(self):
+        self.closed = True
+        self.sender.cancel()
+        self.writer.transport.abort()
+
+    async def wait_closed(self):
+        try:
+            await asyncio.wait_for(asyncio.shield(self.sender), self.send_timeout)
+        except asyncio.TimeoutError:
+            self.abort()
+        except asyncio.CancelledError:
+            if not self.sender.cancelled():
+                raise
+
+    async def receive(self) -> Optional[str]:
+        """Return the next text message, or None once the connection is closing."""
+        fragments = []
+        size = 0
+        while True:
+            first, second = await self.reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            if not second & 0x80:
+                self.close(1002)        # client frames must be masked
+                return None
+            size += length
+            if size > self.max_message:
+                self.close(1009)
+                return None
+            mask = await self.reader.readexactly(4)
+            payload = _unmask(await self.reader.readexactly(length), mask) if length else b""
+
+            if opcode == OP_CLOSE:
+                self.close(struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else 1000)
+                return None
+            if opcode == OP_PING:
+                self._queue(encode_frame(OP_PONG, payload))
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_BINARY:
+                self.close(1003)
+                return None
+            fragments.append(payload)
+            if first & 0x80:
+                try:
+                    return b"".join(fragments).decode("utf-8")
+                except UnicodeDecodeError:
+                    self.close(1007)
+                    return None
+
+
+# -------------------------------------------------------------------
+# Server
+# -------------------------------------------------------------------
+class IntakeServer:
+    """Serve the session engine over HTTP and WebSocket."""
+
+    def __init__(self, engine: Optional[SessionEngine] = None, max_body: int = 64 * 1024,
+                 read_timeout: float = 30.0, send_timeout: float = 10.0, outbox_size: int = 256,
+                 max_connections: int = 1000):
+        self.engine = engine if engine is not None else SessionEngine()
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        self.send_timeout = send_timeout
+        self.outbox_size = outbox_size
+        self.max_connections = max_connections
+        self.connections = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.engine.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            if self.connections > self.max_connections:
+                await self._write(writer, encode_response(503, _json({"error": "Too many connections"}), close=True))
+                return
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader, self.max_body), self.read_timeout)
+                except asyncio.TimeoutError:
+                    return
+                except HttpError as e:
+                    await self._write(writer, encode_response(e.status, _json({"error": e.message}), close=True))
+                    return
+                if request is None:
+                    return
+                match = _SESSION_PATH.match(request.path)
+                if match and match.group(2) == "ws":
+                    await self.websocket(request, match.group(1), reader, writer)
+                    return
+                route, status, body, content_type = await self.dispatch(request, match)
+                HTTP_REQUESTS.inc(route=route, status=status)
+                close = request.headers.get("connection", "").lower() == "close"
+                await self._write(writer, encode_response(status, body, content_type, close))
+                if close:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _write(self, writer: asyncio.StreamWriter, data: bytes):
+        writer.write(data)
+        await asyncio.wait_for(writer.drain(), self.send_timeout)
+
+    # ---------------------------------------------------------------
+    # HTTP routes
+    # ---------------------------------------------------------------
+    async def dispatch(self, request: Request, match) -> Tuple[str, int, bytes, str]:
+        """Return (route, status, body, content type) for one request."""
+        route = "other"
+        thread_id = match.group(1) if match else None
+        try:
+            if request.path == "/healthz" and request.method == "GET":
+                route = "healthz"
+                return route, 200, _json({"status": "ok", "sessions": len(self.engine.sessions)}), "application/json"
+            if request.path == "/metrics" and request.method == "GET":
+                route = "metrics"
+                return route, 200, REGISTRY.render_prometheus().encode(), "text/plain; version=0.0.4; charset=utf-8"
+            if request.path == "/sessions":
+                route = "start"
+                if request.method != "POST":
+                    raise HttpError(405, "Use POST")
+                try:
+                    opening = await self.engine.start_session(request.json().get("thread_id"))
+                except ValueError as e:
+                    raise HttpError(409, str(e)) from None
+                return route, 201, _json(opening.model_dump()), "application/json"
+            if match is None:
+                raise HttpError(404, "Not found")
+
+            action = match.group(2)
+            route = action or "session"
+            if action == "turn" and request.method == "POST":
+                text = request.json().get("text")
+                if not isinstance(text, str) or not text:
+                    raise HttpError(400, "Field 'text' is required")
+                result = await self.engine.send(thread_id, text, exclusive=True)
+                return route, 200, _json(result.model_dump()), "application/json"
+            if action == "resume" and request.method == "POST":
+                return route, 200, _json(await self.engine.resume_session(thread_id)), "application/json"
+            if action is None and request.method == "GET":
+                return route, 200, _json(await self.engine.get_session(thread_id)), "application/json"
+            if action is None and request.method == "DELETE":
+                if thread_id not in self.engine.sessions:
+                    raise HttpError(404, f"Unknown session {thread_id}")
+                await self.engine.end_session(thread_id)
+                return route, 204, b"", "application/json"
+            raise HttpError(405, "Method not allowed")
+        except HttpError as e:
+            status, message = e.status, e.message
+        except ConcurrentTurnError as e:
+            status, message = 409, str(e)
+        except SessionClosedError as e:
+            status, message = (409 if thread_id in self.engine.sessions else 404), str(e)
+        except asyncio.QueueFull:
+            status, message = 429, f"Session {thread_id} has too many queued messages"
+        except Exception:
+            logger.exception("Request %s %s failed", request.method, request.path)
+            status, message = 500, "Internal error"
+        return route, status, _json({"error": message}), "application/json"
+
+    # ---------------------------------------------------------------
+    # WebSocket route
+    # ---------------------------------------------------------------
+    async def websocket(self, request: Request, thread_id: str, reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter):
+        key = request.headers.get("sec-websocket-key")
+        if request.headers.get("upgrade", "").lower() != "websocket" or not key:
+            HTTP_REQUESTS.inc(route="ws", status=400)
+            await self._write(writer, encode_response(400, _json({"error": "Expected a WebSocket upgrade"}),
+                                                      close=True))
+            return
+        if thread_id not in self.engine.sessions:
+            HTTP_REQUESTS.inc(route="ws", status=404)
+            await self._write(writer, encode_response(404, _json({"error": f"Unknown session {thread_id}"}),
+                                                      close=True))
+            return
+        HTTP_REQUESTS.inc(route="ws", status=101)
+        await self._write(writer, (
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n"
+        ).encode("latin-1"))
+
+        ws = WebSocket(reader, writer, self.max_body, self.send_timeout, self.outbox_size)
+
+        def on_delta(delta):
+            ws.send_json({"type": "delta", "delta": delta}, droppable=True)
+
+        def on_done(future: asyncio.Future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is None:
+                ws.send_json({"type": "turn", **future.result().model_dump()})
+            else:
+                status = 409 if isinstance(error, (ConcurrentTurnError, SessionClosedError)) else 500
+                ws.send_json({"type": "error", "status": status, "error": str(error)})
+
+        try:
+            while not ws.closed:
+                text = await ws.receive()
+                if text is None:
+                    break
+                message = text
+                if text.lstrip().startswith("{"):
+                    try:
+                        message = json.loads(text).get("text")
+                    except (ValueError, AttributeError):
+                        pass
+                if not isinstance(message, str) or not message:
+                    ws.send_json({"type": "error", "status": 400, "error": "Expected {\"text\": ...}"})
+                    continue
+                try:
+                    self.engine.submit(thread_id, message, on_delta, exclusive=True).add_done_callback(on_done)
+                except asyncio.QueueFull:
+                    ws.send_json({"type": "error", "status": 429, "error": "Too many queued messages"})
+                except (ConcurrentTurnError, SessionClosedError) as e:
+                    ws.send_json({"type": "error", "status": 409, "error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            ws.abort()
+        finally:
+            ws.close()
+            await ws.wait_closed()
+
+
+def _json(payload: Any) -> bytes:
+    return json.dumps(payload).encode()
+
+
+async def serve(host: str, port: int, server: IntakeServer):
+    await server.start(host, port)
+    logger.info("Serving intake sessions on http://%s:%d", host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve intake sessions over HTTP and WebSocket.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrent-turns", type=int, default=64, help="graph turns in flight at once")
+    parser.add_argument("--queue-size", type=int, default=8, help="queued messages allowed per session")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--idle-timeout", type=float, default=1800.0,
+                        help="seconds before an unused session is ended (0 disables)")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    engine = SessionEngine(max_concurrent_turns=args.max_concurrent_turns, queue_size=args.queue_size,
+                           idle_timeout=args.idle_timeout or None)
+    server = IntakeServer(engine, max_connections=args.max_connections)
+    try:
+        asyncio.run(serve(args.host, args.port, server))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
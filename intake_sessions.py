@@ -0,0 +1,357 @@
+"""
+Asyncio session engine for running many intake conversations in one process.
+
+Each patient conversation is an ``IntakeSession`` bound to its own LangGraph
+``thread_id``. Messages for a session are pushed onto that session's input
+queue and consumed by a dedicated worker task, which drives the compiled
+``graph`` with ``astream`` so that a slow LLM call only suspends its own
+session. Every turn is timed and the engine can report latency percentiles
+across all sessions, over its last ``latency_window`` turns.
+
+Pass ``on_delta`` to stream the agent's reply text as it is generated (see
+``ai_intake_system.call_stage_llm``); it is called with each new piece of
+text and may be a plain function or a coroutine function.
+
+Sessions with nothing queued are ended after ``idle_timeout`` seconds without
+a turn, or ``finished_timeout`` seconds once the intake has finished, so
+abandoned conversations do not hold a worker task forever. Their checkpoints
+are kept: ``resume_session`` re-opens them.
+
+Example:
+
+    engine = SessionEngine()
+    opening = await engine.start_session()
+    reply = await engine.send(opening.thread_id, "I'm 42, female.")
+    print(reply.response, engine.latency_report())
+"""
+import asyncio
+import collections
+import inspect
+import logging
+import statistics
+import time
+import uuid
+
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence
+
+from langchain_core.messages import HumanMessage
+from pydantic import BaseModel
+
+import ai_intake_system as intake
+from intake_logging import log_context, thread_id_var
+from intake_metrics import ACTIVE_SESSIONS, SESSIONS_EVICTED
+
+
+logger = logging.getLogger(__name__)
+
+# Sentinel placed on a session queue to stop its worker.
+_CLOSE = object()
+
+
+class TurnResult(BaseModel):
+    """Outcome of one graph turn for one session."""
+    thread_id: str
+    turn: int
+    step: int
+    response: str
+    status: str
+    # What this turn added to the record (see intake_record.merge_record).
+    medical_history: Dict[str, Any]
+    latency: float
+    # Seconds until the first streamed piece of the reply (None if not streamed).
+    first_token_latency: Optional[float] = None
+    finished: bool
+    # Completed turns of the thread after this one (stateless workers, see intake_worker.py).
+    version: Optional[int] = None
+
+
+class SessionClosedError(RuntimeError):
+    """Raised when a message is sent to a session that has ended."""
+
+
+class ConcurrentTurnError(RuntimeError):
+    """Raised when a session already has a turn in progress (or a stale version)."""
+
+
+class IntakeSession:
+    """State kept by the engine for one patient conversation."""
+
+    def __init__(self, thread_id: str, queue_size: int):
+        self.thread_id = thread_id
+        self.config = {"configurable": {"thread_id": thread_id}}
+        # Items are (text, future, on_delta) tuples, or _CLOSE.
+        self.inbox: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.turns: List[TurnResult] = []
+        self.finished = False
+        # Messages queued or being answered.
+        self.pending = 0
+        # time.monotonic() of the last message or turn, for idle eviction.
+        self.last_active = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SessionEngine:
+    """
+    Run independent intake sessions concurrently on one compiled graph.
+
+    ``max_concurrent_turns`` bounds how many graph turns (and therefore LLM
+    calls) are in flight at once across all sessions; ``queue_size`` bounds
+    how many messages a single session may have waiting. ``idle_timeout``
+    (None disables eviction) and ``finished_timeout`` bound how long an
+    unused session stays open. ``latency_window`` bounds how many recent
+    turn latencies the engine-wide report keeps.
+    """
+
+    def __init__(self, graph=None, max_concurrent_turns: int = 64, queue_size: int = 8,
+                 idle_timeout: Optional[float] = 1800.0, finished_timeout: float = 300.0,
+                 latency_window: int = 10000):
+        self.graph = graph if graph is not None else intake.graph
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.finished_timeout = finished_timeout
+        self.sessions: Dict[str, IntakeSession] = {}
+        self._evictor: Optional[asyncio.Task] = None
+        # Latencies of the last turns run by this engine, including ended sessions.
+        self.latencies: Deque[float] = collections.deque(maxlen=latency_window)
+        self._turn_slots = asyncio.Semaphore(max_concurrent_turns)
+
+    # ---------------------------------------------------------------
+    # Session lifecycle
+    # ---------------------------------------------------------------
+    async def start_session(self, thread_id: Optional[str] = None,
+                            on_delta: Optional[Callable] = None) -> TurnResult:
+        """Create a session, run the agent's opening turn and start its worker."""
+        thread_id = thread_id or str(uuid.uuid4())
+        if thread_id in self.sessions:
+            raise ValueError(f"Session {thread_id} already exists")
+        session = IntakeSession(thread_id, self.queue_size)
+        self.sessions[thread_id] = session
+        ACTIVE_SESSIONS.inc()
+
+        try:
+            with log_context(thread_id=thread_id):
+                opening = await self._run_turn(session, {"messages": [], "step": intake.FIRST_NODE}, on_delta)
+        except BaseException:
+            # No worker was started: drop the half-open session so the id can be retried.
+            del self.sessions[thread_id]
+            ACTIVE_SESSIONS.dec()
+            raise
+        session.task = asyncio.create_task(self._worker(session), name=f"intake-{thread_id}")
+        self._start_evictor()
+        return opening
+
+    async def resume_session(self, thread_id: str) -> Dict[str, Any]:
+        """
+        Re-open a session whose thread is in the checkpointer (e.g. after a
+        server restart) without running an opening turn; return its state.
+        """
+        if thread_id not in self.sessions:
+            snapshot = await self.graph.aget_state({"configurable": {"thread_id": thread_id}})
+            if not snapshot.values.get("messages"):
+                raise SessionClosedError(f"Unknown session {thread_id}")
+            session = IntakeSession(thread_id, self.queue_size)
+            step = snapshot.values.get("step", intake.FIRST_NODE)
+            session.finished = intake.is_finished(step, intake.parse_output(snapshot.values["messages"][-1])["status"])
+            self.sessions[thread_id] = session
+            ACTIVE_SESSIONS.inc()
+            session.task = asyncio.create_task(self._worker(session), name=f"intake-{thread_id}")
+            self._start_evictor()
+        return await self.get_session(thread_id)
+
+    async def get_session(self, thread_id: str) -> Dict[str, Any]:
+        """Return step, finished flag, turn count and medical record of a session."""
+        session = self._get(thread_id)
+        values = (await self.graph.aget_state(session.config)).values
+        return {
+            "thread_id": thread_id,
+            "step": values.get("step", intake.FIRST_NODE),
+            "finished": session.finished,
+            "turns": len(session.turns),
+            "pending": session.pending,
+            "record": intake.current_record(values),
+        }
+
+    async def send(self, thread_id: str, text: str, on_delta: Optional[Callable] = None,
+                   exclusive: bool = False) -> TurnResult:
+        """Queue a patient message and wait for the agent's reply."""
+        return await self.submit(thread_id, text, on_delta, exclusive)
+
+    def submit(self, thread_id: str, text: str, on_delta: Optional[Callable] = None,
+               exclusive: bool = False) -> asyncio.Future:
+        """
+        Queue a patient message without waiting for the reply.
+
+        Raises ``asyncio.QueueFull`` when the session already has
+        ``queue_size`` messages waiting, and with ``exclusive``
+        ``ConcurrentTurnError`` when any message is queued or being answered.
+        """
+        session = self._get(thread_id)
+        if session.finished:
+            raise SessionClosedError(f"Session {thread_id} has finished")
+        if exclusive and session.pending:
+            raise ConcurrentTurnError(f"Session {thread_id} has a turn in progress")
+        future = asyncio.get_running_loop().create_future()
+        session.inbox.put_nowait((text, future, on_delta))
+        session.pending += 1
+        session.last_active = time.monotonic()
+        return future
+
+    async def end_session(self, thread_id: str):
+        """Stop the session's worker after its queued messages are handled."""
+        session = self.sessions.pop(thread_id, None)
+        if session is None:
+            return
+        ACTIVE_SESSIONS.dec()
+        if session.task is None:
+            return
+        await session.inbox.put(_CLOSE)
+        await session.task
+
+    async def close(self):
+        """End every session."""
+        if self._evictor is not None:
+            self._evictor.cancel()
+            self._evictor = None
+        await asyncio.gather(*(self.end_session(t) for t in list(self.sessions)))
+
+    async def evict_idle(self) -> int:
+        """End sessions with nothing queued that are past their idle timeout; return how many."""
+        now = time.monotonic()
+        expired = []
+        for thread_id, session in self.sessions.items():
+            timeout = self.finished_timeout if session.finished else self.idle_timeout
+            if timeout is not None and not session.pending and now - session.last_active > timeout:
+                expired.append((thread_id, "finished" if session.finished else "idle"))
+        for thread_id, reason in expired:
+            logger.info("Evicting %s session %s", reason, thread_id)
+            SESSIONS_EVICTED.inc(reason=reason)
+            await self.end_session(thread_id)
+        return len(expired)
+
+    def _start_evictor(self):
+        if self._evictor is None and self.idle_timeout is not None:
+            self._evictor = asyncio.create_task(self._evict_loop(), name="intake-evictor")
+
+    async def _evict_loop(self):
+        interval = min(self.idle_timeout, self.finished_timeout, 60.0) / 2
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle()
+            except Exception:
+                logger.exception("Session eviction failed")
+
+    def _get(self, thread_id: str) -> IntakeSession:
+        try:
+            return self.sessions[thread_id]
+        except KeyError:
+            raise SessionClosedError(f"Unknown session {thread_id}") from None
+
+    # ---------------------------------------------------------------
+    # Turn execution
+    # ---------------------------------------------------------------
+    async def _worker(self, session: IntakeSession):
+        # The worker task has its own context: tag all its log records.
+        thread_id_var.set(session.thread_id)
+        while True:
+            item = await session.inbox.get()
+            if item is _CLOSE:
+                break
+            text, future, on_delta = item
+            if session.finished:
+                # Queued before the intake ended: do not re-enter the terminal stage.
+                session.pending -= 1
+                if not future.done():
+                    future.set_exception(SessionClosedError(f"Session {session.thread_id} has finished"))
+                continue
+            try:
+                result = await self._run_turn(session, {"messages": [HumanMessage(content=text)]}, on_delta)
+            except Exception as e:
+                logger.exception("Turn failed for thread %s", session.thread_id)
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            finally:
+                session.pending -= 1
+            if not future.done():
+                future.set_result(result)
+
+    async def _run_turn(self, session: IntakeSession, payload: Dict[str, Any],
+                        on_delta: Optional[Callable] = None) -> TurnResult:
+        async with self._turn_slots:
+            start = time.perf_counter()
+            first_token_latency = None
+            last_message = None
+            step = None
+            stream = self.graph.astream(payload, config=session.config, stream_mode=["updates", "custom"])
+            async for mode, update in stream:
+                if mode == "custom":
+                    if first_token_latency is None:
+                        first_token_latency = time.perf_counter() - start
+                    if on_delta is not None:
+                        delivered = on_delta(update["delta"])
+                        if inspect.isawaitable(delivered):
+                            await delivered
+                    continue
+                node_output = next(iter(update.values()))
+                if node_output and node_output.get("messages"):
+                    last_message = node_output["messages"][-1]
+                if node_output and node_output.get("step"):
+                    step = node_output["step"]
+            latency = time.perf_counter() - start
+
+        if last_message is None:
+            raise RuntimeError(f"Turn produced no message for thread {session.thread_id}")
+        if step is None:
+            snapshot = await self.graph.aget_state(session.config)
+            step = snapshot.values.get("step", intake.FIRST_NODE)
+
+        parsed = intake.parse_output(last_message)
+        finished = intake.is_finished(step, parsed["status"])
+        session.finished = finished
+        result = TurnResult(
+            thread_id=session.thread_id,
+            turn=len(session.turns),
+            step=step,
+            response=parsed["response"],
+            status=parsed["status"],
+            medical_history=parsed["medical_history"],
+            latency=latency,
+            first_token_latency=first_token_latency,
+            finished=finished,
+        )
+        session.turns.append(result)
+        session.last_active = time.monotonic()
+        self.latencies.append(latency)
+        logger.info("turn=%d step=%d status=%s latency=%.3fs", result.turn, step, result.status, latency)
+        return result
+
+    # ---------------------------------------------------------------
+    # Reporting
+    # ---------------------------------------------------------------
+    def latency_report(self, thread_id: Optional[str] = None) -> Dict[str, float]:
+        """Summarize turn latencies (seconds) for one session or all sessions."""
+        if thread_id is not None:
+            latencies = [t.latency for t in self._get(thread_id).turns]
+        else:
+            latencies = self.latencies
+        return summarize_latencies(latencies)
+
+
+def summarize_latencies(latencies: Sequence[float]) -> Dict[str, float]:
+    """Return count, mean and p50/p95/p99/max of a collection of latencies."""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "max": ordered[-1],
+    }
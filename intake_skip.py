@@ -0,0 +1,93 @@
+"""
+Stage skipping for answers the patient volunteered early.
+
+Patients often answer later stages before reaching them (naming their
+medications during stage 150 or 300). Every stage reply may report such
+answers under ``volunteered`` (see intake_schemas.Volunteered), and
+``stage_update`` lifts them into the record under the key of the stage they
+belong to. A stage registered with a ``SkipPolicy`` (the ``skip`` column of
+the stage registry) checks that key of the record before it runs:
+
+- ``SKIP``: the router goes straight past the stage to the next one;
+- ``CONFIRM``: the stage still runs, but its first turn is told what is
+  already recorded and asks the patient to confirm it in a single question
+  instead of running the full interview. Its replies are tagged
+  ``response_metadata["skip"] = "confirm"``, and while the stage's first
+  reply carries the tag every later turn of the stage gets the note too, so
+  the model takes the confirmation rather than starting the interview.
+
+Only stages whose answer is a plain list of items have a policy; the
+validated instruments (PHQ-9, suicide risk, RMS) always run in full.
+Skipped and shortened stages are counted in ``intake_stage_skips``.
+
+The default registry uses ``CONFIRM`` for all of them (300, 500, 600): an
+answer picked up in passing is rarely complete (a medication without its
+dose, one diagnosis of several), so it is read back rather than trusted. The
+``SKIP`` path is used by registries that opt into it and is covered by
+test_intake_skip.py.
+"""
+import json
+
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+
+from intake_schemas import Volunteered
+
+
+SKIP = "skip"
+CONFIRM = "confirm"
+# response_metadata key tagging the replies of a stage in its confirm flow.
+METADATA_KEY = "skip"
+
+
+class SkipPolicy(NamedTuple):
+    # Record key that answers the stage (a field of intake_schemas.Volunteered).
+    key: str
+    # What the stage asks about, as used in the prompt notes ("current medications").
+    label: str
+    mode: str = CONFIRM
+
+    def decide(self, record: Dict[str, Any]) -> Optional[str]:
+        """SKIP or CONFIRM if the record already answers the stage, else None."""
+        return self.mode if record.get(self.key) else None
+
+
+def _item_fields(key: str) -> str:
+    # Volunteered fields are Optional[List[Model]]; list the item model's fields.
+    item = Volunteered.model_fields[key].annotation.__args__[0].__args__[0]
+    return ", ".join(f'"{name}"' for name in item.model_fields)
+
+
+def volunteer_instruction(policies: Iterable[SkipPolicy]) -> Optional[str]:
+    """Prompt note asking a stage to report answers to the later stages of ``policies``."""
+    policies = list(policies)
+    if not policies:
+        return None
+    labels = [p.label for p in policies]
+    topics = labels[0] if len(labels) == 1 else ", ".join(labels[:-1]) + " and " + labels[-1]
+    keys = "; ".join(f'"{p.key}" ({p.label}: items with {_item_fields(p.key)})' for p in policies)
+    return (
+        "## Volunteered information\n\n"
+        f"Later stages ask about the patient's {topics}. If the patient mentions any of these now, "
+        f"report them under \"volunteered\" as lists keyed {keys}. "
+        "Do not ask about these topics yourself. Set \"volunteered\" to null if nothing was mentioned."
+    )
+
+
+def confirm_note(policy: SkipPolicy, record: Dict[str, Any], followup: bool = False) -> str:
+    """
+    Prompt note cutting a stage whose answer is already recorded to one
+    confirmation turn; ``followup`` for the turns after the read-back.
+    """
+    items = json.dumps(record.get(policy.key), separators=(",", ":"), ensure_ascii=False)
+    if followup:
+        ask = ("You have already read this back and asked the patient to confirm it. Do not run the full "
+               "interview: take their confirmation or corrections, and ask at most one short follow-up "
+               "question if their answer is unclear.")
+    else:
+        ask = ("Do not run the full interview. In a single question, read this back and ask the patient to "
+               "confirm it and add anything missing.")
+    return (
+        "## Already reported\n\n"
+        f"The patient already mentioned their {policy.label} earlier in the conversation: {items}. "
+        f"{ask} Once they confirm, set status to \"complete\", reporting only new or corrected items."
+    )
@@ -0,0 +1,130 @@
+"""
+Incremental extraction of the "response" field from a streamed IntakeOutput.
+
+The model replies with a JSON object whose "response" string is what the
+patient sees. ``ResponseFieldExtractor`` is fed the raw token text as it
+arrives and returns the newly decoded characters of that string, so the reply
+can be shown before the (often large) "medical_history" object has been
+generated. The complete message is still parsed and validated as usual once
+the stream ends.
+
+    extractor = ResponseFieldExtractor()
+    for chunk in llm.stream(messages):
+        print(extractor.feed(chunk.content), end="")
+"""
+from typing import List
+
+RESPONSE_KEY = "response"
+
+_SIMPLE_ESCAPES = {
+    '"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+}
+
+
+class ResponseFieldExtractor:
+    """
+    Streaming scanner for the top-level "response" string of a JSON object.
+
+    Text before the first "{" (e.g. a ```json fence) is ignored. Only the first
+    top-level "response" value is emitted; everything else is skipped without
+    being decoded.
+    """
+
+    def __init__(self, key: str = RESPONSE_KEY):
+        self.key = key
+        self.depth = 0
+        self.in_string = False
+        self.escape = ""          # pending escape sequence, e.g. "\\u00e"
+        self.expect_key = False   # next string at depth 1 is an object key
+        self.key_chars: List[str] = []
+        self.last_key = None
+        self.capturing = False
+        self.done = False
+        self.text: List[str] = []  # everything emitted so far
+        self._pending_high = ""   # high surrogate waiting for its pair
+
+    @property
+    def response(self) -> str:
+        return "".join(self.text)
+
+    def feed(self, chunk) -> str:
+        """Consume a chunk of raw model output and return newly decoded response text."""
+        if self.done or not chunk or not isinstance(chunk, str):
+            return ""
+        out: List[str] = []
+        for ch in chunk:
+            if self.in_string:
+                self._string_char(ch, out)
+            elif ch == '"':
+                self._open_string()
+            elif ch in "{[":
+                self.depth += 1
+                self.expect_key = ch == "{" and self.depth == 1
+            elif ch in "}]":
+                self.depth -= 1
+            elif ch == "," and self.depth == 1:
+                self.expect_key = True
+            elif ch == ":" and self.depth == 1:
+                self.expect_key = False
+            if self.done:
+                break
+        emitted = "".join(out)
+        if emitted:
+            self.text.append(emitted)
+        return emitted
+
+    def _open_string(self):
+        self.in_string = True
+        if self.depth != 1:
+            return
+        if self.expect_key:
+            self.key_chars = []
+        elif self.last_key == self.key:
+            self.capturing = True
+
+    def _string_char(self, ch: str, out: List[str]):
+        at_key = self.depth == 1 and self.expect_key
+        if self.escape:
+            self.escape += ch
+            decoded = self._decode_escape()
+            if decoded is None:
+                return
+            self.escape = ""
+            if at_key:
+                self.key_chars.append(decoded)
+            elif self.capturing:
+                out.append(decoded)
+            return
+        if ch == "\\":
+            self.escape = ch
+            return
+        if ch == '"':
+            self.in_string = False
+            if at_key:
+                self.last_key = "".join(self.key_chars)
+            elif self.capturing:
+                self.capturing = False
+                self.done = True
+            return
+        if at_key:
+            self.key_chars.append(ch)
+        elif self.capturing:
+            out.append(ch)
+
+    def _decode_escape(self):
+        """Return the decoded text for a complete escape, or None if more input is needed."""
+        kind = self.escape[1]
+        if kind != "u":
+            return _SIMPLE_ESCAPES.get(kind, kind)
+        if len(self.escape) < 6:
+            return None
+        code = int(self.escape[2:6], 16)
+        if 0xD800 <= code < 0xDC00:
+            # High surrogate: wait for the low half (the next \uXXXX escape).
+            self._pending_high = chr(code)
+            return ""
+        if 0xDC00 <= code < 0xE000 and self._pending_high:
+            pair = (self._pending_high + chr(code)).encode("utf-16", "surrogatepass").decode("utf-16")
+            self._pending_high = ""
+            return pair
+        return chr(code)
@@ -0,0 +1,141 @@
+"""
+Compact transcript records for checkpoints.
+
+A LangChain message serializes with its class path and every field
+(additional_kwargs, response_metadata, tool_calls, usage_metadata, ...), most
+of them empty. ``Turn`` is the compact form kept in checkpoints instead (see
+``intake_checkpoint.CompactSerializer``): a slotted record of
+
+- ``role``: the message type ("human", "ai", "tool", "system", ...);
+- ``text``: the content (a string, or a list of content blocks);
+- ``stage``: the stage that produced an AI message (``response_metadata["stage"]``);
+- ``id``;
+- ``extra``: only the fields that differ from their defaults.
+
+``Turn.from_message`` / ``to_message`` convert losslessly, so the graph state
+and the LLM calls keep using LangChain messages and only the stored form
+changes. ``parsed`` lazily decodes an AI turn's JSON reply for tools that read
+transcripts without LangChain.
+"""
+import json
+
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    ChatMessage,
+    FunctionMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+
+
+_MESSAGE_CLASSES = {
+    cls.model_fields["type"].default: cls
+    for cls in (HumanMessage, AIMessage, SystemMessage, ToolMessage, AIMessageChunk, ChatMessage, FunctionMessage,
+                RemoveMessage)
+}
+# Fields stored in the Turn's own slots rather than in extra.
+_OWN_FIELDS = {"type", "content", "id"}
+_REQUIRED = object()
+_defaults: Dict[type, Dict[str, Any]] = {}
+
+
+def _field_defaults(cls) -> Dict[str, Any]:
+    defaults = _defaults.get(cls)
+    if defaults is None:
+        # Required fields (e.g. ToolMessage.tool_call_id) never match and are always kept.
+        defaults = {
+            name: _REQUIRED if field.is_required() else field.get_default(call_default_factory=True)
+            for name, field in cls.model_fields.items()
+            if name not in _OWN_FIELDS
+        }
+        _defaults[cls] = defaults
+    return defaults
+
+
+class Turn:
+    """One message of a transcript in compact form."""
+    __slots__ = ("role", "text", "stage", "id", "extra", "_parsed")
+
+    def __init__(self, role: str, text: Any, stage: Optional[int] = None, id: Optional[str] = None,
+                 extra: Optional[Dict[str, Any]] = None):
+        self.role = role
+        self.text = text
+        self.stage = stage
+        self.id = id
+        self.extra = extra or {}
+        self._parsed = None
+
+    @classmethod
+    def from_message(cls, message: BaseMessage) -> Optional["Turn"]:
+        """Compact a message; None for message classes this module does not know."""
+        if _MESSAGE_CLASSES.get(message.type) is not type(message):
+            return None
+        defaults = _field_defaults(type(message))
+        extra = {}
+        stage = None
+        for name, default in defaults.items():
+            value = getattr(message, name)
+            if name == "response_metadata" and "stage" in value:
+                stage = value["stage"]
+                value = {k: v for k, v in value.items() if k != "stage"}
+            if value != default:
+                extra[name] = value
+        return cls(message.type, message.content, stage, message.id, extra)
+
+    def to_message(self) -> BaseMessage:
+        cls = _MESSAGE_CLASSES[self.role]
+        fields = dict(self.extra)
+        if self.stage is not None:
+            fields["response_metadata"] = {**fields.get("response_metadata", {}), "stage": self.stage}
+        if self.id is not None:
+            fields["id"] = self.id
+        return cls(content=self.text, **fields)
+
+    # Stored as a list, trailing empty slots dropped: [role, text, stage, id, extra].
+    def pack(self) -> list:
+        row = [self.role, self.text, self.stage, self.id, self.extra or None]
+        while len(row) > 2 and row[-1] is None:
+            row.pop()
+        return row
+
+    @classmethod
+    def unpack(cls, row: list) -> "Turn":
+        return cls(*row)
+
+    @property
+    def parsed(self) -> Optional[Dict[str, Any]]:
+        """The JSON reply of an AI turn (response/status/medical_history), or None."""
+        if self._parsed is None and self.role == "ai" and isinstance(self.text, str):
+            try:
+                value = json.loads(self.text)
+            except ValueError:
+                value = None
+            self._parsed = value if isinstance(value, dict) else {}
+        return self._parsed or None
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Turn) and self.pack() == other.pack()
+
+    def __repr__(self) -> str:
+        return f"Turn({self.role!r}, stage={self.stage!r}, text={self.text!r:.40})"
+
+
+def to_turns(messages: List[BaseMessage]) -> Optional[List[Turn]]:
+    """Compact a message list, or None if any message cannot be compacted."""
+    turns = []
+    for message in messages:
+        turn = Turn.from_message(message)
+        if turn is None:
+            return None
+        turns.append(turn)
+    return turns
+
+
+def to_messages(turns: List[Turn]) -> List[BaseMessage]:
+    return [turn.to_message() for turn in turns]
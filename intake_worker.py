@@ -0,0 +1,343 @@
+"""
+Stateless intake workers over a shared SQLite session store.
+
+An ``IntakeWorker`` keeps no conversation state between turns. Each turn
+loads the thread from the shared checkpoint database (the
+``INTAKE_CHECKPOINT_DB`` file, see intake_checkpoint.py), runs one graph turn,
+persists the new checkpoint and returns. Any worker, in any process, on any
+host that mounts the database, can serve any turn of any patient.
+
+Turns of one thread are serialized with a per-thread row in the
+``thread_turns`` table of the same database:
+
+- ``version`` counts completed turns. A caller may pass the version it last
+  saw (``expected_version``); a stale version fails instead of replying to a
+  conversation that has moved on.
+- A lease (``lease_owner``, ``lease_expires``) is taken in a ``BEGIN
+  IMMEDIATE`` transaction before the turn and released, with the version
+  bumped, after the checkpoint is written. A second turn for the same thread
+  meanwhile fails fast with ``ConcurrentTurnError`` (the HTTP layer maps it to
+  409). A lease left by a crashed worker expires after ``lease_seconds``
+  (``INTAKE_LEASE_SECONDS``, default 120, above the default LLM read timeout).
+- Each turn leases under its own owner token, and every checkpoint write is
+  fenced on it: the checkpointer checks ``lease_owner`` in the same
+  transaction as the write, so a turn whose lease expired and was taken over
+  fails with ``ConcurrentTurnError`` instead of overwriting the new turn.
+
+Example (two processes, one database):
+
+    worker = IntakeWorker("sessions.db")
+    opening = worker.start_session()
+    reply = worker.run_turn(opening.thread_id, "I'm 42, female.", expected_version=opening.version)
+
+    python intake_worker.py --db sessions.db start
+    python intake_worker.py --db sessions.db turn <thread_id> "I'm 42, female."
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from typing import Any, Callable, Dict, Optional
+
+from langchain_core.messages import HumanMessage
+
+import ai_intake_system as intake
+from intake_logging import log_context
+from intake_sessions import ConcurrentTurnError, SessionClosedError, TurnResult
+
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS_ENV = "INTAKE_LEASE_SECONDS"
+# Configurable key carrying the turn's lease owner token to the checkpointer fence.
+LEASE_OWNER_KEY = "lease_owner"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thread_turns (
+    thread_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    finished INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+"""
+
+
+# -------------------------------------------------------------------
+# Per-thread version and lease rows
+# -------------------------------------------------------------------
+class ThreadLeases:
+    """Optimistic versions and turn leases per thread_id, in a SQLite file."""
+
+    def __init__(self, path: str, lease_seconds: float = 120.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def version(self, thread_id: str) -> Optional[int]:
+        """Completed turns of the thread, or None if it does not exist."""
+        with self.lock:
+            row = self.conn.execute("SELECT version FROM thread_turns WHERE thread_id = ?", (thread_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def acquire(self, thread_id: str, owner: str, expected_version: Optional[int] = None,
+                create: bool = False) -> int:
+        """
+        Lease the thread for one turn and return its current version.
+
+        With ``create`` the thread must not exist yet; otherwise it must exist
+        and not be finished.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT version, finished, lease_owner, lease_expires FROM thread_turns WHERE thread_id = ?",
+                    (thread_id,),
+                ).fetchone()
+                if create:
+                    if row is not None:
+                        raise ValueError(f"Session {thread_id} already exists")
+                    self.conn.execute(
+                        "INSERT INTO thread_turns (thread_id, version, lease_owner, lease_expires, updated) "
+                        "VALUES (?, 0, ?, ?, ?)",
+                        (thread_id, owner, now + self.lease_seconds, now),
+                    )
+                    self.conn.execute("COMMIT")
+                    return 0
+                if row is None:
+                    raise SessionClosedError(f"Unknown session {thread_id}")
+                version, finished, lease_owner, lease_expires = row
+                if finished:
+                    raise SessionClosedError(f"Session {thread_id} has finished")
+                if lease_owner is not None and lease_expires > now:
+                    raise ConcurrentTurnError(f"Session {thread_id} has a turn in progress")
+                if expected_version is not None and expected_version != version:
+                    raise ConcurrentTurnError(
+                        f"Session {thread_id} is at version {version}, not {expected_version}")
+                self.conn.execute(
+                    "UPDATE thread_turns SET lease_owner = ?, lease_expires = ?, updated = ? WHERE thread_id = ?",
+                    (owner, now + self.lease_seconds, now, thread_id),
+                )
+                self.conn.execute("COMMIT")
+                return version
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def release(self, thread_id: str, owner: str, completed: bool, finished: bool = False) -> int:
+        """
+        Release the lease; a completed turn bumps the version. Return the
+        version, or raise ConcurrentTurnError if the lease was lost meanwhile.
+        """
+        with self.lock:
+            if completed:
+                cursor = self.conn.execute(
+                    "UPDATE thread_turns SET version = version + 1, finished = ?, lease_owner = NULL, "
+                    "lease_expires = 0, updated = ? WHERE thread_id = ? AND lease_owner = ?",
+                    (int(finished), time.time(), thread_id, owner),
+                )
+            else:
+                cursor = self.conn.execute(
+                    "UPDATE thread_turns SET lease_owner = NULL, lease_expires = 0 "
+                    "WHERE thread_id = ? AND lease_owner = ?",
+                    (thread_id, owner),
+                )
+            row = self.conn.execute("SELECT version FROM thread_turns WHERE thread_id = ?", (thread_id,)).fetchone()
+        if cursor.rowcount == 0 and completed:
+            raise ConcurrentTurnError(f"Lease on session {thread_id} expired during the turn")
+        return row[0] if row else 0
+
+    def delete(self, thread_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM thread_turns WHERE thread_id = ?", (thread_id,))
+
+    @staticmethod
+    def fence(conn: sqlite3.Connection, config: Dict[str, Any]):
+        """
+        Checkpointer fence: refuse the write unless the turn still holds the
+        thread's lease. Runs inside the checkpoint's transaction, so a lease
+        cannot change hands between the check and the write.
+        """
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        row = conn.execute("SELECT 1 FROM thread_turns WHERE thread_id = ? AND lease_owner = ?",
+                           (thread_id, configurable.get(LEASE_OWNER_KEY))).fetchone()
+        if row is None:
+            raise ConcurrentTurnError(f"Lease on session {thread_id} was lost during the turn")
+
+
+# -------------------------------------------------------------------
+# Worker
+# -------------------------------------------------------------------
+class IntakeWorker:
+    """
+    Run single intake turns against the shared store. Workers hold only the
+    compiled graph and database connections, so they are interchangeable.
+    """
+
+    def __init__(self, path: Optional[str] = None, worker_id: Optional[str] = None,
+                 lease_seconds: Optional[float] = None, keep_last: Optional[int] = None):
+        path = path or os.environ.get(intake.CHECKPOINT_DB_ENV)
+        if not path:
+            raise ValueError(f"A shared session database is required (set {intake.CHECKPOINT_DB_ENV})")
+        if lease_seconds is None:
+            lease_seconds = float(os.environ.get(LEASE_SECONDS_ENV, "120"))
+        self.path = path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.leases = ThreadLeases(path, lease_seconds)
+        self.checkpointer = intake.build_checkpointer(path, keep_last, fence=ThreadLeases.fence)
+        self.graph = intake.build_workflow().compile(checkpointer=self.checkpointer)
+
+    def close(self):
+        self.leases.close()
+        self.checkpointer.close()
+
+    def start_session(self, thread_id: Optional[str] = None,
+                      on_delta: Optional[Callable[[str], Any]] = None) -> TurnResult:
+        """Create a thread and run the agent's opening turn."""
+        thread_id = thread_id or str(uuid.uuid4())
+        owner = self._lease_owner()
+        self.leases.acquire(thread_id, owner, create=True)
+        try:
+            return self._turn(thread_id, owner, 0, {"messages": [], "step": intake.FIRST_NODE}, on_delta)
+        except BaseException:
+            self.end_session(thread_id)
+            raise
+
+    def run_turn(self, thread_id: str, text: str, expected_version: Optional[int] = None,
+                 on_delta: Optional[Callable[[str], Any]] = None) -> TurnResult:
+        """
+        Run one patient turn on the thread. ``on_delta`` is called with each
+        piece of the reply text as it streams in.
+        """
+        owner = self._lease_owner()
+        version = self.leases.acquire(thread_id, owner, expected_version)
+        return self._turn(thread_id, owner, version, {"messages": [HumanMessage(content=text)]}, on_delta)
+
+    def end_session(self, thread_id: str):
+        """Delete the thread's checkpoints and its version row."""
+        self.checkpointer.delete_thread(thread_id)
+        self.leases.delete(thread_id)
+
+    def get_session(self, thread_id: str) -> Dict[str, Any]:
+        """Return version, step, finished flag and record of a thread."""
+        version = self.leases.version(thread_id)
+        if version is None:
+            raise SessionClosedError(f"Unknown session {thread_id}")
+        values = self.graph.get_state({"configurable": {"thread_id": thread_id}}).values
+        return {
+            "thread_id": thread_id,
+            "version": version,
+            "step": values.get("step", intake.FIRST_NODE),
+            "record": intake.current_record(values),
+            "messages": len(values.get("messages", [])),
+        }
+
+    async def astart_session(self, thread_id: Optional[str] = None, on_delta=None) -> TurnResult:
+        return await asyncio.to_thread(self.start_session, thread_id, on_delta)
+
+    async def arun_turn(self, thread_id: str, text: str, expected_version: Optional[int] = None,
+                        on_delta=None) -> TurnResult:
+        """Async run_turn; the turn runs on a thread, so on_delta is called from that thread."""
+        return await asyncio.to_thread(self.run_turn, thread_id, text, expected_version, on_delta)
+
+    def _lease_owner(self) -> str:
+        # Unique per turn, so a later turn of this same worker never inherits a lost lease.
+        return f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+
+    def _turn(self, thread_id: str, owner: str, version: int, payload: Dict[str, Any],
+              on_delta: Optional[Callable[[str], Any]]) -> TurnResult:
+        config = {"configurable": {"thread_id": thread_id, LEASE_OWNER_KEY: owner}}
+        completed = False
+        finished = False
+        try:
+            with log_context(thread_id=thread_id):
+                start = time.perf_counter()
+                first_token_latency = None
+                last_message = None
+                step = None
+                for mode, update in self.graph.stream(payload, config=config, stream_mode=["updates", "custom"]):
+                    if mode == "custom":
+                        if first_token_latency is None:
+                            first_token_latency = time.perf_counter() - start
+                        if on_delta is not None:
+                            on_delta(update["delta"])
+                        continue
+                    node_output = next(iter(update.values()))
+                    if node_output and node_output.get("messages"):
+                        last_message = node_output["messages"][-1]
+                    if node_output and node_output.get("step"):
+                        step = node_output["step"]
+                latency = time.perf_counter() - start
+                if last_message is None:
+                    raise RuntimeError(f"Turn produced no message for thread {thread_id}")
+                if step is None:
+                    step = self.graph.get_state(config).values.get("step", intake.FIRST_NODE)
+                parsed = intake.parse_output(last_message)
+                finished = intake.is_finished(step, parsed["status"])
+                completed = True
+                logger.info("turn=%d step=%d status=%s latency=%.3fs worker=%s",
+                            version, step, parsed["status"], latency, self.worker_id)
+        finally:
+            new_version = self.leases.release(thread_id, owner, completed, finished)
+        return TurnResult(
+            thread_id=thread_id,
+            turn=version,
+            version=new_version,
+            step=step,
+            response=parsed["response"],
+            status=parsed["status"],
+            medical_history=parsed["medical_history"],
+            latency=latency,
+            first_token_latency=first_token_latency,
+            finished=finished,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run one intake turn on a shared session database.")
+    parser.add_argument("--db", help=f"session database (default: ${intake.CHECKPOINT_DB_ENV})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    start = commands.add_parser("start", help="create a session and print the opening turn")
+    start.add_argument("thread_id", nargs="?")
+    turn = commands.add_parser("turn", help="send one patient message")
+    turn.add_argument("thread_id")
+    turn.add_argument("text")
+    turn.add_argument("--expected-version", type=int)
+    args = parser.parse_args(argv)
+
+    worker = IntakeWorker(args.db)
+    try:
+        if args.command == "start":
+            result = worker.start_session(args.thread_id)
+        else:
+            result = worker.run_turn(args.thread_id, args.text, args.expected_version)
+    except (ConcurrentTurnError, SessionClosedError) as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    finally:
+        worker.close()
+    print(result.model_dump_json())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Phrase table for the crisis screen (intake_crisis.py): run with ``python -m pytest``."""
+import pytest
+
+from langchain_core.messages import HumanMessage
+
+from intake_crisis import ACUTE_FACTORS, CRISIS_PHRASES, crisis_stop_turn, screen
+
+
+# (message, factor expected among the matched and the acute factors)
+ESCALATE = [
+    ("I want to die", "active_suicidal_ideation"),
+    ("I can't sleep and I want to die", "active_suicidal_ideation"),
+    ("I can't do this, I want to die", "active_suicidal_ideation"),
+    ("Honestly I have been thinking about killing myself", "active_suicidal_ideation"),
+    ("I'm not okay. I'm suicidal", "active_suicidal_ideation"),
+    ("I told her I want to kill myself", "active_suicidal_ideation"),
+    ("My mom passed away and I want to end my life", "active_suicidal_ideation"),
+    ("No I want to die", "active_suicidal_ideation"),
+    ("I can't cope I want to die", "active_suicidal_ideation"),
+    ("I can't sleep I want to die", "active_suicidal_ideation"),
+    ("I don't know I want to die", "active_suicidal_ideation"),
+    ("I wish I was dead", "passive_suicidal_ideation"),
+    ("Everyone would be better off dead, me included", "passive_suicidal_ideation"),
+    ("I wish I could go to sleep and never wake up", "passive_suicidal_ideation"),
+    ("Some nights I hope to never wake up", "passive_suicidal_ideation"),
+    ("I don't want to live anymore", "passive_suicidal_ideation"),
+    ("Last month I tried to kill myself", "suicidal_behavior"),
+    ("I overdosed in March", "suicidal_behavior"),
+    ("I have been saving up pills", "preparatory_suicide_actions"),
+    ("I wrote a goodbye letter", "preparatory_suicide_actions"),
+]
+
+# Matched, but only flagged for the model: negated or about someone else.
+FLAG_ONLY = [
+    ("I'm not suicidal", "active_suicidal_ideation"),
+    ("I never wanted to kill myself", "active_suicidal_ideation"),
+    ("I don't feel suicidal", "active_suicidal_ideation"),
+    ("I don't want to die", "active_suicidal_ideation"),
+    ("My brother was suicidal last year", "active_suicidal_ideation"),
+    ("My friend tried to kill himself, he is okay now", None),
+    ("She attempted suicide when she was young", "suicidal_behavior"),
+    ("I can't sleep", "lack_of_sleep"),
+    ("I feel hopeless about work", "hopelessness"),
+    ("I've been cutting myself", "non_suicidal_self_injury"),
+]
+
+NO_MATCH = [
+    "",
+    "I'm doing fine, thanks",
+    "I never wake up rested",
+    "I do not wake up easily in the morning",
+    "My job is killing me",
+    "I'm dying to see the new movie",
+    "I take sertraline 50mg",
+]
+
+
+@pytest.mark.parametrize("text,factor", ESCALATE)
+def test_escalates(text, factor):
+    result = screen(text)
+    assert factor in result.factors
+    assert factor in result.acute
+    assert result.escalate
+
+
+@pytest.mark.parametrize("text,factor", FLAG_ONLY)
+def test_flags_without_escalating(text, factor):
+    result = screen(text)
+    if factor is not None:
+        assert factor in result.factors
+    assert not result.escalate
+
+
+@pytest.mark.parametrize("text", NO_MATCH)
+def test_no_match(text):
+    assert screen(text).factors == ()
+
+
+def test_every_factor_has_phrases():
+    assert all(CRISIS_PHRASES[factor] for factor in ACUTE_FACTORS)
+
+
+def test_stop_turn_replies_only_on_escalation():
+    assert crisis_stop_turn([HumanMessage("I want to die")], {}) is not None
+    assert crisis_stop_turn([HumanMessage("My brother was suicidal last year")], {}) is None
+    assert crisis_stop_turn([], {}) is None
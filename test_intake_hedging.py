@@ -0,0 +1,108 @@
+"""Deadlines of stage LLM calls (intake_hedging.py): run with ``python -m pytest``."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+import ai_intake_system as intake
+import intake_hedging
+from intake_hedging import DeadlineExceeded, HedgeLost, HedgePolicy, configure_hedging
+from intake_llm import ScriptedChatModel, default_script
+
+
+class SlowModel(ScriptedChatModel):
+    """Replay model that stalls before its first chunk (or its whole reply)."""
+    stall: float = 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.stall)
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.stall)
+        yield from super()._stream(messages, stop, run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.stall)
+        async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+            yield chunk
+
+
+def reply_after(seconds, claim_at=None):
+    """An attempt replying after ``seconds``, claiming the reply after ``claim_at`` (default: on return)."""
+    def attempt(ticket):
+        if claim_at is not None:
+            time.sleep(claim_at)
+            if not ticket.claim():
+                raise HedgeLost()
+            time.sleep(seconds - claim_at)
+        else:
+            time.sleep(seconds)
+            if not ticket.claim():
+                raise HedgeLost()
+        return "reply"
+    return attempt
+
+
+def timed(func, *args):
+    start = time.monotonic()
+    try:
+        return func(*args), time.monotonic() - start
+    except DeadlineExceeded:
+        return None, time.monotonic() - start
+
+
+def test_sync_call_stops_waiting_at_deadline():
+    result, elapsed = timed(HedgePolicy(deadline=0.2).call, 150, reply_after(1.0))
+    assert result is None
+    assert elapsed < 0.5
+
+
+def test_sync_call_keeps_reply_claimed_before_deadline():
+    result, elapsed = timed(HedgePolicy(deadline=0.2).call, 150, reply_after(0.5, claim_at=0.05))
+    assert result == "reply"
+    assert elapsed >= 0.5
+
+
+def test_sync_call_without_deadline_runs_inline():
+    callers = []
+    HedgePolicy(deadline=None).call(150, lambda ticket: callers.append(threading.current_thread()))
+    assert callers == [threading.current_thread()]
+
+
+def test_async_call_stops_waiting_at_deadline():
+    async def attempt(ticket):
+        await asyncio.sleep(1.0)
+        return "reply"
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(HedgePolicy(deadline=0.2).acall(150, attempt))
+    assert time.monotonic() - start < 0.5
+
+
+@pytest.fixture
+def slow_graph(monkeypatch):
+    """A graph whose model stalls 3s before replying, with a 0.5s stage deadline."""
+    for name in ("_llm", "_llm_with_tool"):
+        monkeypatch.setattr(intake, name, getattr(intake, name))
+    monkeypatch.setattr(intake, "_tier_llms", {})
+    monkeypatch.setattr(intake, "_stage_llms", {})
+    monkeypatch.setattr(intake_hedging, "_policy", intake_hedging._policy)
+    intake.configure_llm(SlowModel(script=default_script(), stall=3.0))
+    configure_hedging(HedgePolicy(deadline=0.5))
+    return intake.build_workflow().compile(checkpointer=MemorySaver())
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_graph_invoke_answers_with_fallback_on_time(slow_graph, monkeypatch, stream):
+    monkeypatch.setattr(intake, "STREAM_LLM", stream)
+    start = time.monotonic()
+    state = slow_graph.invoke({"messages": [], "step": 150},
+                              {"configurable": {"thread_id": f"slow-{stream}"}})
+    assert time.monotonic() - start < 1.5
+    last = state["messages"][-1]
+    assert isinstance(last, AIMessage) and last.response_metadata.get("fallback") == "deadline"
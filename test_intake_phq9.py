@@ -0,0 +1,121 @@
+"""Tables for the PHQ-9 fast path (intake_phq9.py): run with ``python -m pytest``."""
+import json
+
+import pytest
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from intake_phq9 import FREQUENCY_LABELS, SELF_HARM_ITEM, code_answer, phq9_turn, question, severity
+
+
+def record_for(codes):
+    """Record with the given {item: code} PHQ-9 answers."""
+    return {"phq9_responses": [{"question_number": item, "answer": FREQUENCY_LABELS[code]}
+                               for item, code in codes.items()]}
+
+
+def codes_for(total):
+    """Answers to all nine items adding up to ``total``, with item 9 at 0."""
+    codes = {}
+    for item in range(1, 10):
+        codes[item] = 0 if item == SELF_HARM_ITEM else min(3, total)
+        total -= codes[item]
+    return codes
+
+
+def asked(item, text="I'll ask."):
+    return AIMessage(content=json.dumps({"response": text}), response_metadata={"phq9_item": item})
+
+
+def reply(message):
+    return json.loads(message.content)
+
+
+# (total score, severity): the band boundaries.
+SEVERITIES = [
+    (0, "low"),
+    (9, "low"),
+    (10, "moderate"),
+    (19, "moderate"),
+    (20, "severe"),
+    (24, "severe"),
+]
+
+# (patient answer, code); None means the turn goes to the LLM.
+ANSWERS = [
+    ("0", 0),
+    ("3", 3),
+    ("Not at all.", 0),
+    ("several days", 1),
+    ("More-than-half the days", 2),
+    ("most days", 2),
+    ("Nearly every day!", 3),
+    ("everyday", 3),
+    ("4", None),
+    ("", None),
+    ("sometimes, I guess", None),
+    ("not sure", None),
+    ("several days, but worse lately", None),
+    (2, None),
+    (None, None),
+]
+
+
+@pytest.mark.parametrize("total,expected", SEVERITIES)
+def test_severity_bands(total, expected):
+    assert severity(total) == expected
+
+
+@pytest.mark.parametrize("total,expected", SEVERITIES)
+def test_confirmed_summary_completes_with_band(total, expected):
+    window = [asked("confirm"), HumanMessage("Yes, that's correct")]
+    result = reply(phq9_turn(window, record_for(codes_for(total))))
+    assert result["status"] == "complete"
+    assert result["medical_history"]["depression_severity"] == expected
+
+
+@pytest.mark.parametrize("text,code", ANSWERS)
+def test_code_answer(text, code):
+    assert code_answer(text) == code
+
+
+@pytest.mark.parametrize("text,code", [(text, code) for text, code in ANSWERS if isinstance(text, str)])
+def test_answer_turn(text, code):
+    message = phq9_turn([asked(1), HumanMessage(text)], {})
+    if code is None:
+        assert message is None
+    else:
+        result = reply(message)
+        assert result["medical_history"]["phq9_responses"] == [
+            {"question_number": 1, "answer": FREQUENCY_LABELS[code]}]
+        assert message.response_metadata["phq9_item"] == 2
+
+
+@pytest.mark.parametrize("text", ["several days", "more than half the days", "nearly every day", "1"])
+def test_nonzero_self_harm_answer_defers_to_llm(text):
+    codes = {item: 0 for item in range(1, 9)}
+    assert phq9_turn([asked(SELF_HARM_ITEM), HumanMessage(text)], record_for(codes)) is None
+
+
+def test_zero_self_harm_answer_reads_back_summary():
+    codes = {item: 1 for item in range(1, 9)}
+    message = phq9_turn([asked(SELF_HARM_ITEM), HumanMessage("not at all")], record_for(codes))
+    assert message.response_metadata["phq9_item"] == "confirm"
+    assert "total score is 8" in reply(message)["response"]
+
+
+def test_opening_turn_asks_first_unanswered_item():
+    assert reply(phq9_turn([HumanMessage("ok")], {}))["response"] == question(1, opening=True)
+    assert phq9_turn([HumanMessage("ok")], record_for({1: 0, 2: 1})).response_metadata["phq9_item"] == 3
+    assert phq9_turn([], record_for(codes_for(5))) is None
+
+
+@pytest.mark.parametrize("text", ["no, item 3 was wrong", "wait", "yes but change item 2"])
+def test_unconfirmed_summary_defers_to_llm(text):
+    assert phq9_turn([asked("confirm"), HumanMessage(text)], record_for(codes_for(12))) is None
+
+
+def test_summary_with_free_text_answer_defers_to_llm():
+    record = record_for(codes_for(12))
+    record["phq9_responses"][0]["answer"] = "on and off"
+    assert phq9_turn([asked("confirm"), HumanMessage("yes")], record) is None
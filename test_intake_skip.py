@@ -0,0 +1,84 @@
+"""Stage skipping (intake_skip.py) through the graph router: run with ``python -m pytest``."""
+import json
+
+import pytest
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from ai_intake_system import COMPLETE, END, STAGES, build_workflow, confirm_flow, make_router, node_name, \
+    stage_prompt
+from intake_skip import CONFIRM, SKIP, SkipPolicy
+
+
+TRANSITIONS = {150: 300, 300: 500, 500: 600, 600: 700, 700: None}
+MEDICATIONS = [{"name": "sertraline", "dose": "50mg"}]
+PROCEDURES = [{"name": "appendectomy"}]
+
+
+def completed(step, record):
+    content = json.dumps({"response": "Thanks.", "status": COMPLETE, "medical_history": {}})
+    return {"messages": [AIMessage(content=content)], "step": step, "record": record}
+
+
+def router(modes):
+    keys = {500: ("medications", "current medications"), 600: ("procedures", "medical procedures")}
+    skips = {stage: SkipPolicy(*keys[stage], mode=mode) for stage, mode in modes.items()}
+    return make_router(TRANSITIONS, stop_stage=700, skips=skips)
+
+
+# (skip modes, record, stage entered after stage 300 completes)
+ROUTES = [
+    ({500: SKIP}, {"medications": MEDICATIONS}, 600),
+    ({500: SKIP}, {}, 500),
+    ({500: SKIP}, {"medications": []}, 500),
+    ({500: CONFIRM}, {"medications": MEDICATIONS}, 500),
+    ({500: SKIP, 600: SKIP}, {"medications": MEDICATIONS, "procedures": PROCEDURES}, 700),
+    ({500: SKIP, 600: SKIP}, {"medications": MEDICATIONS}, 600),
+    ({500: SKIP, 600: CONFIRM}, {"medications": MEDICATIONS, "procedures": PROCEDURES}, 600),
+]
+
+
+@pytest.mark.parametrize("modes,record,expected", ROUTES)
+def test_router_skips_answered_stages(modes, record, expected):
+    assert router(modes)(completed(300, record)) == node_name(expected)
+
+
+def test_router_skips_to_end():
+    get_state = make_router({500: 600, 600: None}, stop_stage=500,
+                            skips={600: SkipPolicy("procedures", "medical procedures", SKIP)})
+    assert get_state(completed(500, {"procedures": PROCEDURES})) == END
+
+
+def test_default_registry_only_confirms():
+    assert {stage.skip.mode for stage in STAGES if stage.skip is not None} == {CONFIRM}
+
+
+def test_workflow_wires_edges_past_skip_stages():
+    stages = [stage._replace(skip=stage.skip._replace(mode=SKIP)) if stage.id == 500 else stage
+              for stage in STAGES]
+    graph = build_workflow(stages).compile()
+    targets = {edge.target for edge in graph.get_graph().edges if edge.source == node_name(400)}
+    assert {node_name(500), node_name(600)} <= targets
+
+
+def stage_reply(stage, **metadata):
+    return AIMessage(content=json.dumps({"response": "Is that right?"}), response_metadata={"stage": stage, **metadata})
+
+
+# (stage 500 messages so far, confirm flow step)
+CONFIRM_TURNS = [
+    ([], "first"),
+    ([stage_reply(500, skip=CONFIRM), HumanMessage("yes, and ibuprofen")], "followup"),
+    ([stage_reply(500, skip=CONFIRM), HumanMessage("and"), stage_reply(500), HumanMessage("that's all")],
+     "followup"),
+    ([stage_reply(500), HumanMessage("sertraline")], None),
+]
+
+
+@pytest.mark.parametrize("window,expected", CONFIRM_TURNS)
+def test_confirm_note_lasts_whole_confirm_flow(window, expected):
+    stage = next(stage for stage in STAGES if stage.id == 500)
+    state = {"messages": [stage_reply(400), HumanMessage("ok")] + window, "record": {"medications": MEDICATIONS}}
+    confirming = confirm_flow(stage, state)
+    assert confirming == expected
+    assert ("Already reported" in stage_prompt(stage, state, confirming=confirming)) == (expected is not None)